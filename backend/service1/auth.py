@@ -2,7 +2,7 @@ import os
 import re
 import time
 import threading
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from fastapi import APIRouter, HTTPException, Depends, Request, Response, status, Body
 from fastapi.security import OAuth2, OAuth2PasswordRequestForm
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
@@ -106,6 +106,127 @@ def _clear_rate_limit(ip: str):
         _login_attempts.pop(ip, None)
 
 
+# ---------------------------------------------------------------------------
+# Principal-cache (TTL + LRU)
+# Hver autentificeret request slog tidligere User/Client op i DB efter JWT-decode.
+# Cachen gemmer et løsrevet snapshot af principal'en pr. (subject, token-iat),
+# og hvert opslag får en frisk transient kopi, så requests aldrig deler objekt.
+# Ændringer af rolle, aktiv-status, kodeord og client-secret invaliderer via
+# invalidate_user_principal() / invalidate_client_principal().
+# ---------------------------------------------------------------------------
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "2048"))
+
+_principal_lock = threading.Lock()
+# (kind, subject, iat) -> (udløb monotonic, snapshot-dict)
+_principal_cache: "OrderedDict[tuple, tuple[float, dict]]" = OrderedDict()
+# (kind, subject) -> nøgler, så invalidation ikke skal scanne hele cachen
+_principal_index: dict[tuple, set] = defaultdict(set)
+_principal_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+
+def _principal_cache_key(kind: str, subject, payload: dict) -> tuple:
+    # Ældre tokens uden iat falder tilbage til exp, som også er unik pr. token.
+    return (kind, str(subject), payload.get("iat", payload.get("exp")))
+
+
+def _principal_cache_drop(key: tuple) -> None:
+    _principal_cache.pop(key, None)
+    keys = _principal_index.get(key[:2])
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            _principal_index.pop(key[:2], None)
+
+
+def _principal_cache_get(key: tuple, model):
+    if PRINCIPAL_CACHE_TTL_SECONDS <= 0:
+        return None
+    now = time.monotonic()
+    with _principal_lock:
+        entry = _principal_cache.get(key)
+        if entry is None:
+            _principal_stats["misses"] += 1
+            return None
+        expires_at, snapshot = entry
+        if expires_at <= now:
+            _principal_cache_drop(key)
+            _principal_stats["misses"] += 1
+            return None
+        _principal_cache.move_to_end(key)
+        _principal_stats["hits"] += 1
+    return model(**snapshot)
+
+
+def _principal_cache_put(key: tuple, principal) -> None:
+    if PRINCIPAL_CACHE_TTL_SECONDS <= 0:
+        return
+    snapshot = principal.model_dump()
+    with _principal_lock:
+        _principal_cache[key] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, snapshot)
+        _principal_cache.move_to_end(key)
+        _principal_index[key[:2]].add(key)
+        while len(_principal_cache) > PRINCIPAL_CACHE_MAX_ENTRIES:
+            oldest = next(iter(_principal_cache))
+            _principal_cache_drop(oldest)
+            _principal_stats["evictions"] += 1
+
+
+def _invalidate_principal(kind: str, subject) -> None:
+    with _principal_lock:
+        for key in list(_principal_index.get((kind, str(subject)), ())):
+            _principal_cache_drop(key)
+        _principal_stats["invalidations"] += 1
+
+
+def invalidate_user_principal(username: Optional[str]) -> None:
+    """Kaldes efter rolleskift, deaktivering, kodeordsskift og sletning af bruger."""
+    if username:
+        _invalidate_principal("user", username)
+
+
+def invalidate_client_principal(client_id: Optional[int]) -> None:
+    """Kaldes efter revoke/rotate af client-secret og sletning af klient."""
+    if client_id is not None:
+        _invalidate_principal("client", int(client_id))
+
+
+def principal_cache_stats() -> dict:
+    with _principal_lock:
+        return {
+            "ttl_seconds": PRINCIPAL_CACHE_TTL_SECONDS,
+            "max_entries": PRINCIPAL_CACHE_MAX_ENTRIES,
+            "entries": len(_principal_cache),
+            **_principal_stats,
+        }
+
+
+def _lookup_user(payload: dict, session: Session) -> Optional[User]:
+    """Aktiv eller inaktiv bruger for token-payload; kalderen afgør fejlkoden."""
+    username = payload.get("sub")
+    if not username:
+        return None
+    key = _principal_cache_key("user", username, payload)
+    user = _principal_cache_get(key, User)
+    if user is not None:
+        return user
+    user = session.exec(select(User).where(User.username == username)).first()
+    if user is not None:
+        _principal_cache_put(key, user)
+    return user
+
+
+def _lookup_client(client_id: int, payload: dict, session: Session) -> Optional[Client]:
+    key = _principal_cache_key("client", client_id, payload)
+    client = _principal_cache_get(key, Client)
+    if client is not None:
+        return client
+    client = session.get(Client, client_id)
+    if client is not None:
+        _principal_cache_put(key, client)
+    return client
+
+
 # ---------------------------------------------------------------------------
 
 def validate_password_strength(password: str):
@@ -137,10 +258,12 @@ def authenticate_user(username: str, password: str, session: Session):
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (
+    now = datetime.now(timezone.utc)
+    expire = now + (
         expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    to_encode.update({"exp": expire})
+    # iat indgår i principal-cachens nøgle, så et nyt token altid slår op i DB.
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -277,7 +400,7 @@ def get_me(
             raise credentials_exception
     except InvalidTokenError:
         raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         raise credentials_exception
     return {
@@ -313,7 +436,7 @@ def get_current_client(
     client_id = payload.get("client_id")
     if client_id is None:
         raise HTTPException(status_code=401, detail="Ugyldigt klient-token")
-    client = session.get(Client, int(client_id))
+    client = _lookup_client(int(client_id), payload, session)
     if not client or client.client_secret_revoked_at is not None:
         raise HTTPException(status_code=401, detail="Klienten er ukendt eller revoked")
     return client
@@ -328,7 +451,7 @@ def get_current_user_or_client(
         client_id = payload.get("client_id")
         if client_id is None:
             raise HTTPException(status_code=401, detail="Ugyldigt klient-token")
-        client = session.get(Client, int(client_id))
+        client = _lookup_client(int(client_id), payload, session)
         if not client or client.client_secret_revoked_at is not None:
             raise HTTPException(status_code=401, detail="Klienten er ukendt eller revoked")
         return client
@@ -336,7 +459,7 @@ def get_current_user_or_client(
     username: str = payload.get("sub")
     if username is None:
         raise HTTPException(status_code=401, detail="Ugyldigt bruger-token")
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         raise HTTPException(status_code=403, detail="Inaktiv eller ukendt bruger")
     return user
@@ -374,7 +497,7 @@ def get_current_admin_user(
     except InvalidTokenError:
         raise credentials_exception
 
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         raise credentials_exception
     if not user.is_admin:
@@ -400,7 +523,7 @@ def get_current_superadmin_user(
     except InvalidTokenError:
         raise credentials_exception
 
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         raise credentials_exception
     if not user.is_superadmin:
@@ -425,7 +548,7 @@ def get_current_user(
     except InvalidTokenError:
         raise credentials_exception
 
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         raise HTTPException(status_code=403, detail="Inaktiv eller ukendt bruger")
     return user
@@ -471,7 +594,7 @@ def verify_ws_token(token: str, session: Session) -> Optional[Union[User, Client
             client_id = int(client_id)
         except (TypeError, ValueError):
             return None
-        client = session.get(Client, client_id)
+        client = _lookup_client(client_id, payload, session)
         if not client or client.client_secret_revoked_at is not None:
             return None
         return client
@@ -479,7 +602,7 @@ def verify_ws_token(token: str, session: Session) -> Optional[Union[User, Client
     username: str = payload.get("sub")
     if not username:
         return None
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = _lookup_user(payload, session)
     if not user or not user.is_active:
         return None
     return user
@@ -0,0 +1,327 @@
+"""
+calendar_store.py
+
+Læs/skriv af klientkalendere i CalendarDay (én række pr. klient og dato).
+
+Tidligere lå hele sæsonen som én JSON-blob i CalendarMarking.markings (~365
+nøgler pr. klient). Både læsning af én uge og gem af én dag kostede derfor en
+hel sæson. Nu:
+- datovinduer læses med en range-query på (client_id, date),
+- gem skriver kun de dage der faktisk er ændret (upsert) og sletter fjernede,
+- dag-objektet ({"status", "onTime", "offTime", ...}) returneres i samme
+  format som før, så frontend og kiosk-agenter er uændrede.
+
+Upsert bruger ON CONFLICT (client_id, date) på PostgreSQL og SQLite; andre
+dialekter falder tilbage til delete + insert.
+
+apply_season_template() er bulk-motoren til "anvend sæsontider": én
+skabelon, én læsning for alle klienter og ét samlet upsert.
+"""
+
+from __future__ import annotations
+
+import time
+from datetime import date, datetime
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import and_, delete, not_, select
+
+from models import CalendarDay
+
+DAY_KEY_FORMAT = "%Y-%m-%dT00:00:00"
+_VALUE_COLUMNS = ("season", "status", "on_time", "off_time", "extra")
+# Begræns antal parametre pr. IN (...) ved sletning.
+_DELETE_CHUNK = 500
+
+
+def parse_day_key(key: Any) -> Optional[date]:
+    """'2025-08-01' eller '2025-08-01T00:00:00' -> date. Ugyldige nøgler -> None."""
+    try:
+        return datetime.fromisoformat(str(key)).date()
+    except (ValueError, TypeError):
+        return None
+
+
+def format_day_key(day: date) -> str:
+    return day.strftime(DAY_KEY_FORMAT)
+
+
+def entry_to_values(entry: Any) -> dict[str, Any]:
+    """Frontendens dag-objekt -> kolonneværdier (ukendte nøgler lægges i extra)."""
+    if not isinstance(entry, dict):
+        return {"status": None if entry is None else str(entry), "on_time": None, "off_time": None, "extra": None}
+    extra = {k: v for k, v in entry.items() if k not in {"status", "onTime", "offTime"}}
+    return {
+        "status": entry.get("status"),
+        "on_time": entry.get("onTime"),
+        "off_time": entry.get("offTime"),
+        "extra": extra or None,
+    }
+
+
+def values_to_entry(status, on_time, off_time, extra) -> dict[str, Any]:
+    entry: dict[str, Any] = dict(extra or {})
+    entry["status"] = status
+    if on_time is not None:
+        entry["onTime"] = on_time
+    if off_time is not None:
+        entry["offTime"] = off_time
+    return entry
+
+
+def build_rows(client_id: int, season: str, markings: dict[str, Any]) -> dict[date, dict[str, Any]]:
+    """markedDays-dict -> {dato: række}. Nøgler der ikke er ISO-datoer ignoreres."""
+    rows: dict[date, dict[str, Any]] = {}
+    for key, entry in (markings or {}).items():
+        day = parse_day_key(key)
+        if day is None:
+            continue
+        rows[day] = {"client_id": client_id, "date": day, "season": season, **entry_to_values(entry)}
+    return rows
+
+
+def template_rows(client_id: int, season: str, template: dict[date, dict[str, Any]]) -> list[dict[str, Any]]:
+    """{dato: dag-objekt} (fx SeasonCalendar.template) -> rækker for én klient."""
+    return [
+        {"client_id": client_id, "date": day, "season": season, **entry_to_values(entry)}
+        for day, entry in template.items()
+    ]
+
+
+# -- læsning -------------------------------------------------------------------
+
+def read_days(
+    session,
+    client_id: int,
+    *,
+    season: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> dict[str, dict[str, Any]]:
+    """Returnerer {"YYYY-MM-DDT00:00:00": dag-objekt} for klienten i vinduet."""
+    table = CalendarDay.__table__
+    stmt = select(
+        table.c.date, table.c.status, table.c.on_time, table.c.off_time, table.c.extra
+    ).where(table.c.client_id == client_id)
+    if season is not None:
+        stmt = stmt.where(table.c.season == season)
+    if start is not None:
+        stmt = stmt.where(table.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.date <= end)
+    stmt = stmt.order_by(table.c.date)
+    return {
+        format_day_key(row.date): values_to_entry(row.status, row.on_time, row.off_time, row.extra)
+        for row in session.connection().execute(stmt)
+    }
+
+
+def season_has_days(session, client_id: int, season: str) -> bool:
+    table = CalendarDay.__table__
+    stmt = select(table.c.id).where(table.c.client_id == client_id, table.c.season == season).limit(1)
+    return session.connection().execute(stmt).first() is not None
+
+
+# -- skrivning -----------------------------------------------------------------
+
+def _dialect_insert(conn):
+    name = conn.dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(CalendarDay.__table__)
+
+
+def upsert_rows(session, rows: list[dict[str, Any]]) -> int:
+    """Indsæt eller opdatér rækker på (client_id, date). Returnerer antal rækker."""
+    if not rows:
+        return 0
+    conn = session.connection()
+    ins = _dialect_insert(conn)
+    if ins is not None:
+        stmt = ins.on_conflict_do_update(
+            index_elements=["client_id", "date"],
+            set_={col: ins.excluded[col] for col in _VALUE_COLUMNS},
+        )
+        conn.execute(stmt, rows)
+        return len(rows)
+
+    table = CalendarDay.__table__
+    by_client: dict[int, list[date]] = {}
+    for row in rows:
+        by_client.setdefault(row["client_id"], []).append(row["date"])
+    for client_id, days in by_client.items():
+        _delete_days(conn, client_id, days)
+    conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+def insert_missing_rows(session, rows: list[dict[str, Any]]) -> None:
+    """Indsæt rækker, men lad eksisterende dage være (ON CONFLICT DO NOTHING)."""
+    if not rows:
+        return
+    conn = session.connection()
+    ins = _dialect_insert(conn)
+    if ins is not None:
+        conn.execute(ins.on_conflict_do_nothing(index_elements=["client_id", "date"]), rows)
+        return
+    table = CalendarDay.__table__
+    client_ids = {row["client_id"] for row in rows}
+    existing = {
+        (r.client_id, r.date)
+        for r in conn.execute(
+            select(table.c.client_id, table.c.date).where(
+                table.c.client_id.in_(client_ids),
+                table.c.date.in_({row["date"] for row in rows}),
+            )
+        )
+    }
+    missing = [row for row in rows if (row["client_id"], row["date"]) not in existing]
+    if missing:
+        conn.execute(table.insert(), missing)
+
+
+def _delete_days(conn, client_id: int, days: Iterable[date]) -> int:
+    table = CalendarDay.__table__
+    days = list(days)
+    deleted = 0
+    for i in range(0, len(days), _DELETE_CHUNK):
+        chunk = days[i:i + _DELETE_CHUNK]
+        result = conn.execute(
+            delete(table).where(and_(table.c.client_id == client_id, table.c.date.in_(chunk)))
+        )
+        deleted += result.rowcount or 0
+    return deleted
+
+
+def save_season(
+    session,
+    client_id: int,
+    season: str,
+    markings: dict[str, Any],
+    *,
+    partial: bool = False,
+) -> dict[str, int]:
+    """
+    Gem markedDays for én klient og sæson.
+
+    partial=False: sæsonen erstattes (dage der ikke er med slettes), men kun
+    ændrede dage skrives. partial=True: de medsendte dage upsertes, resten
+    røres ikke.
+    """
+    wanted = build_rows(client_id, season, markings)
+    if partial:
+        return {"upserted": upsert_rows(session, list(wanted.values())), "deleted": 0, "unchanged": 0}
+
+    table = CalendarDay.__table__
+    conn = session.connection()
+    existing = {
+        row.date: {"season": row.season, "status": row.status, "on_time": row.on_time,
+                   "off_time": row.off_time, "extra": row.extra}
+        for row in conn.execute(
+            select(
+                table.c.date, table.c.season, table.c.status, table.c.on_time,
+                table.c.off_time, table.c.extra,
+            ).where(table.c.client_id == client_id, table.c.season == season)
+        )
+    }
+    changed = [
+        row for day, row in wanted.items()
+        if existing.get(day) != {col: row[col] for col in _VALUE_COLUMNS}
+    ]
+    removed = [day for day in existing if day not in wanted]
+    deleted = _delete_days(conn, client_id, removed) if removed else 0
+    upserted = upsert_rows(session, changed)
+    return {"upserted": upserted, "deleted": deleted, "unchanged": len(wanted) - len(changed)}
+
+
+def apply_season_template(
+    session,
+    client_ids: list[int],
+    season: str,
+    template: dict[date, dict[str, Any]],
+) -> dict[str, Any]:
+    """
+    Erstat sæsonen for mange klienter med samme dag-skabelon.
+
+    template er {dato: dag-objekt} og bygges én gang af kalderen. Eksisterende
+    dage for alle klienter hentes i én query; kun afvigende dage upsertes i ét
+    samlet executemany, og dage uden for skabelonen slettes med én DELETE.
+    Returnerer tællinger og tid pr. fase i millisekunder.
+    """
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+
+    def _lap(phase: str) -> None:
+        nonlocal started
+        now = time.perf_counter()
+        timings[phase] = round((now - started) * 1000, 2)
+        started = now
+
+    template_values = {day: entry_to_values(entry) for day, entry in template.items()}
+    _lap("template_ms")
+
+    table = CalendarDay.__table__
+    conn = session.connection()
+    existing: dict[tuple[int, date], dict[str, Any]] = {}
+    stale = False
+    if client_ids:
+        for row in conn.execute(
+            select(
+                table.c.client_id, table.c.date, table.c.season, table.c.status,
+                table.c.on_time, table.c.off_time, table.c.extra,
+            ).where(table.c.client_id.in_(client_ids), table.c.season == season)
+        ):
+            if row.date not in template_values:
+                stale = True
+                continue
+            existing[(row.client_id, row.date)] = {
+                "season": row.season, "status": row.status, "on_time": row.on_time,
+                "off_time": row.off_time, "extra": row.extra,
+            }
+    _lap("fetch_ms")
+
+    changed = []
+    for client_id in client_ids:
+        for day, values in template_values.items():
+            wanted = {"season": season, **values}
+            if existing.get((client_id, day)) != wanted:
+                changed.append({"client_id": client_id, "date": day, **wanted})
+    _lap("diff_ms")
+
+    deleted = 0
+    if stale:
+        result = conn.execute(
+            delete(table).where(
+                table.c.client_id.in_(client_ids),
+                table.c.season == season,
+                not_(table.c.date.in_(list(template_values))),
+            )
+        )
+        deleted = result.rowcount or 0
+    upserted = upsert_rows(session, changed)
+    _lap("write_ms")
+
+    return {
+        "upserted": upserted,
+        "deleted": deleted,
+        "unchanged": len(client_ids) * len(template_values) - len(changed),
+        "timings_ms": timings,
+    }
+
+
+def delete_for_clients(session, client_ids: Iterable[int]) -> None:
+    client_ids = list(client_ids)
+    if not client_ids:
+        return
+    table = CalendarDay.__table__
+    session.connection().execute(delete(table).where(table.c.client_id.in_(client_ids)))
+
+
+def delete_season(session, season: str) -> int:
+    table = CalendarDay.__table__
+    result = session.connection().execute(delete(table).where(table.c.season == season))
+    return result.rowcount or 0
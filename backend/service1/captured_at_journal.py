@@ -0,0 +1,198 @@
+"""
+captured_at_journal.py
+
+Append-only journal for segmenternes captured_at-tidspunkter pr. livestream-klient.
+
+Tidligere læste _store_captured_at hele _captured_at.json fra disk, flettede,
+sorterede og skrev filen igen med indent=2 ved hvert segment-upload, og hvert
+manifest/last-segment-info læste den igen. Nu:
+
+- in-memory map pr. klient er sandheden; opslag rører ikke disken,
+- hvert upload tilføjer én linje "segment_navn<TAB>ISO-tid\\n" til
+  _captured_at.journal,
+- journalen komprimeres (atomisk temp+rename) når den har mere end
+  COMPACT_FACTOR gange så mange linjer som der gemmes entries, og ved cleanup,
+- ved første opslag efter genstart genindlæses journalen; en halvt skrevet
+  sidste linje springes over og filen komprimeres. En gammel _captured_at.json
+  læses med og fjernes efter migrering.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+JOURNAL_FILENAME = "_captured_at.journal"
+LEGACY_FILENAME = "_captured_at.json"
+COMPACT_FACTOR = 4
+
+
+def _to_iso(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+class CapturedAtJournal:
+    def __init__(
+        self,
+        dir_for: Callable[[str], str],
+        parse: Callable[[Optional[str]], Optional[datetime]],
+        extract_num: Callable[[str], int],
+        max_entries: int,
+    ):
+        self._dir_for = dir_for
+        self._parse = parse
+        self._extract_num = extract_num
+        self.max_entries = max_entries
+        self._maps: Dict[str, Dict[str, datetime]] = {}
+        self._journal_lines: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"appends": 0, "compactions": 0, "loads": 0, "skipped_lines": 0}
+
+    # -- offentlige operationer ------------------------------------------------
+    def get_map(self, client_id: str) -> Dict[str, datetime]:
+        with self._lock:
+            return dict(self._load(client_id))
+
+    def get(self, client_id: str, segment: str) -> Optional[datetime]:
+        with self._lock:
+            return self._load(client_id).get(segment)
+
+    def store(self, client_id: str, segment: str, dt: datetime) -> None:
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        dt = dt.astimezone(timezone.utc)
+        with self._lock:
+            entries = self._load(client_id)
+            entries[segment] = dt
+            if len(entries) > self.max_entries:
+                self._trim(entries)
+            try:
+                self._append(client_id, segment, dt)
+            except Exception as e:
+                print(f"[HLS] Kunne ikke skrive captured_at journal for client={client_id}: {e}")
+                return
+            if self._journal_lines.get(client_id, 0) > self.max_entries * COMPACT_FACTOR:
+                self._compact(client_id)
+
+    def retain(self, client_id: str, existing: Iterable[str]) -> None:
+        """Behold kun entries for segmenter der stadig findes, og komprimér."""
+        keep = set(existing)
+        with self._lock:
+            entries = self._load(client_id)
+            for name in [n for n in entries if n not in keep]:
+                del entries[name]
+            self._compact(client_id)
+
+    def drop(self, client_id: str) -> None:
+        """Glem klienten i hukommelsen (reset sletter selv filerne)."""
+        with self._lock:
+            self._maps.pop(client_id, None)
+            self._journal_lines.pop(client_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._maps),
+                "entries": sum(len(m) for m in self._maps.values()),
+                "journal_lines": sum(self._journal_lines.values()),
+                **self.stats_counters,
+            }
+
+    # -- intern (kaldes med self._lock) -----------------------------------------
+    def _paths(self, client_id: str) -> tuple[str, str]:
+        client_dir = self._dir_for(client_id)
+        return os.path.join(client_dir, JOURNAL_FILENAME), os.path.join(client_dir, LEGACY_FILENAME)
+
+    def _trim(self, entries: Dict[str, datetime]) -> None:
+        ordered = sorted(entries, key=self._extract_num)
+        for name in ordered[:-self.max_entries]:
+            del entries[name]
+
+    def _load(self, client_id: str) -> Dict[str, datetime]:
+        entries = self._maps.get(client_id)
+        if entries is not None:
+            return entries
+
+        entries = {}
+        needs_compact = False
+        journal_path, legacy_path = self._paths(client_id)
+
+        if os.path.exists(legacy_path):
+            try:
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                if isinstance(raw, dict):
+                    for seg, value in raw.items():
+                        dt = self._parse(str(value)) if isinstance(seg, str) else None
+                        if dt is not None:
+                            entries[seg] = dt
+            except Exception as e:
+                print(f"[HLS] Kunne ikke læse {legacy_path}: {e}")
+            needs_compact = True
+
+        lines = 0
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for raw_line in f:
+                    lines += 1
+                    # En linje uden \n er en afbrudt skrivning fra før et crash.
+                    if not raw_line.endswith("\n"):
+                        needs_compact = True
+                        self.stats_counters["skipped_lines"] += 1
+                        continue
+                    seg, sep, value = raw_line.rstrip("\n").partition("\t")
+                    dt = self._parse(value) if sep else None
+                    if not seg or dt is None:
+                        needs_compact = True
+                        self.stats_counters["skipped_lines"] += 1
+                        continue
+                    entries[seg] = dt
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[HLS] Kunne ikke læse {journal_path}: {e}")
+            needs_compact = True
+
+        if len(entries) > self.max_entries:
+            self._trim(entries)
+        self._maps[client_id] = entries
+        self._journal_lines[client_id] = lines
+        self.stats_counters["loads"] += 1
+
+        if needs_compact:
+            self._compact(client_id)
+            if os.path.exists(legacy_path):
+                try:
+                    os.remove(legacy_path)
+                except OSError:
+                    pass
+        return entries
+
+    def _append(self, client_id: str, segment: str, dt: datetime) -> None:
+        journal_path, _ = self._paths(client_id)
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        with open(journal_path, "a", encoding="utf-8", newline="\n") as f:
+            f.write(f"{segment}\t{_to_iso(dt)}\n")
+        self._journal_lines[client_id] = self._journal_lines.get(client_id, 0) + 1
+        self.stats_counters["appends"] += 1
+
+    def _compact(self, client_id: str) -> None:
+        entries = self._maps.get(client_id, {})
+        journal_path, _ = self._paths(client_id)
+        try:
+            os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+            tmp = f"{journal_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                for name in sorted(entries, key=self._extract_num):
+                    f.write(f"{name}\t{_to_iso(entries[name])}\n")
+            os.replace(tmp, journal_path)
+        except Exception as e:
+            print(f"[HLS] Kunne ikke komprimere captured_at journal for client={client_id}: {e}")
+            return
+        self._journal_lines[client_id] = len(entries)
+        self.stats_counters["compactions"] += 1
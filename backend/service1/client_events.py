@@ -0,0 +1,281 @@
+"""
+client_events.py
+
+In-process change bus for klient-status.
+
+ClientDetailsPage pollede tidligere GET /clients/{id}/chrome-status hvert
+sekund pr. åben fane. Nu abonnerer browseren på en SSE-strøm, og endpoints der
+ændrer klienten (heartbeat, update_chrome_status, set_chrome_command,
+update_client, ...) kalder blot client_change_bus.publish(client_id).
+
+Bussen:
+- læser rækken én gang pr. ændring (uanset antal abonnenter),
+- bygger payload via den loader som routers/clients.py registrerer,
+- sender kun de felter der har ændret sig til alle abonnenter af klienten,
+- genberegner payload periodisk uden DB-læsning, så isOnline kan skifte til
+  offline når last_seen bliver for gammel.
+
+publish() er trådsikker, fordi de fleste endpoints er sync og kører i
+FastAPI's threadpool. Klienter uden abonnenter koster kun et dict-opslag.
+
+ClientCommandSignals nederst bruges på samme måde til long-poll af
+chrome-command fra kiosk-agenterne.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Callable, Optional
+
+from db import _env_int
+
+SUBSCRIBER_QUEUE_SIZE = 32
+# Hvor ofte cached payloads genberegnes (fx isOnline → False) uden DB-kald.
+CLIENT_EVENTS_REFRESH_SECONDS = _env_int("CLIENT_EVENTS_REFRESH_SECONDS", 10, min_value=1)
+
+# loader(client_id) -> (view, payload) eller None hvis klienten ikke findes.
+# view er et objekt med klientens felter; payload er den JSON-klar dict.
+SnapshotLoader = Callable[[int], Optional[tuple[Any, dict[str, Any]]]]
+# builder(view) -> payload; bruges til periodisk genberegning uden DB.
+PayloadBuilder = Callable[[Any], dict[str, Any]]
+
+
+class Subscription:
+    def __init__(self, client_id: int):
+        self.client_id = client_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event: str, data: dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # Langsom browser: smid backloggen og bed om et fuldt snapshot.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(("resync", {}))
+
+
+class ClientChangeBus:
+    def __init__(self):
+        self._loader: Optional[SnapshotLoader] = None
+        self._builder: Optional[PayloadBuilder] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subs: dict[int, set[Subscription]] = {}
+        # Seneste view + payload pr. klient med abonnenter.
+        self._views: dict[int, Any] = {}
+        self._payloads: dict[int, dict[str, Any]] = {}
+        self._dirty: set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._subscribed_ids: frozenset[int] = frozenset()
+        self._ids_lock = threading.Lock()
+        self.stats_counters = {"published": 0, "reads": 0, "pushed": 0}
+
+    def configure(self, loader: SnapshotLoader, builder: PayloadBuilder) -> None:
+        self._loader = loader
+        self._builder = builder
+
+    # -- publisher side --------------------------------------------------------
+    def publish(self, client_id: int) -> None:
+        """Markér klienten som ændret. Må kaldes fra både event-loop og threadpool."""
+        if client_id not in self._subscribed_ids or self._loop is None:
+            return
+        self.stats_counters["published"] += 1
+        try:
+            self._loop.call_soon_threadsafe(self._mark_dirty, client_id)
+        except RuntimeError:
+            # Loopet er lukket (shutdown).
+            pass
+
+    def _mark_dirty(self, client_id: int) -> None:
+        self._dirty.add(client_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # -- subscriber side -------------------------------------------------------
+    async def subscribe(self, client_id: int) -> tuple[Subscription, Optional[dict[str, Any]]]:
+        """Registrér en abonnent og returnér (subscription, fuldt snapshot)."""
+        self._ensure_worker()
+        sub = Subscription(client_id)
+        self._subs.setdefault(client_id, set()).add(sub)
+        self._refresh_subscribed_ids()
+
+        snapshot = self._payloads.get(client_id)
+        if snapshot is None:
+            snapshot = await self._load(client_id)
+        return sub, snapshot
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.client_id)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            self._subs.pop(sub.client_id, None)
+            self._views.pop(sub.client_id, None)
+            self._payloads.pop(sub.client_id, None)
+            self._dirty.discard(sub.client_id)
+        self._refresh_subscribed_ids()
+
+    def snapshot(self, client_id: int) -> Optional[dict[str, Any]]:
+        return self._payloads.get(client_id)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "subscribed_clients": len(self._subs),
+            "subscribers": sum(len(s) for s in self._subs.values()),
+            **self.stats_counters,
+        }
+
+    # -- intern ---------------------------------------------------------------
+    def _refresh_subscribed_ids(self) -> None:
+        with self._ids_lock:
+            self._subscribed_ids = frozenset(self._subs)
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._worker = loop.create_task(self._run())
+
+    async def _load(self, client_id: int) -> Optional[dict[str, Any]]:
+        if self._loader is None:
+            return None
+        self.stats_counters["reads"] += 1
+        result = await asyncio.to_thread(self._loader, client_id)
+        if result is None:
+            return None
+        view, payload = result
+        if client_id in self._subs:
+            self._views[client_id] = view
+            self._payloads[client_id] = payload
+        return payload
+
+    def _fan_out(self, client_id: int, payload: dict[str, Any]) -> None:
+        previous = self._payloads.get(client_id) or {}
+        delta = {k: v for k, v in payload.items() if previous.get(k) != v}
+        self._payloads[client_id] = payload
+        if not delta:
+            return
+        for sub in list(self._subs.get(client_id, ())):
+            sub.push("change", delta)
+            self.stats_counters["pushed"] += 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_recompute = loop.time()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=CLIENT_EVENTS_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            # Tidsbaseret, så travle klienter ikke udsulter offline-skift for andre.
+            if loop.time() - last_recompute >= CLIENT_EVENTS_REFRESH_SECONDS:
+                last_recompute = loop.time()
+                self._recompute_cached()
+            if not self._wakeup.is_set():
+                continue
+            self._wakeup.clear()
+            dirty, self._dirty = self._dirty, set()
+            for client_id in dirty:
+                if client_id not in self._subs:
+                    continue
+                try:
+                    self.stats_counters["reads"] += 1
+                    result = await asyncio.to_thread(self._loader, client_id)
+                except Exception as e:
+                    print(f"[CLIENT_EVENTS] Kunne ikke læse klient {client_id}: {e!r}", flush=True)
+                    continue
+                if result is None or client_id not in self._subs:
+                    continue
+                view, payload = result
+                self._views[client_id] = view
+                self._fan_out(client_id, payload)
+
+    def _recompute_cached(self) -> None:
+        if self._builder is None:
+            return
+        for client_id, view in list(self._views.items()):
+            try:
+                self._fan_out(client_id, self._builder(view))
+            except Exception as e:
+                print(f"[CLIENT_EVENTS] Genberegning fejlede for klient {client_id}: {e!r}", flush=True)
+
+
+client_change_bus = ClientChangeBus()
+
+
+class ClientCommandSignals:
+    """
+    Vækkesignal pr. klient til long-poll af GET /clients/{id}/chrome-command.
+
+    Hver klient har et asyncio.Event der sættes og udskiftes ved notify(), så
+    alle parkerede requests vågner og nye requests venter på næste ændring.
+    notify() er trådsikker og koster intet, når ingen agent venter.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._events: dict[int, asyncio.Event] = {}
+        self._waiters: dict[int, int] = {}
+        self._waiting_ids: frozenset[int] = frozenset()
+        self.stats_counters = {"notifies": 0, "woken": 0, "timeouts": 0}
+
+    def register(self, client_id: int) -> asyncio.Event:
+        """Registrér en venter FØR kommandoen læses, så en notify ikke går tabt."""
+        self._loop = asyncio.get_running_loop()
+        event = self._events.get(client_id)
+        if event is None:
+            event = self._events[client_id] = asyncio.Event()
+        self._waiters[client_id] = self._waiters.get(client_id, 0) + 1
+        self._waiting_ids = frozenset(self._waiters)
+        return event
+
+    def release(self, client_id: int) -> None:
+        remaining = self._waiters.get(client_id, 0) - 1
+        if remaining > 0:
+            self._waiters[client_id] = remaining
+        else:
+            self._waiters.pop(client_id, None)
+            self._events.pop(client_id, None)
+        self._waiting_ids = frozenset(self._waiters)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats_counters["timeouts"] += 1
+            return False
+        self.stats_counters["woken"] += 1
+        return True
+
+    def notify(self, client_id: int) -> None:
+        """Må kaldes fra både event-loop og threadpool."""
+        if client_id not in self._waiting_ids or self._loop is None:
+            return
+        self.stats_counters["notifies"] += 1
+        try:
+            self._loop.call_soon_threadsafe(self._fire, client_id)
+        except RuntimeError:
+            pass
+
+    def _fire(self, client_id: int) -> None:
+        event = self._events.get(client_id)
+        if event is None:
+            return
+        event.set()
+        # Nye ventere skal vente på næste ændring, ikke se det gamle signal.
+        self._events[client_id] = asyncio.Event()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "waiting_clients": len(self._waiters),
+            "waiters": sum(self._waiters.values()),
+            **self.stats_counters,
+        }
+
+
+chrome_command_signals = ClientCommandSignals()
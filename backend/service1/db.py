@@ -1,6 +1,7 @@
 from sqlmodel import SQLModel, create_engine, Session
 from sqlalchemy import inspect, text
 from sqlalchemy.pool import StaticPool
+import json
 import os
 import sys
 import warnings
@@ -180,6 +181,41 @@ def _migrate_seasons_to_string(conn):
             print(f"[DB] Season-migration info for {table}: {e}")
 
 
+def _migrate_calendar_markings_to_days(conn) -> None:
+    """
+    Flytter legacy CalendarMarking-blobs til CalendarDay (én række pr. dag).
+
+    Hver blob konverteres og slettes i samme transaktion, så migrationen er
+    idempotent og ikke genindsætter dage, som senere er fjernet via API'et.
+    Eksisterende CalendarDay-rækker for samme (klient, dato) bevares.
+    """
+    from calendar_store import build_rows, insert_missing_rows
+    from sqlmodel import Session as _Session
+
+    try:
+        legacy = conn.execute(text("SELECT id, client_id, season, markings FROM calendarmarking")).fetchall()
+    except Exception:
+        return
+    if not legacy:
+        return
+
+    migrated_days = 0
+    # Session bundet til den åbne forbindelse: deler transaktion med resten af migrationen.
+    with _Session(bind=conn) as session:
+        for row in legacy:
+            markings = row.markings
+            if isinstance(markings, str):
+                try:
+                    markings = json.loads(markings)
+                except ValueError:
+                    markings = {}
+            rows = list(build_rows(row.client_id, str(row.season), markings or {}).values())
+            insert_missing_rows(session, rows)
+            conn.execute(text("DELETE FROM calendarmarking WHERE id = :id"), {"id": row.id})
+            migrated_days += len(rows)
+    print(f"[DB] Migreret {len(legacy)} calendarmarking-blobs → {migrated_days} calendarday-rækker")
+
+
 def _add_column_if_missing(conn, table: str, existing_columns: set[str], column_name: str, ddl: str) -> None:
     """Idempotent kolonne-migration."""
     if column_name not in existing_columns:
@@ -441,9 +477,19 @@ def create_db_and_tables():
             "ALTER TABLE client ADD COLUMN client_update_error TEXT",
         )
 
+        # --- Indekser til SQL-side filtrering/sortering af klientlisten ---
+        # create_all() opretter kun indekser sammen med nye tabeller.
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_client_status_school_sort "
+            "ON client (status, school_id, sort_order)"
+        ))
+
         # --- Migrér season int → string ---
         _migrate_seasons_to_string(conn)
 
+        # --- Migrér kalender-blobs → én række pr. dag ---
+        _migrate_calendar_markings_to_days(conn)
+
 
 def get_session():
     """
@@ -0,0 +1,227 @@
+"""
+heartbeat_buffer.py
+
+Write-coalescing buffer til POST /api/clients/{id}/heartbeat.
+
+Hver kiosk sender heartbeat med få sekunders mellemrum. Tidligere kostede hvert
+beat session.get + setattr + commit + refresh, og med mange skærme løb den
+lille Neon-pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) tør, så api_error_cors_middleware
+svarede 503 database_pool_timeout.
+
+Bufferen holder i stedet de seneste heartbeat-felter pr. klient i hukommelsen og
+skriver alle "dirty" klienter til client-tabellen i ét batch:
+- PostgreSQL: UPDATE client ... FROM (VALUES ...) pr. felt-kombination.
+- Andre dialekter (SQLite lokalt): executemany af én UPDATE-sætning.
+
+Staleness-garanti: en buffered værdi ligger højst HEARTBEAT_FLUSH_SECONDS
+(+ ét tick) i hukommelsen, før den er skrevet til databasen. Det er langt under
+CLIENTFLOW_ONLINE_TIMEOUT_SECONDS, så online/offline-visningen påvirkes ikke.
+Ved shutdown flushes bufferen fra lifespan i main.py.
+
+Sæt HEARTBEAT_BUFFER_ENABLED=0 for at falde tilbage til write-through.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from sqlalchemy import bindparam, case, or_, text, update
+
+from db import _env_int, engine
+from models import Client
+
+HEARTBEAT_BUFFER_ENABLED = os.getenv("HEARTBEAT_BUFFER_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+HEARTBEAT_FLUSH_SECONDS = _env_int("HEARTBEAT_FLUSH_SECONDS", 5, min_value=1)
+# Flush tidligere hvis mange klienter er dirty, så ét batch ikke bliver enormt.
+HEARTBEAT_MAX_PENDING = _env_int("HEARTBEAT_MAX_PENDING", 500, min_value=1)
+_TICK_SECONDS = 1.0
+
+
+class HeartbeatBuffer:
+    """Trådsikker buffer: sync endpoints kører i FastAPI's threadpool."""
+
+    def __init__(self, flush_seconds: int = HEARTBEAT_FLUSH_SECONDS, max_pending: int = HEARTBEAT_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # client_id -> felter der endnu ikke er skrevet til DB
+        self._pending: dict[int, dict[str, Any]] = {}
+        # client_id -> monotonic tidspunkt for første uflushede beat
+        self._dirty_since: dict[int, float] = {}
+        self._flush_lock = threading.Lock()
+        self.stats_counters = {
+            "beats": 0,
+            "flushes": 0,
+            "rows_flushed": 0,
+            "flush_errors": 0,
+            "last_flush_ms": None,
+        }
+
+    def record(self, client_id: int, fields: dict[str, Any]) -> None:
+        """Absorbér et heartbeat. Nyere værdier overskriver ældre for samme felt."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pending.setdefault(client_id, {})
+            entry.update(fields)
+            self._dirty_since.setdefault(client_id, now)
+            self.stats_counters["beats"] += 1
+
+    def pending(self, client_id: int) -> dict[str, Any]:
+        """Kopi af de uflushede felter for én klient (bruges til response/overlay)."""
+        with self._lock:
+            return dict(self._pending.get(client_id, {}))
+
+    def discard(self, client_id: int) -> None:
+        """Glem buffered felter, fx når klienten slettes."""
+        with self._lock:
+            self._pending.pop(client_id, None)
+            self._dirty_since.pop(client_id, None)
+
+    def due(self) -> bool:
+        with self._lock:
+            if not self._dirty_since:
+                return False
+            if len(self._pending) >= self.max_pending:
+                return True
+            oldest = min(self._dirty_since.values())
+        return (time.monotonic() - oldest) >= self.flush_seconds
+
+    def _take(self) -> dict[int, dict[str, Any]]:
+        with self._lock:
+            batch = self._pending
+            self._pending = {}
+            self._dirty_since = {}
+        return batch
+
+    def _restore(self, batch: dict[int, dict[str, Any]]) -> None:
+        """Læg et fejlet batch tilbage uden at overskrive nyere beats."""
+        now = time.monotonic()
+        with self._lock:
+            for client_id, fields in batch.items():
+                newer = self._pending.get(client_id, {})
+                self._pending[client_id] = {**fields, **newer}
+                self._dirty_since.setdefault(client_id, now)
+
+    def flush(self) -> int:
+        """Skriv alle dirty klienter til DB. Returnerer antal rækker i batchet."""
+        with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    _write_batch(conn, batch)
+            except Exception as e:
+                self._restore(batch)
+                self.stats_counters["flush_errors"] += 1
+                print(f"[HEARTBEAT] Flush fejlede for {len(batch)} klienter: {e!r}", flush=True)
+                return 0
+            self.stats_counters["flushes"] += 1
+            self.stats_counters["rows_flushed"] += len(batch)
+            self.stats_counters["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return len(batch)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+            oldest = min(self._dirty_since.values()) if self._dirty_since else None
+        return {
+            "enabled": HEARTBEAT_BUFFER_ENABLED,
+            "flush_seconds": self.flush_seconds,
+            "max_pending": self.max_pending,
+            "pending_clients": pending,
+            "oldest_pending_age_seconds": None if oldest is None else round(time.monotonic() - oldest, 2),
+            **self.stats_counters,
+        }
+
+
+def _write_batch(conn, batch: dict[int, dict[str, Any]]) -> None:
+    # Gruppér pr. felt-kombination, så hver gruppe kan skrives med én sætning.
+    groups: dict[tuple[str, ...], list[tuple[int, dict[str, Any]]]] = {}
+    for client_id, fields in batch.items():
+        groups.setdefault(tuple(sorted(fields)), []).append((client_id, fields))
+
+    for columns, rows in groups.items():
+        if conn.dialect.name == "postgresql":
+            _write_group_values(conn, columns, rows)
+        else:
+            _write_group_executemany(conn, columns, rows)
+
+
+def _write_group_values(conn, columns: tuple[str, ...], rows: list[tuple[int, dict[str, Any]]]) -> None:
+    """PostgreSQL: UPDATE client AS c SET ... FROM (VALUES ...) AS v(...) WHERE c.id = v.id."""
+    table = Client.__table__
+    dialect = conn.dialect
+
+    def _cast(col: str) -> str:
+        return f"CAST(v.{col} AS {table.c[col].type.compile(dialect=dialect)})"
+
+    assignments = []
+    for col in columns:
+        if col == "last_seen":
+            # Et sent flush må ikke rulle last_seen tilbage, hvis et andet
+            # endpoint (fx chrome-status) har skrevet et nyere livstegn imellem.
+            assignments.append(
+                f"last_seen = CASE WHEN c.last_seen IS NULL OR c.last_seen < {_cast(col)} "
+                f"THEN {_cast(col)} ELSE c.last_seen END"
+            )
+        else:
+            assignments.append(f"{col} = {_cast(col)}")
+
+    params: dict[str, Any] = {}
+    value_rows = []
+    for i, (client_id, fields) in enumerate(rows):
+        placeholders = [f":id_{i}"]
+        params[f"id_{i}"] = client_id
+        for j, col in enumerate(columns):
+            placeholders.append(f":v_{i}_{j}")
+            params[f"v_{i}_{j}"] = fields[col]
+        value_rows.append("(" + ", ".join(placeholders) + ")")
+
+    sql = (
+        f"UPDATE client AS c SET {', '.join(assignments)} "
+        f"FROM (VALUES {', '.join(value_rows)}) AS v(id, {', '.join(columns)}) "
+        f"WHERE c.id = CAST(v.id AS INTEGER)"
+    )
+    conn.execute(text(sql), params)
+
+
+def _write_group_executemany(conn, columns: tuple[str, ...], rows: list[tuple[int, dict[str, Any]]]) -> None:
+    table = Client.__table__
+    values = {}
+    for col in columns:
+        param = bindparam(f"b_{col}")
+        if col == "last_seen":
+            values[col] = case(
+                (or_(table.c.last_seen.is_(None), table.c.last_seen < param), param),
+                else_=table.c.last_seen,
+            )
+        else:
+            values[col] = param
+    stmt = update(table).where(table.c.id == bindparam("b_id")).values(**values)
+    conn.execute(
+        stmt,
+        [{"b_id": client_id, **{f"b_{col}": fields[col] for col in columns}} for client_id, fields in rows],
+    )
+
+
+heartbeat_buffer = HeartbeatBuffer()
+
+
+async def run_flush_loop(buffer: Optional[HeartbeatBuffer] = None) -> None:
+    """Baggrundsopgave startet fra lifespan. Flusher i threadpool, så event-loopet ikke blokeres."""
+    buffer = buffer or heartbeat_buffer
+    while True:
+        await asyncio.sleep(_TICK_SECONDS)
+        try:
+            if buffer.due():
+                await asyncio.to_thread(buffer.flush)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[HEARTBEAT] Uventet fejl i flush-loop: {e!r}", flush=True)
@@ -0,0 +1,97 @@
+"""
+hls_manifests.py
+
+In-memory cache af index.m3u8 pr. livestream-klient.
+
+Hver viewer genindlæser manifestet hver target duration. Via CustomStaticFiles
+betød det stat + læsning fra disk pr. request og pr. viewer. Nu:
+
+- _write_manifest lægger de skrevne bytes i cachen (put) samtidig med at
+  filen skrives, så disken kun bruges som fallback efter genstart,
+- ETag er et hash af indholdet, så den er stabil på tværs af genstart og
+  ændres kun når manifestet faktisk ændres,
+- generation tælles op ved hver ændring og sendes som X-Manifest-Generation,
+- handleren i routers/livestream.py svarer 304 på If-None-Match.
+
+Cachen er pr. proces; andre workers opdateres via relay_bus' HLS-hændelser
+(backend kører dog fortsat --workers 1, se relay_bus.py).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass(frozen=True)
+class CachedManifest:
+    body: bytes
+    etag: str
+    generation: int
+
+
+def _etag_for(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match kan indeholde flere (evt. svage) tags eller *."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ManifestCache:
+    def __init__(self):
+        self._entries: Dict[str, CachedManifest] = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"puts": 0, "unchanged_puts": 0, "hits": 0, "not_modified": 0, "disk_loads": 0}
+
+    def put(self, client_id: str, body: bytes) -> CachedManifest:
+        etag = _etag_for(body)
+        with self._lock:
+            current = self._entries.get(client_id)
+            if current is not None and current.etag == etag:
+                self.stats_counters["unchanged_puts"] += 1
+                return current
+            entry = CachedManifest(body, etag, (current.generation + 1) if current else 1)
+            self._entries[client_id] = entry
+            self.stats_counters["puts"] += 1
+            return entry
+
+    def get(self, client_id: str) -> Optional[CachedManifest]:
+        with self._lock:
+            return self._entries.get(client_id)
+
+    def load(self, client_id: str, manifest_path: str) -> Optional[CachedManifest]:
+        """Cache-miss (fx efter genstart): læs manifestet fra disk én gang."""
+        try:
+            with open(manifest_path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.stats_counters["disk_loads"] += 1
+        return self.put(client_id, body)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def drop(self, client_id: str) -> None:
+        with self._lock:
+            self._entries.pop(client_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "bytes": sum(len(e.body) for e in self._entries.values()),
+                **self.stats_counters,
+            }
@@ -0,0 +1,263 @@
+"""
+hls_retention.py
+
+Server-side oprydning i HLS_DIR.
+
+Segmenter blev kun slettet når kiosk-agenten kaldte /hls/cleanup med en
+keep_files-liste. Døde en agent, voksede klientmappen for evigt. Sweeperen
+kører nu som baggrundsopgave fra lifespan i main.py og:
+
+- beholder pr. klient de nyeste HLS_RETENTION_MAX_SEGMENTS segmenter og
+  sletter segmenter ældre end HLS_RETENTION_MAX_AGE_SECONDS (de nyeste
+  keep_min, som står i manifestet, røres aldrig af aldersreglen),
+- sletter efterladte LL-HLS-dele og temp-filer fra afbrudte uploads,
+- håndhæver HLS_DISK_QUOTA_MB for hele HLS_DIR ved at tømme de streams der
+  har været inaktive længst (LRU); aktive streams evictes aldrig,
+- rapporterer frigjorte bytes via stats() (/health/hls-retention).
+
+Alt læses med én os.scandir pr. mappe og sammenlignes med sets.
+Filsystem-arbejdet kører i en tråd (asyncio.to_thread). sweep() rører ikke
+in-memory tilstanden; den returnerer hvilke klienter der blev beskåret eller
+tømt, og on_pruned/on_evicted kaldes derefter på event-loopet (LL-HLS-
+tilstanden må kun røres derfra, og hændelserne skal ud på relay_bus).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from db import _env_int
+
+HLS_RETENTION_INTERVAL_SECONDS = _env_int("HLS_RETENTION_INTERVAL_SECONDS", 30, min_value=5)
+HLS_RETENTION_MAX_SEGMENTS = _env_int("HLS_RETENTION_MAX_SEGMENTS", 60, min_value=1)
+HLS_RETENTION_MAX_AGE_SECONDS = _env_int("HLS_RETENTION_MAX_AGE_SECONDS", 600, min_value=30)
+HLS_DISK_QUOTA_MB = _env_int("HLS_DISK_QUOTA_MB", 2048, min_value=0)  # 0 = ingen kvote
+HLS_IDLE_SECONDS = _env_int("HLS_IDLE_SECONDS", 300, min_value=30)
+
+# Dele og temp-filer er kun relevante i få sekunder.
+_PART_MAX_AGE_SECONDS = 60
+_TEMP_MAX_AGE_SECONDS = 300
+
+_CLIENT_DIR_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
+
+
+@dataclass
+class _ClientScan:
+    client_id: str
+    path: str
+    total_bytes: int = 0
+    newest_mtime: float = 0.0
+    # (seq, navn, størrelse, mtime)
+    segments: List[tuple] = field(default_factory=list)
+    junk: List[tuple] = field(default_factory=list)
+
+
+@dataclass
+class SweepResult:
+    # client_id -> (slettede segmenter, tilbageværende segmenter)
+    pruned: Dict[str, Tuple[List[str], List[str]]] = field(default_factory=dict)
+    evicted: List[str] = field(default_factory=list)
+
+
+class HlsRetention:
+    def __init__(
+        self,
+        hls_dir: str,
+        extract_num: Callable[[str], int],
+        keep_min: int,
+        on_pruned: Optional[Callable[[str, List[str], List[str]], Awaitable[None]]] = None,
+        on_evicted: Optional[Callable[[str], Awaitable[None]]] = None,
+        max_segments: int = HLS_RETENTION_MAX_SEGMENTS,
+        max_age_seconds: int = HLS_RETENTION_MAX_AGE_SECONDS,
+        quota_bytes: int = HLS_DISK_QUOTA_MB * 1024 * 1024,
+        idle_seconds: int = HLS_IDLE_SECONDS,
+    ):
+        self.hls_dir = hls_dir
+        self._extract_num = extract_num
+        self.keep_min = keep_min
+        # Manifestet skal altid kunne pege på de keep_min nyeste segmenter.
+        self.max_segments = max(max_segments, keep_min)
+        self.max_age_seconds = max_age_seconds
+        self.quota_bytes = quota_bytes
+        self.idle_seconds = idle_seconds
+        self.on_pruned = on_pruned
+        self.on_evicted = on_evicted
+        self._lock = threading.Lock()
+        self.last_run: Dict[str, object] = {}
+        self.stats_counters = {"runs": 0, "bytes_reclaimed": 0, "files_deleted": 0, "clients_evicted": 0}
+
+    # -- scanning --------------------------------------------------------------
+    def _scan_client(self, client_id: str, path: str, now: float) -> _ClientScan:
+        scan = _ClientScan(client_id, path)
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            return scan
+        for entry in entries:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            name = entry.name
+            scan.total_bytes += st.st_size
+            scan.newest_mtime = max(scan.newest_mtime, st.st_mtime)
+            age = now - st.st_mtime
+            if name.startswith("segment_"):
+                seq = self._extract_num(name)
+                if seq >= 0:
+                    scan.segments.append((seq, name, st.st_size, st.st_mtime))
+            elif name.startswith("part_"):
+                if age > _PART_MAX_AGE_SECONDS:
+                    scan.junk.append((name, st.st_size))
+            elif (name.startswith(".") and name.endswith(".part")) or ".tmp." in name:
+                if age > _TEMP_MAX_AGE_SECONDS:
+                    scan.junk.append((name, st.st_size))
+        scan.segments.sort()
+        return scan
+
+    def _expired_segments(self, scan: _ClientScan, now: float) -> List[tuple]:
+        segments = scan.segments
+        protected = {name for _, name, _, _ in segments[-self.keep_min:]}
+        keep = {name for _, name, _, _ in segments[-self.max_segments:]}
+        return [
+            seg for seg in segments
+            if seg[1] not in protected
+            and (seg[1] not in keep or now - seg[3] > self.max_age_seconds)
+        ]
+
+    # -- sletning --------------------------------------------------------------
+    def _remove(self, path: str, names: List[str]) -> List[str]:
+        removed = []
+        for name in names:
+            try:
+                os.remove(os.path.join(path, name))
+                removed.append(name)
+            except FileNotFoundError:
+                removed.append(name)
+            except OSError as e:
+                print(f"[RETENTION] Kunne ikke slette {name}: {e}", flush=True)
+        return removed
+
+    def _evict(self, scan: _ClientScan) -> int:
+        """Tøm en inaktiv klientmappe. Returnerer frigjorte bytes."""
+        try:
+            names = [entry.name for entry in os.scandir(scan.path) if entry.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            names = []
+        self._remove(scan.path, names)
+        try:
+            os.rmdir(scan.path)
+        except OSError:
+            pass
+        return scan.total_bytes
+
+    def sweep(self) -> SweepResult:
+        """Én oprydningsrunde. Kaldes fra en tråd; se run_retention_loop."""
+        with self._lock:
+            result = SweepResult()
+            started = time.perf_counter()
+            now = time.time()
+            reclaimed = 0
+            deleted = 0
+            scans: List[_ClientScan] = []
+
+            try:
+                entries = list(os.scandir(self.hls_dir))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) or not _CLIENT_DIR_RE.match(entry.name):
+                    continue
+                scan = self._scan_client(entry.name, entry.path, now)
+                expired = self._expired_segments(scan, now)
+                expired_names = {name for _, name, _, _ in expired}
+                removed = self._remove(scan.path, sorted(expired_names) + [name for name, _ in scan.junk])
+                removed_set = set(removed)
+                freed = sum(size for _, name, size, _ in expired if name in removed_set)
+                freed += sum(size for name, size in scan.junk if name in removed_set)
+                if expired_names:
+                    remaining = [name for _, name, _, _ in scan.segments if name not in removed_set]
+                    result.pruned[scan.client_id] = ([n for n in removed if n in expired_names], remaining)
+                scan.total_bytes -= freed
+                scan.segments = [seg for seg in scan.segments if seg[1] not in removed_set]
+                reclaimed += freed
+                deleted += len(removed)
+                scans.append(scan)
+
+            total = sum(scan.total_bytes for scan in scans)
+            evicted = result.evicted
+            if self.quota_bytes and total > self.quota_bytes:
+                idle = sorted(
+                    (s for s in scans if now - s.newest_mtime > self.idle_seconds),
+                    key=lambda s: s.newest_mtime,
+                )
+                for scan in idle:
+                    if total <= self.quota_bytes:
+                        break
+                    freed = self._evict(scan)
+                    total -= freed
+                    reclaimed += freed
+                    evicted.append(scan.client_id)
+                if total > self.quota_bytes:
+                    print(
+                        f"[RETENTION] HLS_DIR over kvote ({total // (1024 * 1024)} MB > "
+                        f"{self.quota_bytes // (1024 * 1024)} MB) — kun aktive streams tilbage",
+                        flush=True,
+                    )
+
+            self.stats_counters["runs"] += 1
+            self.stats_counters["bytes_reclaimed"] += reclaimed
+            self.stats_counters["files_deleted"] += deleted
+            self.stats_counters["clients_evicted"] += len(evicted)
+            self.last_run = {
+                "at": now,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                "clients": len(scans),
+                "total_bytes": total,
+                "bytes_reclaimed": reclaimed,
+                "files_deleted": deleted,
+                "evicted": list(evicted),
+            }
+            if reclaimed:
+                print(
+                    f"[RETENTION] Frigjort {reclaimed} bytes ({deleted} filer, "
+                    f"{len(evicted)} inaktive streams tømt)",
+                    flush=True,
+                )
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "max_segments": self.max_segments,
+            "max_age_seconds": self.max_age_seconds,
+            "quota_bytes": self.quota_bytes,
+            "idle_seconds": self.idle_seconds,
+            "last_run": self.last_run,
+            **self.stats_counters,
+        }
+
+
+async def run_retention_loop(retention: HlsRetention, interval: int = HLS_RETENTION_INTERVAL_SECONDS) -> None:
+    """Baggrundsopgave startet fra lifespan i main.py."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await asyncio.to_thread(retention.sweep)
+            if retention.on_pruned is not None:
+                for client_id, (deleted, remaining) in result.pruned.items():
+                    await retention.on_pruned(client_id, deleted, remaining)
+            if retention.on_evicted is not None:
+                for client_id in result.evicted:
+                    await retention.on_evicted(client_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[RETENTION] Uventet fejl i sweep: {e!r}", flush=True)
@@ -0,0 +1,217 @@
+"""
+hls_segments.py
+
+In-memory segment-indeks pr. livestream-klient.
+
+update_manifest listede tidligere hele klientmappen og kaldte getsize på hvert
+segment_*-fil ved hvert upload, så prisen voksede med antallet af gemte
+segmenter. Indekset holder i stedet de nyeste segmenter pr. klient som
+(seq, filename, size, captured_at, duration, mtime) sorteret efter seq:
+
+- upload_hls_file kalder record() efter den atomiske rename,
+- cleanup kalder discard(), reset kalder drop(),
+- første opslag for en klient (fx efter genstart) genopbygger fra disk.
+
+Indekset er pr. proces. Med flere workers holdes det i sync via relay_bus'
+HLS-hændelser (routers/livestream.py), men backend kører fortsat med
+--workers 1 (se relay_bus.py).
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Segmenter under denne størrelse er typisk afbrudte skrivninger fra ffmpeg.
+MIN_SEGMENT_BYTES = 1000
+SEGMENT_EXTS = (".ts", ".mp4")
+
+
+@dataclass(frozen=True)
+class SegmentInfo:
+    seq: int
+    filename: str
+    size: int
+    captured_at: Optional[datetime]
+    duration: int
+    mtime: float
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1]
+
+    @property
+    def program_date(self) -> datetime:
+        """captured_at, eller mtime minus varighed hvis klienten ikke sendte tidspunkt."""
+        if self.captured_at is not None:
+            return self.captured_at
+        return datetime.fromtimestamp(self.mtime - self.duration, tz=timezone.utc)
+
+
+class ClientSegments:
+    """Sorteret ring af de nyeste segmenter for én klient."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._seqs: List[int] = []
+        self._items: List[SegmentInfo] = []
+
+    def add(self, info: SegmentInfo) -> None:
+        self.discard(info.filename)
+        i = bisect.bisect_right(self._seqs, info.seq)
+        self._seqs.insert(i, info.seq)
+        self._items.insert(i, info)
+        overflow = len(self._items) - self.capacity
+        if overflow > 0:
+            del self._seqs[:overflow]
+            del self._items[:overflow]
+
+    def discard(self, filename: str) -> bool:
+        for i, item in enumerate(self._items):
+            if item.filename == filename:
+                del self._seqs[i]
+                del self._items[i]
+                return True
+        return False
+
+    def latest(self, n: int, ext: Optional[str] = None) -> List[SegmentInfo]:
+        if ext is None:
+            return self._items[-n:] if n else []
+        out: List[SegmentInfo] = []
+        for item in reversed(self._items):
+            if item.ext == ext:
+                out.append(item)
+                if len(out) >= n:
+                    break
+        out.reverse()
+        return out
+
+    def get(self, filename: str) -> Optional[SegmentInfo]:
+        for item in reversed(self._items):
+            if item.filename == filename:
+                return item
+        return None
+
+    def all(self) -> List[SegmentInfo]:
+        return list(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SegmentIndex:
+    def __init__(self, capacity: int, extract_num: Callable[[str], int]):
+        self.capacity = capacity
+        self._extract_num = extract_num
+        self._clients: Dict[str, ClientSegments] = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"records": 0, "rebuilds": 0}
+
+    def _rebuild(
+        self,
+        client_dir: str,
+        duration: int,
+        captured_at_map: Optional[Dict[str, datetime]] = None,
+    ) -> ClientSegments:
+        segments = ClientSegments(self.capacity)
+        captured_at_map = captured_at_map or {}
+        try:
+            entries = list(os.scandir(client_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            name = entry.name
+            if not name.startswith("segment_") or not name.endswith(SEGMENT_EXTS):
+                continue
+            seq = self._extract_num(name)
+            if seq < 0:
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_size <= MIN_SEGMENT_BYTES:
+                continue
+            segments.add(SegmentInfo(seq, name, st.st_size, captured_at_map.get(name), duration, st.st_mtime))
+        self.stats_counters["rebuilds"] += 1
+        return segments
+
+    def _segments(
+        self,
+        client_id: str,
+        client_dir: str,
+        duration: int,
+        captured_at_loader: Optional[Callable[[], Dict[str, datetime]]],
+    ) -> ClientSegments:
+        """Kaldes med self._lock. Bygger klientens indeks fra disk ved første opslag."""
+        segments = self._clients.get(client_id)
+        if segments is None:
+            captured = captured_at_loader() if captured_at_loader else None
+            segments = self._clients[client_id] = self._rebuild(client_dir, duration, captured)
+        return segments
+
+    def record(
+        self,
+        client_id: str,
+        client_dir: str,
+        filename: str,
+        size: int,
+        captured_at: Optional[datetime],
+        duration: int,
+        mtime: float,
+        captured_at_loader: Optional[Callable[[], Dict[str, datetime]]] = None,
+    ) -> Optional[SegmentInfo]:
+        seq = self._extract_num(filename)
+        with self._lock:
+            segments = self._segments(client_id, client_dir, duration, captured_at_loader)
+            self.stats_counters["records"] += 1
+            if seq < 0 or size <= MIN_SEGMENT_BYTES:
+                segments.discard(filename)
+                return None
+            info = SegmentInfo(seq, filename, size, captured_at, duration, mtime)
+            segments.add(info)
+            return info
+
+    def latest(
+        self,
+        client_id: str,
+        client_dir: str,
+        n: int,
+        ext: Optional[str] = None,
+        *,
+        duration: int = 2,
+        captured_at_loader: Optional[Callable[[], Dict[str, datetime]]] = None,
+    ) -> List[SegmentInfo]:
+        """De n nyeste segmenter (stigende seq), evt. kun med én filendelse."""
+        with self._lock:
+            return self._segments(client_id, client_dir, duration, captured_at_loader).latest(n, ext)
+
+    def get(self, client_id: str, filename: str) -> Optional[SegmentInfo]:
+        with self._lock:
+            segments = self._clients.get(client_id)
+            return segments.get(filename) if segments is not None else None
+
+    def discard(self, client_id: str, filenames: Iterable[str]) -> None:
+        with self._lock:
+            segments = self._clients.get(client_id)
+            if segments is None:
+                return
+            for name in filenames:
+                segments.discard(name)
+
+    def drop(self, client_id: str) -> None:
+        with self._lock:
+            self._clients.pop(client_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "segments": sum(len(s) for s in self._clients.values()),
+                "capacity_per_client": self.capacity,
+                **self.stats_counters,
+            }
@@ -0,0 +1,260 @@
+"""
+ll_hls.py
+
+Low-Latency HLS-tilstand for livestreamen.
+
+Den almindelige index.m3u8 indeholder kun hele segmenter, og browseren poller
+den. Med KEEP_N segmenter á 2 sek. ligger viewers typisk ~3 segmenter bag.
+Når en kiosk også uploader delsegmenter (POST /hls/upload-part), tilbyder
+GET /hls/{client_id}/ll/index.m3u8 en LL-HLS-playlist med:
+
+- EXT-X-PART for delsegmenterne i de nyeste LL_HLS_PART_SEGMENTS segmenter og
+  i det segment der er under opbygning,
+- EXT-X-PRELOAD-HINT for næste forventede del,
+- blokerende reload (_HLS_msn/_HLS_part): forespørgslen venter på en
+  asyncio.Condition pr. klient, som upload af dele og hele segmenter
+  signalerer, i stedet for at browseren poller.
+
+Tilstanden er pr. proces og kun i hukommelsen; andre workers opdateres via
+relay_bus' HLS-hændelser (backend kører dog fortsat --workers 1, se relay_bus.py).
+Efter genstart starter playlisten med hele segmenter, indtil næste del kommer.
+Alle muterende metoder kaldes fra event-loopet (async upload-endpoints).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from hls_segments import SegmentInfo
+
+# Dele bevares for så mange afsluttede segmenter bag live edge (RFC 8216bis
+# anbefaler dele for mindst de sidste 3 target durations).
+LL_HLS_PART_SEGMENTS = max(1, int(os.getenv("HLS_LL_PART_SEGMENTS", "3")))
+DEFAULT_PART_TARGET = 0.5
+
+PART_FILENAME_RE = re.compile(r"^part_(\d+)_(\d+)\.(ts|mp4)$")
+
+
+def part_filename(msn: int, index: int, ext: str) -> str:
+    return f"part_{msn}_{index}{ext}"
+
+
+def parse_part_filename(filename: str) -> Optional[Tuple[int, int]]:
+    m = PART_FILENAME_RE.match(filename)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+@dataclass(frozen=True)
+class PartInfo:
+    msn: int
+    index: int
+    filename: str
+    duration: float
+    independent: bool
+    captured_at: Optional[datetime] = None
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1]
+
+
+@dataclass
+class _ClientState:
+    condition: asyncio.Condition = field(default_factory=asyncio.Condition)
+    parts: Dict[int, List[PartInfo]] = field(default_factory=dict)
+    last_complete_msn: int = -1
+    part_target: float = 0.0
+
+    @property
+    def live_msn(self) -> int:
+        """Højeste msn der er set, som helt segment eller som del."""
+        return max([self.last_complete_msn, *self.parts.keys()])
+
+    def has_part(self, msn: int, index: int) -> bool:
+        if msn <= self.last_complete_msn and msn not in self.parts:
+            # Segmentet er færdigt og dets dele er ryddet: det hele findes.
+            return True
+        return index < len(self.parts.get(msn, ()))
+
+    def satisfies(self, msn: int, part: Optional[int]) -> bool:
+        if msn <= self.last_complete_msn:
+            return True
+        return part is not None and self.has_part(msn, part)
+
+
+class LowLatencyHls:
+    def __init__(self, part_segments: int = LL_HLS_PART_SEGMENTS):
+        self.part_segments = part_segments
+        self._clients: Dict[str, _ClientState] = {}
+        self.stats_counters = {"parts": 0, "segments": 0, "blocked_reloads": 0, "timeouts": 0}
+
+    def _state(self, client_id: str) -> _ClientState:
+        state = self._clients.get(client_id)
+        if state is None:
+            state = self._clients[client_id] = _ClientState()
+        return state
+
+    def is_active(self, client_id: str) -> bool:
+        """True når klienten har uploadet dele siden seneste reset/genstart."""
+        state = self._clients.get(client_id)
+        return state is not None and state.part_target > 0
+
+    def part_target(self, client_id: str) -> float:
+        state = self._clients.get(client_id)
+        return state.part_target if state is not None and state.part_target > 0 else DEFAULT_PART_TARGET
+
+    # -- opdateringer fra upload ----------------------------------------------
+    async def record_part(self, client_id: str, info: PartInfo) -> List[str]:
+        """Registrér en uploadet del. Returnerer delfiler der nu kan slettes."""
+        state = self._state(client_id)
+        async with state.condition:
+            if info.msn <= state.last_complete_msn:
+                # Delen kom efter det hele segment; playlisten bruger segmentet.
+                return [info.filename]
+            parts = state.parts.setdefault(info.msn, [])
+            if info.index < len(parts):
+                parts[info.index] = info
+            elif info.index == len(parts):
+                parts.append(info)
+            else:
+                # Huller i rækkefølgen kan ikke udtrykkes i playlisten.
+                return [info.filename]
+            # PART-TARGET må aldrig være mindre end en dels varighed.
+            state.part_target = max(state.part_target, math.ceil(info.duration * 1000) / 1000)
+            self.stats_counters["parts"] += 1
+            state.condition.notify_all()
+        return []
+
+    async def segment_complete(self, client_id: str, msn: int) -> List[str]:
+        """Et helt segment er uploadet. Returnerer delfiler der nu kan slettes."""
+        state = self._state(client_id)
+        async with state.condition:
+            state.last_complete_msn = max(state.last_complete_msn, msn)
+            self.stats_counters["segments"] += 1
+            expired = [
+                n for n in state.parts
+                if n <= state.last_complete_msn - self.part_segments
+            ]
+            stale = [p.filename for n in expired for p in state.parts.pop(n)]
+            state.condition.notify_all()
+        return stale
+
+    def drop(self, client_id: str) -> None:
+        """Glem klienten (reset sletter selv filerne). Ventende reloads får timeout."""
+        self._clients.pop(client_id, None)
+
+    # -- blokerende reload -----------------------------------------------------
+    def can_block(self, client_id: str, msn: int, last_segment_seq: int = -1) -> bool:
+        """RFC 8216bis: _HLS_msn mere end to segmenter fremme afvises med 400."""
+        state = self._clients.get(client_id)
+        live = max(state.live_msn if state is not None else -1, last_segment_seq)
+        return msn <= live + 2
+
+    async def wait_for(self, client_id: str, msn: int, part: Optional[int], timeout: float) -> bool:
+        # Kun klienter med tilstand; forespørgsler må aldrig oprette den.
+        state = self._clients.get(client_id)
+        if state is None:
+            return False
+        async with state.condition:
+            if state.satisfies(msn, part):
+                return True
+            self.stats_counters["blocked_reloads"] += 1
+            try:
+                await asyncio.wait_for(
+                    state.condition.wait_for(lambda: state.satisfies(msn, part)),
+                    timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                self.stats_counters["timeouts"] += 1
+                return False
+
+    async def wait_for_part(self, client_id: str, msn: int, index: int, timeout: float) -> bool:
+        """Bruges af preload-hint: vent til delen findes."""
+        state = self._clients.get(client_id)
+        if state is None:
+            return False
+        async with state.condition:
+            try:
+                await asyncio.wait_for(
+                    state.condition.wait_for(lambda: state.has_part(msn, index)),
+                    timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    # -- playlist --------------------------------------------------------------
+    def render(self, client_id: str, segments: List[SegmentInfo], segment_duration: int) -> str:
+        """
+        LL-HLS-playlist. URI'er er relative til playlisten, som ligger i samme
+        /ll/-mappe som endpointet der serverer segmenter og dele.
+
+        EXT-X-DISCONTINUITY før hvert segment svarer til _write_manifest
+        (ffmpeg reset_timestamps=1); delene i et segment er sammenhængende.
+        """
+        state = self._clients.get(client_id) or _ClientState()
+        part_target = state.part_target or DEFAULT_PART_TARGET
+        parts = state.parts
+        # Segment-indekset rummer kun hele segmenter. Kun dele for segmentet
+        # lige efter det seneste hele vises, så media sequence er sammenhængende.
+        last_seq = max(state.last_complete_msn, segments[-1].seq if segments else -1)
+        if last_seq < 0 and parts:
+            last_seq = min(parts) - 1
+        live_msn = last_seq + 1
+        first_seq = segments[0].seq if segments else live_msn
+
+        target = max([segment_duration, *(math.ceil(s.duration) for s in segments)])
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:6",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={part_target * 3:.3f}",
+            f"#EXT-X-PART-INF:PART-TARGET={part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first_seq}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{first_seq}",
+        ]
+
+        def _parts(msn: int) -> None:
+            for p in parts.get(msn, ()):
+                attrs = f'DURATION={p.duration:.3f},URI="{p.filename}"'
+                if p.independent:
+                    attrs += ",INDEPENDENT=YES"
+                lines.append(f"#EXT-X-PART:{attrs}")
+
+        for i, seg in enumerate(segments):
+            if i > 0:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{seg.program_date.strftime('%Y-%m-%dT%H:%M:%S.000Z')}")
+            _parts(seg.seq)
+            lines.append(f"#EXTINF:{seg.duration}.0,")
+            lines.append(seg.filename)
+
+        live_parts = parts.get(live_msn, [])
+        if live_parts:
+            if segments:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if live_parts[0].captured_at is not None:
+                lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{live_parts[0].captured_at.strftime('%Y-%m-%dT%H:%M:%S.000Z')}")
+            _parts(live_msn)
+
+        ext = live_parts[-1].ext if live_parts else (segments[-1].ext if segments else ".ts")
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{part_filename(live_msn, len(live_parts), ext)}"')
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "active": sum(1 for s in self._clients.values() if s.part_target > 0),
+            "parts_held": sum(len(p) for s in self._clients.values() for p in s.parts.values()),
+            **self.stats_counters,
+        }
+
+
+ll_hls = LowLatencyHls()
@@ -0,0 +1,69 @@
+"""
+loop_monitor.py
+
+Måler hvor længe event-loopet er blokeret.
+
+Synkrone DB-kald i async def-handlere og WebSocket-ruter stoppede hele
+loopet, inkl. alle terminal- og remote desktop-relæer. Handlerne kører nu
+DB-arbejdet i threadpoolen, og denne opgave (startet fra lifespan i main.py)
+holder øje med at det forbliver sådan:
+
+- sover LOOP_MONITOR_INTERVAL_MS ad gangen og måler hvor meget senere den
+  vågner end bestilt (lag),
+- logger lag over LOOP_BLOCK_THRESHOLD_MS med [LOOP] og tæller det,
+- /health/event-loop viser seneste, maks. og antal blokeringer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from db import _env_int
+
+LOOP_MONITOR_INTERVAL_MS = _env_int("LOOP_MONITOR_INTERVAL_MS", 250, min_value=10)
+LOOP_BLOCK_THRESHOLD_MS = _env_int("LOOP_BLOCK_THRESHOLD_MS", 100, min_value=1)
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval_ms: int = LOOP_MONITOR_INTERVAL_MS,
+        threshold_ms: int = LOOP_BLOCK_THRESHOLD_MS,
+    ):
+        self.interval = interval_ms / 1000
+        self.threshold_ms = threshold_ms
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.blocked = 0
+        self.samples = 0
+
+    def record(self, lag_ms: float) -> bool:
+        """Registrér én måling. True hvis loopet var blokeret over grænsen."""
+        self.samples += 1
+        self.last_lag_ms = lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if lag_ms <= self.threshold_ms:
+            return False
+        self.blocked += 1
+        print(f"[LOOP] Event-loopet var blokeret i {lag_ms:.0f} ms (grænse {self.threshold_ms} ms)", flush=True)
+        return True
+
+    async def run(self) -> None:
+        """Baggrundsopgave startet fra lifespan i main.py."""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, (time.perf_counter() - started - self.interval) * 1000))
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "blocked": self.blocked,
+            "samples": self.samples,
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -1,9 +1,10 @@
 print("### main.py starter ###")
 
+import asyncio
 import os
 import traceback
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
@@ -24,15 +25,21 @@ from routers import schools
 from routers import users
 from routers import livestream
 from routers import enrollment
-from routers.remote_desktop import router as remote_desktop_router
-from routers.terminal import router as terminal_router
+from routers.remote_desktop import router as remote_desktop_router, stats as remote_desktop_stats
+from routers.terminal import router as terminal_router, stats as terminal_stats
 from routers import holidays
 from routers.livestream import HLS_DIR
 
 print("### main.py: livestream importeret ###")
 
-from auth import router as auth_router, get_password_hash
+from auth import router as auth_router, get_current_superadmin_user, get_password_hash, principal_cache_stats
 from db import create_db_and_tables, engine
+from heartbeat_buffer import heartbeat_buffer, run_flush_loop as run_heartbeat_flush_loop
+from schedule_publisher import schedule_publisher
+from ll_hls import ll_hls
+from hls_retention import run_retention_loop as run_hls_retention_loop
+from relay_bus import relay_bus
+from loop_monitor import loop_monitor
 from models import User
 
 print("### main.py: Efter alle imports ###")
@@ -116,7 +123,24 @@ async def lifespan(app: FastAPI):
     migrate_legacy_user_roles()
     migrate_add_chrome_step()
     ensure_admin_user()
-    yield
+    await relay_bus.start()
+    heartbeat_task = asyncio.create_task(run_heartbeat_flush_loop())
+    schedule_task = asyncio.create_task(schedule_publisher.run())
+    retention_task = asyncio.create_task(run_hls_retention_loop(livestream.hls_retention))
+    loop_monitor_task = asyncio.create_task(loop_monitor.run())
+    try:
+        yield
+    finally:
+        for task in (heartbeat_task, schedule_task, retention_task, loop_monitor_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await relay_bus.stop()
+        # Skriv sidste buffered heartbeats, så last_seen/uptime ikke tabes ved deploy.
+        flushed = heartbeat_buffer.flush()
+        print(f"Heartbeat-buffer flushet ved shutdown: {flushed} klienter")
 
 
 app = FastAPI(
@@ -134,6 +158,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["Authorization", "Content-Type", "Accept"],
+    # Cursor-pagination af /api/clients/ returnerer næste side i en header.
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -211,7 +237,9 @@ class HLSCORSMiddleware(BaseHTTPMiddleware):
             response.headers["Access-Control-Allow-Headers"]     = "Authorization, Content-Type, Range"
 
             if request.url.path.endswith(".m3u8"):
-                response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+                # no-cache (ikke no-store): browseren må gemme manifestet og
+                # revalidere med If-None-Match, så uændrede manifester giver 304.
+                response.headers["Cache-Control"] = "no-cache"
                 response.headers["Pragma"]        = "no-cache"
                 response.headers["Expires"]       = "0"
             else:
@@ -237,6 +265,8 @@ class CustomStaticFiles(StaticFiles):
         return response
 
 
+# index.m3u8 serveres fra livestreams manifest-cache; skal registreres før mountet.
+app.include_router(livestream.hls_router)
 app.mount("/hls", CustomStaticFiles(directory=HLS_DIR), name="hls")
 print(f"### main.py: Static mount for HLS på {HLS_DIR} ###")
 
@@ -287,6 +317,66 @@ def health_db_pool():
         )
 
 
+@app.get("/health/heartbeat-buffer")
+def health_heartbeat_buffer():
+    """Debug-endpoint: viser hvor mange heartbeats der venter på flush."""
+    return {"status": "ok", "buffer": heartbeat_buffer.stats()}
+
+
+@app.get("/health/schedule-publisher")
+def health_schedule_publisher():
+    """Debug-endpoint: kø, igangværende leveringer og tællere for kalender-udsendelse."""
+    return {"status": "ok", "publisher": schedule_publisher.stats()}
+
+
+@app.get("/health/hls-manifests")
+def health_hls_manifests():
+    """Debug-endpoint: manifest-cachen (hits, 304-svar, disk-fallbacks)."""
+    return {"status": "ok", "cache": livestream.manifest_cache.stats()}
+
+
+@app.get("/health/hls-retention")
+def health_hls_retention():
+    """Debug-endpoint: seneste oprydningsrunde i HLS_DIR og frigjorte bytes i alt."""
+    return {"status": "ok", "retention": livestream.hls_retention.stats()}
+
+
+@app.get("/health/remote-desktop")
+def health_remote_desktop(user=Depends(get_current_superadmin_user)):
+    """Debug-endpoint (superadmin): udgående kø-dybde og droppede frames pr. browser-session."""
+    return {"status": "ok", "remote_desktop": remote_desktop_stats()}
+
+
+@app.get("/health/terminal")
+def health_terminal(user=Depends(get_current_superadmin_user)):
+    """Debug-endpoint (superadmin): ventende output, ack-vindue og pauser pr. terminal-session."""
+    return {"status": "ok", "terminal": terminal_stats()}
+
+
+@app.get("/health/event-loop")
+def health_event_loop():
+    """Debug-endpoint: hvor længe event-loopet har været blokeret (fx af synkrone DB-kald)."""
+    return {"status": "ok", "event_loop": loop_monitor.stats()}
+
+
+@app.get("/health/relay-bus")
+def health_relay_bus():
+    """Debug-endpoint: pub/sub-backend mellem workers, kanaler og presence."""
+    return {"status": "ok", "relay_bus": relay_bus.stats()}
+
+
+@app.get("/health/ll-hls")
+def health_ll_hls():
+    """Debug-endpoint: LL-HLS-klienter, ventende dele og blokerende reloads."""
+    return {"status": "ok", "ll_hls": ll_hls.stats()}
+
+
+@app.get("/health/principal-cache")
+def health_principal_cache():
+    """Debug-endpoint: hit/miss-tællere for auth-principal-cachen."""
+    return {"status": "ok", "cache": principal_cache_stats()}
+
+
 @app.get("/")
 def read_root():
     return {"message": "Kulturskole Infoskaerm Backend kører"}
@@ -1,6 +1,7 @@
 from sqlmodel import SQLModel, Field, Column, JSON
+from sqlalchemy import Index, UniqueConstraint
 from typing import Optional, Dict, Any
-from datetime import datetime, timezone
+from datetime import date as date_type, datetime, timezone
 from enum import Enum
 
 
@@ -74,6 +75,12 @@ class ClientBase(SQLModel):
 
 
 class Client(ClientBase, table=True):
+    # Dækker dashboard-listen: filter på status/skole og ORDER BY sort_order.
+    # Oprettes også for eksisterende databaser i db.create_db_and_tables().
+    __table_args__ = (
+        Index("ix_client_status_school_sort", "status", "school_id", "sort_order"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     # Client-secret bruges af nye klienter installeret via enrollment-token.
     # Eksisterende klienter med admin-login virker fortsat bagudkompatibelt.
@@ -225,6 +232,30 @@ class ClientRead(ClientBase):
     client_update_error: Optional[str] = None
 
 
+class ClientListItem(SQLModel):
+    """
+    Slank projektion til listevisninger (/clients/?view=list, /clients/me?view=list).
+
+    Indeholder kun de felter ClientInfoPage og CalendarPage bruger, så listen
+    ikke skal hente ~80 kolonner inkl. diagnostik og display-opløsning pr. række.
+    """
+    id: int
+    name: str
+    locality: Optional[str] = None
+    status: Optional[str] = "pending"
+    school_id: Optional[int] = None
+    sort_order: Optional[int] = None
+    isOnline: Optional[bool] = False
+    last_seen: Optional[datetime] = None
+    state: Optional[str] = "normal"
+    machine_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+    wifi_ip_address: Optional[str] = None
+    wifi_mac_address: Optional[str] = None
+    lan_ip_address: Optional[str] = None
+    lan_mac_address: Optional[str] = None
+
+
 class ClientCreate(ClientBase):
     machine_id: Optional[str] = None
     sort_order: Optional[int] = None
@@ -379,12 +410,48 @@ class EnrollmentToken(SQLModel, table=True):
 
 
 class CalendarMarking(SQLModel, table=True):
+    """
+    Legacy: én JSON-blob pr. (klient, sæson). Rækkerne flyttes til CalendarDay
+    ved opstart (se db._migrate_calendar_markings_to_days) og bruges ikke længere.
+    """
     id: Optional[int] = Field(default=None, primary_key=True)
     season: str = Field(index=True)
     client_id: int = Field(index=True)
     markings: Dict[str, Any] = Field(sa_column=Column(JSON))
 
 
+class CalendarDay(SQLModel, table=True):
+    """Én kalenderdag pr. (klient, dato). Læs/skriv via calendar_store."""
+    __table_args__ = (
+        UniqueConstraint("client_id", "date", name="uq_calendarday_client_date"),
+        Index("ix_calendarday_season_client", "season", "client_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    client_id: int
+    date: date_type
+    season: str
+    status: Optional[str] = None
+    on_time: Optional[str] = None
+    off_time: Optional[str] = None
+    # Øvrige nøgler fra frontendens dag-objekt, så formatet bevares uændret.
+    extra: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+
+
+class SchedulePublishStatus(SQLModel, table=True):
+    """Seneste levering af kalenderen til kiosk-agenten (se schedule_publisher)."""
+    client_id: int = Field(primary_key=True)
+    season: Optional[str] = None
+    # queued | sending | retrying | delivered | failed | skipped
+    status: str = "queued"
+    attempts: int = 0
+    last_error: Optional[str] = None
+    queued_at: Optional[datetime] = None
+    last_attempt_at: Optional[datetime] = None
+    next_attempt_at: Optional[datetime] = None
+    delivered_at: Optional[datetime] = None
+
+
 class Holiday(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     date: str = Field(index=True)
@@ -0,0 +1,434 @@
+"""
+relay_bus.py
+
+Pub/sub-lag mellem uvicorn-workers for remote desktop, terminal og
+livestream (WebSocket-relæ og HLS-tilstand).
+
+Tidligere lå AGENTS/BROWSERS/CLIENTS og livestream-rum kun i processens
+hukommelse, så en browser og en agent på hver sin worker aldrig fandt
+hinanden, og render.yaml måtte låse backend til --workers 1. Nu:
+
+- WebSocket-forbindelser ejes stadig af den worker de er forbundet til,
+  men beskeder sendes via kanaler ("rd:agent:12", "term:browser:<sid>", ...)
+  som den ejende worker abonnerer på,
+- presence ("er agenten for klient 12 forbundet, og hvor stor er skærmen?")
+  er et replikeret map, som hver worker holder opdateret via bussen og
+  genudsender med jævne mellemrum (entries fra døde workers udløber),
+- broadcast() sender kun til de andre workers; bruges til at holde
+  in-memory caches (HLS-indeks, manifest-cache, LL-HLS) i sync.
+
+Backends (RELAY_BUS):
+- memory   (default): én proces, leverer direkte til lokale abonnenter.
+- postgres: LISTEN/NOTIFY på kanalen relay_bus. Payloads over NOTIFY's
+  8000-byte-grænse deles i bidder og samles igen. Kræver en direkte
+  (ikke PgBouncer transaction-pooled) forbindelse; sæt evt.
+  RELAY_BUS_DATABASE_URL til Neons unpooled URL.
+
+SQLite har ingen notifikation mellem processer; der bruges memory.
+
+Backend skal stadig køre med --workers 1. Bussen dækker relæerne og
+HLS-tilstanden, men følgende er fortsat pr. proces og går ikke via bussen:
+- heartbeat_buffer og client_change_bus (SSE-status/online-beregning),
+- chrome_command_signals (long-poll-vækning),
+- principal-cachen i auth.py og dens invalidate_*-kald,
+- holiday-/sæson-cachen i season_calendar.py (ingen TTL),
+- schedule_publishers jobkø.
+Først når de også fordeles (eller flyttes ud af processen), må
+--workers hæves.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from db import DATABASE_URL, _normalize_database_url
+
+RELAY_BUS = os.getenv("RELAY_BUS", "memory").strip().lower()
+PRESENCE_TTL_SECONDS = 90
+_PRESENCE_REFRESH_SECONDS = 30
+_PRESENCE_CHANNEL = "__presence__"
+
+# Handlere får en dict, eller bytes for binære beskeder (send_bytes).
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class RelayBus:
+    """In-memory bus. Basisklasse for backends der også sender til andre workers."""
+
+    backend = "memory"
+    # True når der kan være andre workers, der skal have broadcast().
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._handlers: Dict[str, Set[Handler]] = {}
+        self._presence: Dict[str, Dict[str, Any]] = {}
+        # meta["group"] -> nøgler, fx alle browsere for én klient.
+        self._groups: Dict[str, Set[str]] = {}
+        self._own_presence: Dict[str, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: list[asyncio.Task] = []
+        self.stats_counters = {"published": 0, "delivered": 0, "remote_sent": 0, "remote_received": 0, "handler_errors": 0}
+
+    # -- livscyklus (lifespan i main.py) ---------------------------------------
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        for key in list(self._own_presence):
+            await self.clear_presence(key)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        self._loop = None
+
+    # -- abonnementer ----------------------------------------------------------
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self._handlers[channel]
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        """Lever til abonnenter på alle workers (også denne)."""
+        self.stats_counters["published"] += 1
+        await self._dispatch(channel, message)
+        await self._send_remote(channel, message)
+
+    async def send(self, channel: str, message: Dict[str, Any]) -> bool:
+        """
+        Punkt-til-punkt: channel er også modtagerens presence-nøgle. Ejes
+        modtageren af denne worker, leveres direkte uden om backenden.
+        False hvis modtageren ikke er forbundet nogen steder.
+        """
+        entry = self.get_presence(channel)
+        if entry is None:
+            return False
+        self.stats_counters["published"] += 1
+        if entry.get("worker") == self.worker_id:
+            await self._dispatch(channel, message)
+        else:
+            await self._send_remote(channel, message)
+        return True
+
+    async def send_bytes(self, channel: str, data: bytes) -> bool:
+        """
+        Som send(), men for binære beskeder (fx remote desktop-frames). Lokalt
+        leveres de samme bytes uændret; til andre workers base64-kodes de.
+        """
+        entry = self.get_presence(channel)
+        if entry is None:
+            return False
+        self.stats_counters["published"] += 1
+        if entry.get("worker") == self.worker_id:
+            await self._dispatch(channel, data)
+        else:
+            await self._send_remote(channel, {"_bytes": base64.b64encode(data).decode("ascii")})
+        return True
+
+    async def broadcast(self, channel: str, message: Dict[str, Any]) -> None:
+        """Lever kun til de andre workers (denne har allerede opdateret sig selv)."""
+        await self._send_remote(channel, message)
+
+    async def _dispatch(self, channel: str, message: Any) -> None:
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(message)
+                self.stats_counters["delivered"] += 1
+            except Exception as e:
+                self.stats_counters["handler_errors"] += 1
+                print(f"[RELAY] Fejl i handler for {channel}: {e!r}", flush=True)
+
+    async def _send_remote(self, channel: str, message: Dict[str, Any]) -> None:
+        """Memory-backenden har ingen andre workers."""
+
+    async def _on_remote(self, origin: str, channel: str, message: Dict[str, Any]) -> None:
+        if origin == self.worker_id:
+            return
+        self.stats_counters["remote_received"] += 1
+        if channel != _PRESENCE_CHANNEL:
+            if "_bytes" in message:
+                await self._dispatch(channel, base64.b64decode(message["_bytes"]))
+            else:
+                await self._dispatch(channel, message)
+            return
+        op = message.get("op")
+        key = message.get("key")
+        if op == "set" and key:
+            self._put_presence(key, message["entry"])
+        elif op == "clear" and key:
+            entry = self._presence.get(key)
+            if entry is not None and entry.get("worker") == origin:
+                self._drop_presence(key)
+        elif op == "sync":
+            for own_key, entry in list(self._own_presence.items()):
+                await self._send_remote(_PRESENCE_CHANNEL, {"op": "set", "key": own_key, "entry": entry})
+
+    # -- presence --------------------------------------------------------------
+    def _put_presence(self, key: str, entry: Dict[str, Any]) -> None:
+        old = self._presence.get(key)
+        if old is not None and old.get("group") != entry.get("group"):
+            self._drop_presence(key)
+        self._presence[key] = entry
+        group = entry.get("group")
+        if group:
+            self._groups.setdefault(group, set()).add(key)
+
+    def _drop_presence(self, key: str) -> None:
+        entry = self._presence.pop(key, None)
+        group = entry.get("group") if entry is not None else None
+        if group and group in self._groups:
+            self._groups[group].discard(key)
+            if not self._groups[group]:
+                del self._groups[group]
+
+    async def set_presence(self, key: str, meta: Dict[str, Any]) -> None:
+        """meta["group"] (valgfri) gør nøglen opslagbar med presence_in_group()."""
+        entry = {**meta, "worker": self.worker_id, "ts": time.time()}
+        self._own_presence[key] = entry
+        self._put_presence(key, entry)
+        await self._send_remote(_PRESENCE_CHANNEL, {"op": "set", "key": key, "entry": entry})
+
+    async def clear_presence(self, key: str) -> None:
+        if self._own_presence.pop(key, None) is None:
+            return
+        entry = self._presence.get(key)
+        if entry is not None and entry.get("worker") == self.worker_id:
+            self._drop_presence(key)
+        await self._send_remote(_PRESENCE_CHANNEL, {"op": "clear", "key": key})
+
+    def get_presence(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._presence.get(key)
+        if entry is None:
+            return None
+        if entry.get("worker") != self.worker_id and time.time() - entry.get("ts", 0) > PRESENCE_TTL_SECONDS:
+            return None
+        return entry
+
+    def presence_in_group(self, group: str) -> Dict[str, Dict[str, Any]]:
+        """Levende presence-nøgler med meta["group"] == group; O(gruppens størrelse)."""
+        return {
+            key: entry for key in list(self._groups.get(group, ()))
+            if (entry := self.get_presence(key)) is not None
+        }
+
+    async def _refresh_presence_loop(self) -> None:
+        while True:
+            await asyncio.sleep(_PRESENCE_REFRESH_SECONDS)
+            now = time.time()
+            for key, entry in list(self._own_presence.items()):
+                entry["ts"] = now
+                await self._send_remote(_PRESENCE_CHANNEL, {"op": "set", "key": key, "entry": entry})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "worker_id": self.worker_id,
+            "channels": len(self._handlers),
+            "subscriptions": sum(len(h) for h in self._handlers.values()),
+            "presence": len(self._presence),
+            "own_presence": len(self._own_presence),
+            **self.stats_counters,
+        }
+
+
+class PostgresRelayBus(RelayBus):
+    """LISTEN/NOTIFY. Én lyttetråd og én afsender-task pr. worker."""
+
+    backend = "postgres"
+    distributed = True
+    PG_CHANNEL = "relay_bus"
+    # NOTIFY-payload skal være under 8000 bytes; json med ensure_ascii er 1 byte/tegn.
+    CHUNK_CHARS = 7000
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self._dsn = dsn
+        self._outbox: Optional[asyncio.Queue] = None
+        self._inbox: Optional[asyncio.Queue] = None
+        self._stop = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+        self._send_conn = None
+        self._chunks: Dict[tuple, Dict[int, str]] = {}
+        # Postgres slår ens NOTIFY'er (kanal + payload) i samme transaktion
+        # sammen; løbenummeret "s" gør hver besked unik.
+        self._seq = 0
+        self.stats_counters.update({"notify_batches": 0, "chunked": 0, "reconnects": 0})
+
+    async def start(self) -> None:
+        await super().start()
+        self._outbox = asyncio.Queue()
+        self._inbox = asyncio.Queue()
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, name="relay-bus-listen", daemon=True)
+        self._listener.start()
+        self._tasks = [
+            asyncio.create_task(self._sender()),
+            asyncio.create_task(self._receiver()),
+            asyncio.create_task(self._refresh_presence_loop()),
+        ]
+        # Bed de andre workers om deres presence, så status er korrekt fra start.
+        await self._send_remote(_PRESENCE_CHANNEL, {"op": "sync"})
+
+    async def stop(self) -> None:
+        for key in list(self._own_presence):
+            await self.clear_presence(key)
+        # Giv afsenderen et øjeblik til at sende clear-beskederne.
+        if self._outbox is not None:
+            for _ in range(20):
+                if self._outbox.empty():
+                    break
+                await asyncio.sleep(0.05)
+        self._stop.set()
+        await super().stop()
+        if self._send_conn is not None:
+            try:
+                self._send_conn.close()
+            except Exception:
+                pass
+            self._send_conn = None
+
+    # -- afsendelse -------------------------------------------------------------
+    def _encode(self, channel: str, message: Dict[str, Any]) -> list[str]:
+        self._seq += 1
+        body = json.dumps(
+            {"w": self.worker_id, "s": self._seq, "c": channel, "m": message},
+            ensure_ascii=True, separators=(",", ":"),
+        )
+        if len(body) <= self.CHUNK_CHARS:
+            return [body]
+        self.stats_counters["chunked"] += 1
+        msg_id = uuid.uuid4().hex[:12]
+        pieces = [body[i:i + self.CHUNK_CHARS] for i in range(0, len(body), self.CHUNK_CHARS)]
+        return [
+            json.dumps({"w": self.worker_id, "id": msg_id, "i": i, "n": len(pieces), "d": piece},
+                       ensure_ascii=True, separators=(",", ":"))
+            for i, piece in enumerate(pieces)
+        ]
+
+    async def _send_remote(self, channel: str, message: Dict[str, Any]) -> None:
+        if self._outbox is None:
+            return
+        self.stats_counters["remote_sent"] += 1
+        self._outbox.put_nowait(self._encode(channel, message))
+
+    async def _sender(self) -> None:
+        """Sender i rækkefølge; alt der har hobet sig op sendes i én transaktion."""
+        while True:
+            batch = [await self._outbox.get()]
+            while not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            payloads = [p for item in batch for p in item]
+            try:
+                await asyncio.to_thread(self._notify, payloads)
+                self.stats_counters["notify_batches"] += 1
+            except Exception as e:
+                print(f"[RELAY] NOTIFY fejlede ({len(payloads)} beskeder tabt): {e!r}", flush=True)
+                self._send_conn = None
+
+    def _connect(self):
+        import psycopg2
+
+        return psycopg2.connect(self._dsn)
+
+    def _notify(self, payloads: list[str]) -> None:
+        if self._send_conn is None or self._send_conn.closed:
+            self._send_conn = self._connect()
+        with self._send_conn.cursor() as cur:
+            for payload in payloads:
+                cur.execute("SELECT pg_notify(%s, %s)", (self.PG_CHANNEL, payload))
+        self._send_conn.commit()
+
+    # -- modtagelse -------------------------------------------------------------
+    def _listen(self) -> None:
+        """Lyttetråd: LISTEN og videresend notifikationer til event-loopet."""
+        loop = self._loop
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.PG_CHANNEL}")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        loop.call_soon_threadsafe(self._inbox.put_nowait, notify.payload)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.stats_counters["reconnects"] += 1
+                print(f"[RELAY] LISTEN-forbindelse fejlede: {e!r} — forbinder igen", flush=True)
+                self._stop.wait(2.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    async def _receiver(self) -> None:
+        while True:
+            raw = await self._inbox.get()
+            try:
+                envelope = self._decode(raw)
+                if envelope is not None:
+                    await self._on_remote(envelope["w"], envelope["c"], envelope["m"])
+            except Exception as e:
+                print(f"[RELAY] Ugyldig besked på bussen: {e!r}", flush=True)
+
+    def _decode(self, raw: str) -> Optional[Dict[str, Any]]:
+        data = json.loads(raw)
+        if data.get("w") == self.worker_id:
+            return None
+        if "id" not in data:
+            return data
+        key = (data["w"], data["id"])
+        parts = self._chunks.setdefault(key, {})
+        parts[data["i"]] = data["d"]
+        if len(parts) < data["n"]:
+            # Halvfærdige beskeder fra en død afsender må ikke hobe sig op.
+            if len(self._chunks) > 256:
+                self._chunks.pop(next(iter(self._chunks)))
+            return None
+        del self._chunks[key]
+        return json.loads("".join(parts[i] for i in range(data["n"])))
+
+
+def _postgres_dsn() -> Optional[str]:
+    url = _normalize_database_url(os.getenv("RELAY_BUS_DATABASE_URL") or DATABASE_URL)
+    if not url.startswith("postgresql"):
+        return None
+    # SQLAlchemy-driverangivelse (postgresql+psycopg2://) forstås ikke af libpq.
+    _, rest = url.split("://", 1)
+    return "postgresql://" + rest
+
+
+def create_relay_bus() -> RelayBus:
+    if RELAY_BUS == "postgres":
+        dsn = _postgres_dsn()
+        if dsn is not None:
+            return PostgresRelayBus(dsn)
+        print("[RELAY] RELAY_BUS=postgres kræver en PostgreSQL DATABASE_URL — bruger memory", flush=True)
+    elif RELAY_BUS != "memory":
+        print(f"[RELAY] Ukendt RELAY_BUS={RELAY_BUS!r} — bruger memory", flush=True)
+    return RelayBus()
+
+
+relay_bus = create_relay_bus()
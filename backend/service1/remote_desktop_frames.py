@@ -0,0 +1,100 @@
+"""
+remote_desktop_frames.py
+
+Binær sub-protokol for skærmbilleder i remote desktop.
+
+Agenten sendte hver frame som {"type": "frame", "data": "<base64 JPEG>"} i en
+tekst-frame. Backend parsede JSON, serialiserede igen pr. browser, og base64
+fylder 33 % mere. Nu kan agenten sende billeder som binære WebSocket-frames:
+
+    offset  størrelse  felt
+    0       1          version (FRAME_VERSION)
+    1       1          type (FRAME_JPEG, FRAME_TILE, ...)
+    2       16         session_id (uuid4 hex som 16 rå bytes)
+    18      4          seq (uint32, big endian)
+    22      2+2+2+2    x, y, width, height (uint16) — hele frames: 0, 0, skærm
+    30      ...        billeddata (JPEG/PNG), uændret
+
+Backend læser kun headeren for at finde browser-sessionen og videresender
+de samme bytes med send_bytes. JSON-tekstframes virker stadig for ældre
+agenter; browseren melder binary=true i start_stream.
+
+Delt stream (agenter der melder shared_stream=true i hello):
+- FRAME_JPEG er en keyframe (hele skærmen), FRAME_TILE et ændret område
+  (x, y, width, height) oven på den seneste keyframe,
+- session_id BROADCAST_SESSION_ID betyder "alle viewers af klienten";
+  backend cacher keyframe + tiles (remote_desktop_keyframes.py) og sender
+  dem straks til nye viewers.
+"""
+
+from __future__ import annotations
+
+import struct
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+FRAME_VERSION = 1
+
+FRAME_JPEG = 1
+FRAME_TILE = 2
+
+# Nul-UUID: framen gælder alle browser-sessioner for klienten.
+BROADCAST_SESSION_ID = "0" * 32
+
+HEADER = struct.Struct("!BB16sIHHHH")
+HEADER_SIZE = HEADER.size  # 30
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    version: int
+    type: int
+    session_id: str
+    seq: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def session_id_bytes(session_id: str) -> bytes:
+    return uuid.UUID(hex=session_id).bytes
+
+
+def pack_frame(
+    frame_type: int,
+    session_id: str,
+    seq: int,
+    payload: bytes,
+    x: int = 0,
+    y: int = 0,
+    width: int = 0,
+    height: int = 0,
+) -> bytes:
+    header = HEADER.pack(
+        FRAME_VERSION, frame_type, session_id_bytes(session_id),
+        seq & 0xFFFFFFFF, x, y, width, height,
+    )
+    return header + payload
+
+
+def parse_header(data: bytes) -> Optional[FrameHeader]:
+    """None hvis framen er for kort eller har en ukendt version."""
+    if len(data) < HEADER_SIZE or data[0] != FRAME_VERSION:
+        return None
+    version, frame_type, sid, seq, x, y, width, height = HEADER.unpack_from(data)
+    return FrameHeader(version, frame_type, sid.hex(), seq, x, y, width, height)
+
+
+def frame_session_id(data: bytes) -> Optional[str]:
+    """Kun session_id; bruges på relæets varme sti uden at pakke resten ud."""
+    if len(data) < HEADER_SIZE or data[0] != FRAME_VERSION:
+        return None
+    return data[2:18].hex()
+
+
+def frame_type(data: bytes) -> Optional[int]:
+    if len(data) < HEADER_SIZE or data[0] != FRAME_VERSION:
+        return None
+    return data[1]
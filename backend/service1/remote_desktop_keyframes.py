@@ -0,0 +1,130 @@
+"""
+remote_desktop_keyframes.py
+
+Keyframe-cache for delte remote desktop-streams.
+
+Tidligere startede hver browser-session sin egen stream på agenten, og en
+ny viewer ventede på en hel skærm-frame. Med en delt stream sender agenten
+én keyframe (FRAME_JPEG) og derefter kun ændrede tiles (FRAME_TILE) til
+alle viewers. Den worker der har agenten, gemmer pr. klient:
+
+- den seneste keyframe,
+- de tiles der er kommet siden, i rækkefølge.
+
+En ny viewer får keyframe + tiles med det samme og har dermed samme billede
+som de andre. Backend afkoder ikke billederne; browseren lægger tiles oven
+på keyframen. Kæden er begrænset: bliver den længere end
+REMOTE_DESKTOP_TILE_CHAIN_MAX tiles eller større end keyframen selv, smides
+cachen væk, og agenten bedes om en ny keyframe. Indtil den kommer, caches
+intet, og nye viewers venter på keyframen. Kommer der ikke en keyframe
+inden for REMOTE_DESKTOP_KEYFRAME_RETRY_MS, spørges der igen.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from db import _env_int
+from remote_desktop_frames import FRAME_JPEG, FRAME_TILE, frame_type
+
+REMOTE_DESKTOP_TILE_CHAIN_MAX = _env_int("REMOTE_DESKTOP_TILE_CHAIN_MAX", 120, min_value=1)
+REMOTE_DESKTOP_KEYFRAME_RETRY_MS = _env_int("REMOTE_DESKTOP_KEYFRAME_RETRY_MS", 2000, min_value=100)
+
+
+@dataclass
+class _Stream:
+    keyframe: Optional[bytes] = None
+    tiles: List[bytes] = field(default_factory=list)
+    tile_bytes: int = 0
+    updated: float = field(default_factory=time.time)
+    # Hvornår agenten sidst blev bedt om en keyframe (0 = ingen udestående).
+    keyframe_requested_at: float = 0.0
+
+
+class KeyframeCache:
+    def __init__(
+        self,
+        chain_max: int = REMOTE_DESKTOP_TILE_CHAIN_MAX,
+        retry_ms: int = REMOTE_DESKTOP_KEYFRAME_RETRY_MS,
+    ):
+        self.chain_max = chain_max
+        self.retry = retry_ms / 1000
+        self._streams: Dict[int, _Stream] = {}
+        self.stats_counters = {
+            "keyframes": 0,
+            "tiles": 0,
+            "tiles_without_keyframe": 0,
+            "chains_dropped": 0,
+            "replays": 0,
+            "keyframe_requests": 0,
+        }
+
+    def record(self, client_id: int, data: bytes) -> bool:
+        """
+        Registrér en frame fra agenten. True hvis agenten skal bedes om en
+        ny keyframe (kæden blev for lang, eller der mangler en keyframe og
+        sidste anmodning er ubesvaret i mere end retry).
+        """
+        stream = self._streams.get(client_id)
+        if stream is None:
+            stream = self._streams[client_id] = _Stream()
+        stream.updated = time.time()
+        kind = frame_type(data)
+
+        if kind == FRAME_JPEG:
+            stream.keyframe = data
+            stream.tiles = []
+            stream.tile_bytes = 0
+            stream.keyframe_requested_at = 0.0
+            self.stats_counters["keyframes"] += 1
+            return False
+
+        if kind != FRAME_TILE:
+            return False
+        if stream.keyframe is None:
+            # En tile uden keyframe kan ingen viewer bruge.
+            self.stats_counters["tiles_without_keyframe"] += 1
+            return self._request_keyframe(stream)
+
+        stream.tiles.append(data)
+        stream.tile_bytes += len(data)
+        self.stats_counters["tiles"] += 1
+        if len(stream.tiles) > self.chain_max or stream.tile_bytes > len(stream.keyframe):
+            # Stop med at cache; nye viewers venter på næste keyframe.
+            stream.keyframe = None
+            stream.tiles = []
+            stream.tile_bytes = 0
+            self.stats_counters["chains_dropped"] += 1
+            return self._request_keyframe(stream)
+        return False
+
+    def _request_keyframe(self, stream: _Stream) -> bool:
+        now = time.time()
+        if stream.keyframe_requested_at and now - stream.keyframe_requested_at < self.retry:
+            return False
+        stream.keyframe_requested_at = now
+        self.stats_counters["keyframe_requests"] += 1
+        return True
+
+    def replay(self, client_id: int) -> List[bytes]:
+        """Keyframe + tiles siden, eller [] hvis der ingen keyframe er."""
+        stream = self._streams.get(client_id)
+        if stream is None or stream.keyframe is None:
+            return []
+        self.stats_counters["replays"] += 1
+        return [stream.keyframe, *stream.tiles]
+
+    def drop(self, client_id: int) -> None:
+        self._streams.pop(client_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "bytes": sum(
+                len(s.keyframe or b"") + s.tile_bytes for s in self._streams.values()
+            ),
+            "chain_max": self.chain_max,
+            **self.stats_counters,
+        }
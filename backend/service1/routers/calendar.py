@@ -1,14 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import select, delete
-from models import CalendarMarking, Client
+from sqlmodel import select
+from models import Client
 from db import get_session
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
-from datetime import datetime, date
-import ipaddress
-import requests
+from datetime import date
 from auth import get_current_user, get_current_admin_user, get_current_user_or_client, require_client_self_or_user, principal_is_client
+import calendar_store
+from season_calendar import current_season, get_season_calendar
+from schedule_publisher import schedule_publisher, mark_queued, list_status
 
 router = APIRouter()
 
@@ -17,42 +18,8 @@ class MarkedDaysRequest(BaseModel):
     markedDays: Dict[str, Dict[str, Any]]
     clients: List[int]
     season: str                              # fx "2025/2026"
-
-
-def parse_iso8601_keys(d: Dict[str, Any]) -> Dict[str, Any]:
-    out = {}
-    for k, v in d.items():
-        try:
-            datetime.fromisoformat(k)
-            out[k] = v
-        except (ValueError, TypeError):
-            pass
-    return out
-
-
-def _is_safe_private_ip(ip_str: str) -> bool:
-    try:
-        addr = ipaddress.ip_address(ip_str)
-        return addr.is_private or addr.is_loopback
-    except ValueError:
-        return False
-
-
-def publish_schedule_for_client(client: Client, markings: Dict[str, Any]):
-    client_ip = client.lan_ip_address or client.wifi_ip_address
-    if not client_ip:
-        print(f"Klient {client.id} har ingen IP-adresse")
-        return
-    if not _is_safe_private_ip(client_ip):
-        print(f"SSRF-advarsel: Klient {client.id} har offentlig IP ({client_ip}) — afviser")
-        return
-    url = f"http://{client_ip}:8000/api/update_schedule"
-    try:
-        resp = requests.post(url, json={"markedDays": markings}, timeout=5)
-        resp.raise_for_status()
-        print(f"Sendt kalender til klient {client.id} ({url})")
-    except Exception as e:
-        print(f"Fejl ved send til klient {client.id} ({url}): {e}")
+    # True: kun de medsendte dage gemmes; øvrige dage i sæsonen bevares.
+    partial: bool = False
 
 
 def _validate_season(season: str) -> str:
@@ -69,6 +36,22 @@ def _validate_season(season: str) -> str:
     return season
 
 
+def _validate_days_in_season(session, season: str, marked_days: Dict[str, Dict[str, Any]]) -> None:
+    """Afvis datoer uden for sæsonen (1. aug – 31. jul). Ikke-ISO nøgler ignoreres som før."""
+    calendar = get_season_calendar(session, season)
+    outside = sorted({
+        day.isoformat()
+        for markings in marked_days.values()
+        for key in markings
+        if (day := calendar_store.parse_day_key(key)) is not None and not calendar.contains(day)
+    })
+    if outside:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{len(outside)} dato(er) ligger uden for sæson {season}, fx {outside[0]}",
+        )
+
+
 @router.post("/calendar/marked-days")
 def save_marked_days(
     data: MarkedDaysRequest,
@@ -76,6 +59,7 @@ def save_marked_days(
     user=Depends(get_current_admin_user)
 ):
     _validate_season(data.season)
+    _validate_days_in_season(session, data.season, data.markedDays)
     for client_id in data.clients:
         client = session.get(Client, client_id)
         if not client:
@@ -84,28 +68,43 @@ def save_marked_days(
             raise HTTPException(status_code=403, detail="Du har kun adgang til klienter i din egen skole")
     try:
         for client_id in data.clients:
-            markings = parse_iso8601_keys(data.markedDays.get(str(client_id), {}))
-            existing = session.exec(
-                select(CalendarMarking).where(
-                    CalendarMarking.season == data.season,
-                    CalendarMarking.client_id == client_id
-                )
-            ).first()
-            if existing:
-                existing.markings = markings
-                session.add(existing)
-            else:
-                session.add(CalendarMarking(
-                    season=data.season, client_id=client_id, markings=markings
-                ))
+            calendar_store.save_season(
+                session, client_id, data.season,
+                data.markedDays.get(str(client_id), {}),
+                partial=data.partial,
+            )
+            mark_queued(session, client_id, data.season)
         session.commit()
-        for client_id in data.clients:
-            client = session.exec(select(Client).where(Client.id == client_id)).first()
-            if client:
-                publish_schedule_for_client(client, data.markedDays.get(str(client_id), {}))
-        return {"ok": True}
     except SQLAlchemyError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # Levering til kiosk-agenterne sker i baggrunden; status via /calendar/publish-status.
+    schedule_publisher.enqueue(data.clients, data.season)
+    return {"ok": True, "publish": "queued"}
+
+
+@router.get("/calendar/publish-status")
+def get_publish_status(
+    client_ids: List[int] = Query(..., description="Klient-id'er, fx ?client_ids=1&client_ids=2"),
+    session=Depends(get_session),
+    user=Depends(get_current_user)
+):
+    """Seneste leveringsstatus for kalenderen pr. klient."""
+    if not getattr(user, "is_superadmin", False):
+        allowed = set(session.exec(
+            select(Client.id).where(Client.id.in_(client_ids), Client.school_id == user.school_id)
+        ).all())
+        if set(client_ids) - allowed:
+            raise HTTPException(status_code=403, detail="Du har kun adgang til klienter i din egen skole")
+    return {"statuses": list_status(session, client_ids)}
+
+
+def _parse_date_param(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    parsed = calendar_store.parse_day_key(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Ugyldig {name} — brug format YYYY-MM-DD")
+    return parsed
 
 
 @router.get("/calendar/marked-days")
@@ -127,27 +126,14 @@ def get_marked_days(
             raise HTTPException(status_code=404, detail="Klient ikke fundet")
         if not getattr(principal, "is_superadmin", False) and client.school_id != principal.school_id:
             raise HTTPException(status_code=403, detail="Du har kun adgang til klienter i din egen skole")
-    existing = session.exec(
-        select(CalendarMarking).where(
-            CalendarMarking.season == season,
-            CalendarMarking.client_id == client_id
-        )
-    ).first()
-    markings = existing.markings if existing else {}
-    formatted = {}
-    for k, v in markings.items():
-        try:
-            parsed = datetime.fromisoformat(k)
-            iso_key = parsed.strftime("%Y-%m-%dT00:00:00")
-            iso_date = iso_key[:10]
-            if start_date and iso_date < start_date:
-                continue
-            if end_date and iso_date > end_date:
-                continue
-            formatted[iso_key] = v
-        except Exception:
-            formatted[str(k)] = v
-    return {"markedDays": formatted}
+    # Datovinduet filtreres i SQL på (client_id, date), så én uge ikke koster en hel sæson.
+    marked_days = calendar_store.read_days(
+        session, client_id,
+        season=season,
+        start=_parse_date_param(start_date, "start_date"),
+        end=_parse_date_param(end_date, "end_date"),
+    )
+    return {"markedDays": marked_days}
 
 
 @router.get("/calendar/seasons")
@@ -169,18 +155,14 @@ def get_seasons_list(principal=Depends(get_current_user_or_client)):
 
 @router.get("/calendar/season")
 def get_current_season(principal=Depends(get_current_user_or_client)):
-    today = date.today()
-    if today.month >= 8:
-        season_start, season_end = today.year, today.year + 1
-    else:
-        season_start, season_end = today.year - 1, today.year
-    season_str = f"{season_start}/{season_end}"
+    season_str = current_season()
+    season_start = int(season_str.split("/")[0])
     return {
         "id": season_str,
         "label": season_str,
         "isCurrent": True,
         "start_date": date(season_start, 8, 1).isoformat(),
-        "end_date": date(season_end, 7, 31).isoformat(),
+        "end_date": date(season_start + 1, 7, 31).isoformat(),
     }
 
 
@@ -191,7 +173,7 @@ def cleanup_past_seasons(session=Depends(get_session), user=Depends(get_current_
         current_start = today.year if today.month >= 8 else today.year - 1
         old_start = current_start - 2
         season_to_delete = f"{old_start}/{old_start + 1}"
-        session.exec(delete(CalendarMarking).where(CalendarMarking.season == season_to_delete))
+        calendar_store.delete_season(session, season_to_delete)
         session.commit()
         return {"deleted_season": season_to_delete}
     return {"deleted_season": None, "message": "Ingen sæson slettet — ikke efter 10. august"}
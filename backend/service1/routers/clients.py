@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlmodel import select, delete
-from typing import List, Optional
-from datetime import datetime, timedelta, date, timezone
-from db import get_session
-from models import Client, ClientRead, ClientCreate, ClientUpdate, CalendarMarking, ChromeAction, School, SchoolSeasonTimes, EnrollmentToken
-from auth import get_current_user, get_current_admin_user, get_current_superadmin_user, get_current_user_or_client, require_client_self_or_user, principal_is_client, get_password_hash
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+from sqlalchemy import and_, or_, not_, case, func, true, false
+from typing import List, Literal, Optional, Union
+from datetime import datetime, timedelta, timezone
+from db import get_session, engine
+from models import Client, ClientRead, ClientListItem, ClientCreate, ClientUpdate, ChromeAction, School, SchoolSeasonTimes, EnrollmentToken
+from auth import get_current_user, get_current_admin_user, get_current_superadmin_user, get_current_user_or_client, require_client_self_or_user, principal_is_client, get_password_hash, invalidate_client_principal
 from models import utcnow
+from heartbeat_buffer import heartbeat_buffer, HEARTBEAT_BUFFER_ENABLED
+from client_events import client_change_bus, chrome_command_signals
+import calendar_store
+from season_calendar import current_season, get_season_calendar
+import asyncio
+import base64
 import os
 import glob
 import json
@@ -20,6 +30,13 @@ HLS_BASE_DIR = os.getenv("HLS_BASE_DIR", "/opt/render/project/src/backend/servic
 # den gamle adfærd.
 ONLINE_TIMEOUT_SECONDS = int(os.getenv("CLIENTFLOW_ONLINE_TIMEOUT_SECONDS", "120"))
 
+# SSE-kommentar sendes når intet er ændret, så proxies ikke lukker strømmen.
+SSE_KEEPALIVE_SECONDS = 15
+
+# Øvre grænse for long-poll af chrome-command (?wait=N). Hold den under
+# proxy/load balancer idle-timeout.
+CHROME_COMMAND_MAX_WAIT_SECONDS = 30
+
 VALID_CLIENT_STATES = {"normal", "sleeping", "wakeup", "shutdown", "error", "updating"}
 VALID_PENDING_CHROME_ACTION_SOURCES = {"actionbutton", "calendar"}
 
@@ -327,6 +344,23 @@ def is_online(client: Client) -> bool:
     return (now - last_seen) < timedelta(seconds=ONLINE_TIMEOUT_SECONDS)
 
 
+def online_clause(now: Optional[datetime] = None):
+    """
+    SQL-udgaven af is_online(): last_seen > now - ONLINE_TIMEOUT_SECONDS.
+
+    Kan bruges i where/order_by/group_by og som kolonne via
+    online_column(). Tærsklen beregnes én gang i Python, så udtrykket er
+    ens på PostgreSQL og SQLite.
+    """
+    threshold = (now or utcnow()) - timedelta(seconds=ONLINE_TIMEOUT_SECONDS)
+    return and_(Client.last_seen.is_not(None), Client.last_seen > threshold)
+
+
+def online_column(now: Optional[datetime] = None):
+    """online_clause() som boolsk kolonne 'isOnline' til select()."""
+    return case((online_clause(now), true()), else_=false()).label("isOnline")
+
+
 SYSTEM_TERMINAL_STEPS = {
     "system_reboot_countdown",
     "system_rebooting",
@@ -361,32 +395,196 @@ def is_step_from_previous_boot(client: Client) -> bool:
     return step_time is not None and step_time < (current_boot_time - timedelta(seconds=2))
 
 
+CLIENT_LIST_MAX_LIMIT = 500
+
+CLIENT_LIST_COLUMNS = tuple(
+    getattr(Client, name) for name in ClientListItem.model_fields if name != "isOnline"
+)
+
+
+def _client_list_order():
+    """Samme rækkefølge som den tidligere Python-sort: sort_order NULLS LAST, id."""
+    return (Client.sort_order.asc().nulls_last(), Client.id.asc())
+
+
+def _encode_client_cursor(sort_order: Optional[int], client_id: int) -> str:
+    raw = json.dumps([sort_order, client_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_client_cursor(cursor: str) -> tuple[Optional[int], int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_order, client_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (None if sort_order is None else int(sort_order)), int(client_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Ugyldig cursor")
+
+
+def _after_cursor_clause(sort_order: Optional[int], client_id: int):
+    """Keyset-betingelse for rækker efter (sort_order, id) med NULLS LAST."""
+    if sort_order is None:
+        return and_(Client.sort_order.is_(None), Client.id > client_id)
+    return or_(
+        Client.sort_order > sort_order,
+        and_(Client.sort_order == sort_order, Client.id > client_id),
+        Client.sort_order.is_(None),
+    )
+
+
+def _list_clients(
+    session,
+    response: Response,
+    *,
+    view: str,
+    status: Optional[str] = None,
+    school_id: Optional[int] = None,
+    online: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Fælles SQL-side listning til /clients/ og /clients/me.
+
+    Filtrering, sortering og pagination sker i databasen. view=list henter kun
+    ClientListItem-kolonnerne; view=full returnerer ClientRead som hidtil.
+    Næste side angives i response-headeren X-Next-Cursor.
+    """
+    now = utcnow()
+    if view == "list":
+        stmt = select(*CLIENT_LIST_COLUMNS, online_column(now))
+    else:
+        stmt = select(Client, online_column(now))
+    if status is not None:
+        stmt = stmt.where(Client.status == status)
+    if school_id is not None:
+        stmt = stmt.where(Client.school_id == school_id)
+    if online is not None:
+        stmt = stmt.where(online_clause(now) if online else not_(online_clause(now)))
+    if cursor:
+        stmt = stmt.where(_after_cursor_clause(*_decode_client_cursor(cursor)))
+    stmt = stmt.order_by(*_client_list_order())
+    if limit is not None:
+        # Hent én ekstra række for at vide, om der findes en næste side.
+        stmt = stmt.limit(limit + 1)
+
+    rows = session.exec(stmt).all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1] if view == "list" else rows[-1][0]
+        response.headers["X-Next-Cursor"] = _encode_client_cursor(last.sort_order, last.id)
+
+    if view == "list":
+        return [ClientListItem(**row._mapping) for row in rows]
+    # isOnline lægges på en kopi, så ORM-objekterne ikke markeres dirty.
+    return [
+        ClientRead.model_validate(client).model_copy(update={"isOnline": bool(online_flag)})
+        for client, online_flag in rows
+    ]
+
+
 @router.get("/clients/public")
 def get_clients_public(session=Depends(get_session)):
-    clients = session.exec(select(Client).where(Client.status == "approved")).all()
-    return {"clients": [{"id": c.id, "name": c.name} for c in clients]}
+    rows = session.exec(
+        select(Client.id, Client.name)
+        .where(Client.status == "approved")
+        .order_by(*_client_list_order())
+    ).all()
+    return {"clients": [{"id": row.id, "name": row.name} for row in rows]}
 
 
-@router.get("/clients/me", response_model=List[ClientRead])
-def get_clients_for_my_school(session=Depends(get_session), user=Depends(get_current_user)):
+@router.get("/clients/me", response_model=List[Union[ClientListItem, ClientRead]])
+def get_clients_for_my_school(
+    response: Response,
+    view: Literal["full", "list"] = Query("full"),
+    online: Optional[bool] = Query(None),
+    cursor: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=CLIENT_LIST_MAX_LIMIT),
+    session=Depends(get_session),
+    user=Depends(get_current_user),
+):
     if not user.school_id:
         return []
-    clients = session.exec(
-        select(Client).where(Client.status == "approved", Client.school_id == user.school_id)
-    ).all()
-    for client in clients:
-        client.isOnline = is_online(client)
-    clients.sort(key=lambda c: (c.sort_order is None, c.sort_order if c.sort_order is not None else 9999, c.id))
-    return clients
+    return _list_clients(
+        session, response,
+        view=view, status="approved", school_id=user.school_id,
+        online=online, cursor=cursor, limit=limit,
+    )
 
 
-@router.get("/clients/", response_model=List[ClientRead])
-def get_clients(session=Depends(get_session), user=Depends(get_current_user)):
-    clients = session.exec(select(Client)).all()
-    for client in clients:
-        client.isOnline = is_online(client)
-    clients.sort(key=lambda c: (c.sort_order is None, c.sort_order if c.sort_order is not None else 9999, c.id))
-    return clients
+@router.get("/clients/summary")
+def get_clients_summary(
+    school_id: Optional[int] = Query(None),
+    session=Depends(get_session),
+    user=Depends(get_current_user),
+):
+    """
+    Online/offline/sleeping-tællinger pr. skole til dashboard-headeren.
+
+    Én grupperet query over godkendte klienter. En online klient med
+    state='sleeping' tælles som sleeping, ikke som online.
+    Brugere (rolle 'bruger') ser kun egen skole; admins kan filtrere på school_id.
+    """
+    if not getattr(user, "is_admin", False):
+        if not user.school_id:
+            return {"schools": [], "totals": {"online": 0, "offline": 0, "sleeping": 0, "total": 0}}
+        school_id = user.school_id
+
+    online = online_clause()
+    sleeping = and_(online, Client.state == "sleeping")
+
+    def _count(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    stmt = (
+        select(
+            Client.school_id,
+            _count(and_(online, not_(sleeping))).label("online"),
+            _count(not_(online)).label("offline"),
+            _count(sleeping).label("sleeping"),
+            func.count().label("total"),
+        )
+        .where(Client.status == "approved")
+        .group_by(Client.school_id)
+        .order_by(Client.school_id.asc().nulls_last())
+    )
+    if school_id is not None:
+        stmt = stmt.where(Client.school_id == school_id)
+
+    schools = [
+        {
+            "school_id": row.school_id,
+            "online": int(row.online),
+            "offline": int(row.offline),
+            "sleeping": int(row.sleeping),
+            "total": int(row.total),
+        }
+        for row in session.exec(stmt).all()
+    ]
+    totals = {
+        key: sum(item[key] for item in schools)
+        for key in ("online", "offline", "sleeping", "total")
+    }
+    return {"schools": schools, "totals": totals}
+
+
+@router.get("/clients/", response_model=List[Union[ClientListItem, ClientRead]])
+def get_clients(
+    response: Response,
+    view: Literal["full", "list"] = Query("full"),
+    status: Optional[str] = Query(None),
+    school_id: Optional[int] = Query(None),
+    online: Optional[bool] = Query(None),
+    cursor: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=CLIENT_LIST_MAX_LIMIT),
+    session=Depends(get_session),
+    user=Depends(get_current_user),
+):
+    return _list_clients(
+        session, response,
+        view=view, status=status, school_id=school_id,
+        online=online, cursor=cursor, limit=limit,
+    )
 
 
 @router.get("/clients/{id}/", response_model=ClientRead)
@@ -394,26 +592,27 @@ def get_client(id: int, session=Depends(get_session), user=Depends(get_current_u
     client = session.get(Client, id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    client.isOnline = is_online(client)
+    # isOnline beregnes på en kopi i stedet for at skrive til ORM-objektet.
+    view = ClientRead.model_validate(client).model_copy(update={"isOnline": is_online(client)})
     if principal_is_client(user):
         require_client_self_or_user(user, id)
-        return client
+        return view
     if getattr(user, "is_admin", False):
-        return client
+        return view
     if getattr(user, "role", None) == "bruger":
         if client.status != "approved" or client.school_id != user.school_id:
             raise HTTPException(status_code=403, detail="Du har ikke adgang til denne klient")
-        return client
+        return view
     raise HTTPException(status_code=403, detail="Du har ikke adgang til denne klient")
 
 
-@router.get("/clients/{id}/chrome-status")
-def get_chrome_status(id: int, session=Depends(get_session), user=Depends(get_current_user_or_client)):
-    require_client_self_or_user(user, id)
-    client = session.get(Client, id)
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+def _chrome_status_payload(client) -> dict:
+    """
+    Payload for GET /chrome-status og SSE-strømmen.
 
+    client kan være en Client-række eller en ClientRead med buffered
+    heartbeat-felter lagt ovenpå (se _client_view).
+    """
     online = is_online(client)
 
     # FIX: Læser chrome_step fra database, men filtrerer gamle system-steps fra
@@ -476,6 +675,93 @@ def get_chrome_status(id: int, session=Depends(get_session), user=Depends(get_cu
         "display_resolution_last_applied_at": client.display_resolution_last_applied_at,
     }
 
+
+def _client_view(client: Client) -> ClientRead:
+    """ClientRead med uflushede heartbeat-felter ovenpå, uden at røre ORM-objektet."""
+    view = ClientRead.model_validate(client)
+    pending = heartbeat_buffer.pending(client.id)
+    if pending:
+        view = view.model_copy(update=pending)
+    return view
+
+
+def _load_chrome_status_snapshot(client_id: int):
+    """Loader til client_change_bus: én DB-læsning pr. ændring, uanset antal faner."""
+    with Session(engine) as session:
+        client = session.get(Client, client_id)
+        if not client:
+            return None
+        view = _client_view(client)
+    return view, _chrome_status_payload(view)
+
+
+client_change_bus.configure(_load_chrome_status_snapshot, _chrome_status_payload)
+
+
+@router.get("/clients/{id}/chrome-status")
+def get_chrome_status(id: int, session=Depends(get_session), user=Depends(get_current_user_or_client)):
+    require_client_self_or_user(user, id)
+    client = session.get(Client, id)
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return _chrome_status_payload(_client_view(client))
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+@router.get("/clients/{id}/chrome-status/stream")
+async def stream_chrome_status(
+    id: int,
+    request: Request,
+    session=Depends(get_session),
+    user=Depends(get_current_user_or_client),
+):
+    """
+    Server-Sent Events med samme felter som GET /chrome-status.
+
+    Første event er "snapshot" med alle felter; derefter sendes "change" med
+    kun de felter der er ændret. Ændringer fanges af client_change_bus, så N
+    åbne faner koster én DB-læsning pr. ændring i stedet for N læsninger/sek.
+    """
+    require_client_self_or_user(user, id)
+    # Frigiv DB-forbindelsen med det samme; strømmen kan leve i timevis.
+    session.close()
+
+    sub, snapshot = await client_change_bus.subscribe(id)
+    if snapshot is None:
+        client_change_bus.unsubscribe(sub)
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            yield _sse_event("snapshot", snapshot)
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(sub.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if event == "resync":
+                    current = client_change_bus.snapshot(id)
+                    if current is not None:
+                        yield _sse_event("snapshot", current)
+                    continue
+                yield _sse_event(event, data)
+        finally:
+            client_change_bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.put("/clients/{id}/chrome-status")
 def update_chrome_status(
     id: int,
@@ -500,6 +786,7 @@ def update_chrome_status(
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
     return {"ok": True}
 
 
@@ -519,6 +806,7 @@ def update_client_state(id: int, data: dict = Body(...), session=Depends(get_ses
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
     return {"ok": True, "state": client.state}
 
 
@@ -611,6 +899,8 @@ def set_chrome_command(
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
+    chrome_command_signals.notify(id)
     return {
         "ok": True,
         "pending_chrome_action": client.pending_chrome_action.value,
@@ -618,22 +908,53 @@ def set_chrome_command(
     }
 
 
+def _read_chrome_command(id: int) -> Optional[dict]:
+    with Session(engine) as session:
+        client = session.get(Client, id)
+        if not client:
+            return None
+        action = client.pending_chrome_action.value if client.pending_chrome_action else None
+        source = None if action in (None, "none") else getattr(client, "pending_chrome_action_source", None)
+        return {
+            "action": action,
+            "source": source,
+        }
+
+
 @router.get("/clients/{id}/chrome-command")
-def get_chrome_command(id: int, session=Depends(get_session), user=Depends(get_current_user_or_client)):
+async def get_chrome_command(
+    id: int,
+    wait: int = Query(0, ge=0, le=CHROME_COMMAND_MAX_WAIT_SECONDS),
+    session=Depends(get_session),
+    user=Depends(get_current_user_or_client),
+):
+    """
+    Hent ventende ChromeAction.
+
+    Med ?wait=N (long-poll) parkeres requesten op til N sekunder, hvis der ikke
+    er nogen action, og vækkes af set_chrome_command/os-update/clientflow-update.
+    Uden wait svarer endpointet med det samme som hidtil.
+    """
     require_client_self_or_user(user, id)
-    client = session.get(Client, id)
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
-    action = client.pending_chrome_action.value if client.pending_chrome_action else None
-    source = None if action in (None, "none") else getattr(client, "pending_chrome_action_source", None)
-    return {
-        "action": action,
-        "source": source,
-    }
+    # Hold ikke en pool-forbindelse mens requesten er parkeret.
+    session.close()
+
+    event = chrome_command_signals.register(id) if wait else None
+    try:
+        result = await run_in_threadpool(_read_chrome_command, id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        if event is not None and result["action"] in (None, "none"):
+            if await chrome_command_signals.wait(event, wait):
+                result = await run_in_threadpool(_read_chrome_command, id) or result
+        return result
+    finally:
+        if event is not None:
+            chrome_command_signals.release(id)
 
 
 @router.post("/clients/{id}/os-update")
-async def trigger_os_update(
+def trigger_os_update(
     id: int,
     session=Depends(get_session),
     user=Depends(get_current_admin_user),
@@ -651,6 +972,8 @@ async def trigger_os_update(
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
+    chrome_command_signals.notify(id)
     return {
         "ok": True,
         "message": f"OS-opdatering bestilt for klient {id}",
@@ -661,7 +984,7 @@ async def trigger_os_update(
 
 
 @router.post("/clients/{id}/clientflow-update")
-async def trigger_clientflow_update(
+def trigger_clientflow_update(
     id: int,
     session=Depends(get_session),
     user=Depends(get_current_admin_user),
@@ -693,6 +1016,8 @@ async def trigger_clientflow_update(
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
+    chrome_command_signals.notify(id)
     return {
         "ok": True,
         "message": f"ClientFlow-opdatering bestilt for klient {id}",
@@ -719,7 +1044,7 @@ def get_ubuntu_updates(id: int, session=Depends(get_session), user=Depends(get_c
 
 
 @router.post("/clients/", response_model=ClientRead)
-async def create_client(client_in: ClientCreate, session=Depends(get_session), user=Depends(get_current_user)):
+def create_client(client_in: ClientCreate, session=Depends(get_session), user=Depends(get_current_user)):
     client = Client(
         name=client_in.name,
         locality=client_in.locality,
@@ -793,7 +1118,7 @@ async def create_client(client_in: ClientCreate, session=Depends(get_session), u
 
 
 @router.put("/clients/{id}/update", response_model=ClientRead)
-async def update_client(
+def update_client(
     id: int,
     client_update: ClientUpdate,
     session=Depends(get_session),
@@ -913,11 +1238,14 @@ async def update_client(
     session.add(client)
     session.commit()
     session.refresh(client)
+    client_change_bus.publish(id)
+    if "pending_chrome_action" in fields:
+        chrome_command_signals.notify(id)
     return client
 
 
 @router.put("/clients/{id}/kiosk_url", response_model=ClientRead)
-async def update_kiosk_url(
+def update_kiosk_url(
     id: int,
     data: dict = Body(...),
     session=Depends(get_session),
@@ -947,25 +1275,8 @@ async def update_kiosk_url(
     return client
 
 
-def get_school_year_dates(season_start: int):
-    dates = []
-    for month in range(8, 13):
-        for day in range(1, 32):
-            try:
-                dates.append(date(season_start, month, day))
-            except ValueError:
-                continue
-    for month in range(1, 8):
-        for day in range(1, 32):
-            try:
-                dates.append(date(season_start + 1, month, day))
-            except ValueError:
-                continue
-    return dates
-
-
 @router.post("/clients/{id}/approve", response_model=ClientRead)
-async def approve_client(
+def approve_client(
     id: int,
     data: dict = Body(None),
     session=Depends(get_session),
@@ -987,9 +1298,7 @@ async def approve_client(
     session.commit()
     session.refresh(client)
 
-    today = date.today()
-    season_start = today.year if today.month >= 8 else today.year - 1
-    season_str = f"{season_start}/{season_start + 1}"
+    season_str = current_season()
 
     school = session.get(School, client.school_id) if client.school_id else None
     season_times = None
@@ -1015,27 +1324,58 @@ async def approve_client(
         def_wd_on, def_wd_off = "09:00", "22:30"
         def_we_on, def_we_off = "08:00", "18:00"
 
-    school_year_dates = get_school_year_dates(season_start)
-    markings = {}
-    for d in school_year_dates:
-        if d.weekday() < 5:
-            markings[d.isoformat()] = {"status": "off", "onTime": def_wd_on, "offTime": def_wd_off}
-        else:
-            markings[d.isoformat()] = {"status": "off", "onTime": def_we_on, "offTime": def_we_off}
-
-    existing = session.exec(
-        select(CalendarMarking).where(
-            CalendarMarking.season == season_str,
-            CalendarMarking.client_id == client.id,
+    if not calendar_store.season_has_days(session, client.id, season_str):
+        template = get_season_calendar(session, season_str).template(
+            {"status": "off", "onTime": def_wd_on, "offTime": def_wd_off},
+            {"status": "off", "onTime": def_we_on, "offTime": def_we_off},
+        )
+        calendar_store.insert_missing_rows(
+            session, calendar_store.template_rows(client.id, season_str, template)
         )
-    ).first()
-    if not existing:
-        session.add(CalendarMarking(season=season_str, client_id=client.id, markings=markings))
         session.commit()
 
     return client
 
 
+HEARTBEAT_PASSTHROUGH_FIELDS = (
+    "wifi_ip_address",
+    "wifi_mac_address",
+    "lan_ip_address",
+    "lan_mac_address",
+    "diagnostics_updated_at",
+    "active_network_type",
+    "active_network_interface",
+    "active_network_ip",
+    "active_network_mac",
+    "service_clientflow_status",
+    "service_calendar_status",
+    "service_browser_guard_status",
+    "service_remote_terminal_status",
+    "service_admin_terminal_status",
+    "service_remote_desktop_status",
+    "service_kiosk_x11_guard_status",
+    "service_selfupdate_status",
+    "livestream_process_status",
+)
+
+
+def _heartbeat_fields(data) -> dict:
+    fields = {"last_seen": utcnow()}
+    if isinstance(data, dict):
+        if data.get("uptime") is not None:
+            fields["uptime"] = str(data.get("uptime"))
+        if data.get("ubuntu_version") is not None:
+            fields["ubuntu_version"] = data.get("ubuntu_version")
+        if data.get("client_version") is not None:
+            fields["client_version"] = data.get("client_version")
+
+        # Valgfrit, men nyttigt hvis heartbeat senere bruges til netværksdata.
+        for field in HEARTBEAT_PASSTHROUGH_FIELDS:
+            if data.get(field) is not None:
+                fields[field] = data.get(field)
+    return fields
+
+
 @router.post("/clients/{id}/heartbeat", response_model=ClientRead)
 def client_heartbeat(
     id: int,
@@ -1051,51 +1391,38 @@ def client_heartbeat(
     direkte fra clientflow_config.json, som opdateres fra /proc/uptime.
     Derfor skal heartbeat også opdatere backend.uptime, ellers kan webvisningen
     være bagud i forhold til den lokale GUI.
+
+    Felterne skrives ikke direkte: de absorberes i heartbeat_buffer og flushes
+    samlet til DB højst HEARTBEAT_FLUSH_SECONDS senere. Response bygges ud fra
+    den allerede indlæste klient + de buffered felter, uden commit/refresh.
     """
     require_client_self_or_user(user, id)
+    fields = _heartbeat_fields(data)
+
+    if not HEARTBEAT_BUFFER_ENABLED:
+        client = session.get(Client, id)
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
+        for field, value in fields.items():
+            setattr(client, field, value)
+        session.add(client)
+        session.commit()
+        session.refresh(client)
+        client_change_bus.publish(id)
+        client.isOnline = True
+        return client
+
+    # Ikke principal'en: den kan være et cachet øjebliksbillede (auth), og
+    # svaret skal have aktuel pending_chrome_action/kiosk_url/state.
     client = session.get(Client, id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    client.last_seen = utcnow()
-
-    if isinstance(data, dict):
-        if data.get("uptime") is not None:
-            client.uptime = str(data.get("uptime"))
-        if data.get("ubuntu_version") is not None:
-            client.ubuntu_version = data.get("ubuntu_version")
-        if data.get("client_version") is not None:
-            client.client_version = data.get("client_version")
-
-        # Valgfrit, men nyttigt hvis heartbeat senere bruges til netværksdata.
-        for field in (
-            "wifi_ip_address",
-            "wifi_mac_address",
-            "lan_ip_address",
-            "lan_mac_address",
-            "diagnostics_updated_at",
-            "active_network_type",
-            "active_network_interface",
-            "active_network_ip",
-            "active_network_mac",
-            "service_clientflow_status",
-            "service_calendar_status",
-            "service_browser_guard_status",
-            "service_remote_terminal_status",
-            "service_admin_terminal_status",
-            "service_remote_desktop_status",
-            "service_kiosk_x11_guard_status",
-            "service_selfupdate_status",
-            "livestream_process_status",
-        ):
-            if data.get(field) is not None:
-                setattr(client, field, data.get(field))
-
-    session.add(client)
-    session.commit()
-    session.refresh(client)
-    client.isOnline = True
-    return client
+    heartbeat_buffer.record(id, fields)
+    client_change_bus.publish(id)
+    return ClientRead.model_validate(client).model_copy(
+        update={**heartbeat_buffer.pending(id), "isOnline": True}
+    )
 
 
 def _generate_client_secret() -> str:
@@ -1161,6 +1488,7 @@ def rotate_client_secret(
     session.add(client)
     session.commit()
     session.refresh(client)
+    invalidate_client_principal(id)
 
     return {
         **_client_secret_status(client),
@@ -1187,13 +1515,15 @@ def revoke_client_secret(
     session.add(client)
     session.commit()
     session.refresh(client)
+    # Revoke skal slå igennem med det samme, ikke først når cachen udløber.
+    invalidate_client_principal(id)
 
     return _client_secret_status(client)
 
 
 
 @router.delete("/clients/{id}/remove")
-async def remove_client(id: int, session=Depends(get_session), user=Depends(get_current_admin_user)):
+def remove_client(id: int, session=Depends(get_session), user=Depends(get_current_admin_user)):
     """
     Fjern en klient robust.
 
@@ -1210,7 +1540,7 @@ async def remove_client(id: int, session=Depends(get_session), user=Depends(get_
 
     try:
         # Fjern kalender-markeringer for klienten.
-        session.exec(delete(CalendarMarking).where(CalendarMarking.client_id == client.id))
+        calendar_store.delete_for_clients(session, [client.id])
 
         # Behold installationskode-historik, men fjern FK til klienten før sletning.
         enrollment_tokens = session.exec(
@@ -1222,6 +1552,8 @@ async def remove_client(id: int, session=Depends(get_session), user=Depends(get_
 
         session.delete(client)
         session.commit()
+        heartbeat_buffer.discard(id)
+        invalidate_client_principal(id)
         return {
             "ok": True,
             "removed_client_id": id,
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from db import get_session
 from models import Holiday
 from auth import get_current_user, get_current_admin_user
+from season_calendar import invalidate_holidays
 
 router = APIRouter()
 
@@ -44,6 +45,7 @@ def create_holiday(
     session.add(new_holiday)
     session.commit()
     session.refresh(new_holiday)
+    invalidate_holidays()
     return new_holiday
 
 
@@ -58,3 +60,4 @@ def delete_holiday(
         raise HTTPException(status_code=404, detail="Helligdag ikke fundet")
     session.delete(holiday)
     session.commit()
+    invalidate_holidays()
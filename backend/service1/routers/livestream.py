@@ -1,19 +1,28 @@
 import os
 import re
 import time
-import json
+import threading
 import traceback
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
 
 from fastapi import (
     APIRouter, WebSocket, WebSocketDisconnect,
-    UploadFile, File, HTTPException, Form, Response, Depends, Query
+    UploadFile, File, HTTPException, Form, Response, Depends, Query, Header, Request
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from auth import get_current_user_or_client, verify_ws_token, principal_is_client, require_client_self_or_user
 from models import utcnow
 from sqlmodel import Session
+from hls_segments import SegmentIndex, SegmentInfo
+from captured_at_journal import CapturedAtJournal
+from ll_hls import ll_hls, PartInfo, part_filename, parse_part_filename
+from hls_manifests import ManifestCache, etag_matches
+from stream_state import StreamStates
+from hls_retention import HlsRetention
+from relay_bus import relay_bus
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -28,10 +37,15 @@ os.makedirs(HLS_DIR, exist_ok=True)
 print(f"[HLS] HLS_DIR={HLS_DIR}")
 
 router = APIRouter()
+# Ruter under /hls uden /api-prefix. Inkluderes i main.py før static mountet.
+hls_router = APIRouter()
 
 MANIFEST_STALE_SECONDS = int(os.getenv("HLS_STALE_SECONDS", "12"))
 KEEP_N = int(os.getenv("HLS_MANIFEST_KEEP_N", "8"))
 
+UPLOAD_MAX_BYTES = 50 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
 
 # ---------------------------------------------------------------------------
 # Models
@@ -90,14 +104,16 @@ def _parse_captured_at(captured_at_str: Optional[str]) -> Optional[datetime]:
         return None
 
 
+manifest_cache = ManifestCache()
+stream_states = StreamStates()
+
+
 def _write_manifest(
+    client_id: str,
     manifest_path: str,
-    segments: List[str],
-    media_seq: int,
+    segments: List[SegmentInfo],
     segment_duration: int,
-    client_dir: str = "",
-    captured_at_map: Optional[Dict[str, datetime]] = None,
-) -> None:
+) -> bytes:
     """
     Skriv HLS-manifest med EXT-X-DISCONTINUITY + EXT-X-PROGRAM-DATE-TIME
     på hvert segment.
@@ -113,169 +129,126 @@ def _write_manifest(
     automatisk ved at tilføje en offset — Chrome's MSE ser dermed monotone timestamps.
 
     Safari og Firefox er ikke påvirkede af dette tag.
+
+    Segmentdata kommer fra segment-indekset, så der ikke laves stat-kald her.
+    Manifestet skrives til en temp-fil og omdøbes atomisk, så viewers aldrig
+    læser et halvt skrevet manifest, og lægges i manifest_cache som viewers
+    serveres fra.
     """
-    if captured_at_map is None:
-        captured_at_map = {}
-
-    with open(manifest_path, "w", encoding="utf-8", newline="\n") as m3u:
-        m3u.write("#EXTM3U\n")
-        m3u.write("#EXT-X-VERSION:3\n")
-        m3u.write(f"#EXT-X-TARGETDURATION:{segment_duration}\n")
-        m3u.write(f"#EXT-X-MEDIA-SEQUENCE:{media_seq}\n")
-        m3u.write(f"#EXT-X-DISCONTINUITY-SEQUENCE:{media_seq}\n")
-
-        for i, seg in enumerate(segments):
-            # CHROME FIX: #EXT-X-DISCONTINUITY før hvert segment (undtagen første)
-            # signalerer at DTS nulstilles — HLS.js tilføjer offset automatisk
-            if i > 0:
-                m3u.write("#EXT-X-DISCONTINUITY\n")
-
-            dt = captured_at_map.get(seg)
-
-            if dt is None and client_dir:
-                try:
-                    seg_path = os.path.join(client_dir, seg)
-                    mtime    = os.path.getmtime(seg_path)
-                    dt = datetime.fromtimestamp(mtime - segment_duration, tz=timezone.utc)
-                except Exception:
-                    pass
-
-            if dt is not None:
-                m3u.write(f"#EXT-X-PROGRAM-DATE-TIME:{dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')}\n")
-
-            m3u.write(f"#EXTINF:{segment_duration}.0,\n")
-            m3u.write(f"{seg}\n")
-
-
-# In-memory map: segment_filename → captured_at datetime.
-# Derudover skrives samme map til disk pr. klient, så det virker på tværs af
-# Render workers/restarts og ikke kun i den worker der modtog uploadet.
-_captured_at_store: Dict[str, Dict[str, datetime]] = {}
-CAPTURED_AT_FILENAME = "_captured_at.json"
+    media_seq = segments[0].seq
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{segment_duration}",
+        f"#EXT-X-MEDIA-SEQUENCE:{media_seq}",
+        f"#EXT-X-DISCONTINUITY-SEQUENCE:{media_seq}",
+    ]
+    for i, seg in enumerate(segments):
+        # CHROME FIX: #EXT-X-DISCONTINUITY før hvert segment (undtagen første)
+        # signalerer at DTS nulstilles — HLS.js tilføjer offset automatisk
+        if i > 0:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{seg.program_date.strftime('%Y-%m-%dT%H:%M:%S.000Z')}")
+        lines.append(f"#EXTINF:{segment_duration}.0,")
+        lines.append(seg.filename)
+
+    body = ("\n".join(lines) + "\n").encode("utf-8")
+    tmp = f"{manifest_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "wb") as m3u:
+        m3u.write(body)
+    os.replace(tmp, manifest_path)
+    manifest_cache.put(client_id, body)
+    stream_states.record_manifest(client_id, segments, segment_duration)
+    return body
+
+
+# captured_at pr. segment: in-memory map med append-only journal pr. klient
+# (se captured_at_journal.py), så det overlever genstart uden at skrive hele
+# filen om ved hvert upload.
 MAX_CAPTURED_AT_ENTRIES = 120
 
 
-def _captured_at_path(client_id: str) -> str:
-    return os.path.join(safe_client_dir(client_id), CAPTURED_AT_FILENAME)
-
-
-def _dt_to_iso(dt: datetime) -> str:
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+captured_at_journal = CapturedAtJournal(
+    safe_client_dir,
+    _parse_captured_at,
+    lambda name: extract_num(name, "segment_"),
+    MAX_CAPTURED_AT_ENTRIES,
+)
 
 
-def _load_captured_at_from_disk(client_id: str) -> Dict[str, datetime]:
-    path = _captured_at_path(client_id)
-    if not os.path.exists(path):
-        return {}
-    try:
-        raw = json.loads(open(path, "r", encoding="utf-8").read())
-        if not isinstance(raw, dict):
-            return {}
-        out: Dict[str, datetime] = {}
-        for seg, value in raw.items():
-            if not isinstance(seg, str):
-                continue
-            dt = _parse_captured_at(str(value))
-            if dt is not None:
-                out[seg] = dt
-        return out
-    except Exception as e:
-        print(f"[HLS] Kunne ikke læse {path}: {e}")
-        return {}
+def _store_captured_at(client_id: str, seg_name: str, dt: datetime) -> None:
+    captured_at_journal.store(client_id, seg_name, dt)
 
 
-def _write_captured_at_to_disk(client_id: str, store: Dict[str, datetime]) -> None:
-    try:
-        client_dir = safe_client_dir(client_id)
-        os.makedirs(client_dir, exist_ok=True)
-        # Begræns filen til de nyeste segment-numre.
-        items = sorted(store.items(), key=lambda kv: extract_num(kv[0], "segment_"))[-MAX_CAPTURED_AT_ENTRIES:]
-        data = {name: _dt_to_iso(dt) for name, dt in items}
-        path = os.path.join(client_dir, CAPTURED_AT_FILENAME)
-        tmp = f"{path}.tmp.{os.getpid()}"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, path)
-    except Exception as e:
-        print(f"[HLS] Kunne ikke skrive captured_at sidecar for client={client_id}: {e}")
+def _get_captured_at_map(client_id: str) -> Dict[str, datetime]:
+    return captured_at_journal.get_map(client_id)
 
 
-def _store_captured_at(client_id: str, seg_name: str, dt: datetime) -> None:
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    dt = dt.astimezone(timezone.utc)
+class _UploadTooLarge(Exception):
+    pass
 
-    disk_store = _load_captured_at_from_disk(client_id)
-    mem_store = _captured_at_store.get(client_id, {})
-    merged = {**disk_store, **mem_store}
-    merged[seg_name] = dt
 
-    if len(merged) > MAX_CAPTURED_AT_ENTRIES:
-        keep = sorted(merged.items(), key=lambda kv: extract_num(kv[0], "segment_"))[-MAX_CAPTURED_AT_ENTRIES:]
-        merged = dict(keep)
+def _spool_to_path(src, dest_path: str, max_bytes: int = UPLOAD_MAX_BYTES) -> int:
+    """
+    Kopiér UploadFile's spool-fil til dest_path i bidder. Kører i threadpool.
 
-    _captured_at_store[client_id] = merged
-    _write_captured_at_to_disk(client_id, merged)
+    Skriver til en skjult .part-fil i samme mappe og omdøber atomisk med
+    os.replace, så viewers aldrig henter et halvt segment via /hls-mountet.
+    Størrelsesgrænsen håndhæves løbende; en for stor fil efterlader intet.
+    """
+    directory, name = os.path.split(dest_path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.part")
+    written = 0
+    try:
+        src.seek(0)
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise _UploadTooLarge()
+                out.write(chunk)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return written
 
 
-def _get_captured_at_map(client_id: str) -> Dict[str, datetime]:
-    disk_store = _load_captured_at_from_disk(client_id)
-    mem_store = _captured_at_store.get(client_id, {})
-    merged = {**disk_store, **mem_store}
-    if merged:
-        _captured_at_store[client_id] = merged
-    return merged
+# Indekset rummer lidt mere end manifestet, så cleanup/health kan slå op uden disk.
+HLS_INDEX_CAPACITY = max(KEEP_N * 4, int(os.getenv("HLS_INDEX_CAPACITY", "32")))
+segment_index = SegmentIndex(HLS_INDEX_CAPACITY, lambda name: extract_num(name, "segment_"))
 
 
-def _read_manifest_program_dates(manifest_path: str) -> Dict[str, datetime]:
-    """Fallback: læs EXT-X-PROGRAM-DATE-TIME direkte fra manifestet."""
-    out: Dict[str, datetime] = {}
-    try:
-        last_dt: Optional[datetime] = None
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            for raw_line in f:
-                line = raw_line.strip()
-                if line.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
-                    last_dt = _parse_captured_at(line.split(":", 1)[1])
-                elif line.startswith("segment_"):
-                    if last_dt is not None:
-                        out[line] = last_dt
-                    last_dt = None
-    except Exception:
-        pass
-    return out
+def _latest_segments(client_id: str, client_dir: str, n: int, ext: Optional[str] = None, segment_duration: int = 2) -> List[SegmentInfo]:
+    return segment_index.latest(
+        client_id, client_dir, n, ext,
+        duration=segment_duration,
+        captured_at_loader=lambda: _get_captured_at_map(client_id),
+    )
 
 
-def update_manifest(client_dir: str, client_id: str, keep_n: int = KEEP_N, segment_duration: int = 2) -> None:
+def update_manifest(client_dir: str, client_id: str, keep_n: int = KEEP_N, segment_duration: int = 2) -> Optional[dict]:
+    """Returnerer manifest-hændelsen til de andre workers (se _hls_event)."""
     segment_duration = _normalize_segment_duration(segment_duration, default=2)
 
     for ext in [".ts", ".mp4"]:
-        segs = sorted(
-            [
-                f for f in os.listdir(client_dir)
-                if f.startswith("segment_") and f.endswith(ext)
-                and os.path.getsize(os.path.join(client_dir, f)) > 1000
-            ],
-            key=lambda f: extract_num(f, "segment_")
-        )
-        if not segs:
+        manifest_segs = _latest_segments(client_id, client_dir, keep_n, ext, segment_duration)
+        if not manifest_segs:
             continue
 
-        manifest_segs = segs[-keep_n:]
-        media_seq     = extract_num(manifest_segs[0], "segment_")
         manifest_path = os.path.join(client_dir, "index.m3u8")
-
-        _write_manifest(
-            manifest_path, manifest_segs, media_seq, segment_duration,
-            client_dir=client_dir,
-            captured_at_map=_get_captured_at_map(client_id),
-        )
+        body = _write_manifest(client_id, manifest_path, manifest_segs, segment_duration)
         print(f"[MANIFEST] Opdateret: {manifest_path} ({len(manifest_segs)} seg, duration={segment_duration}s)")
-        return
+        return _manifest_event(body, manifest_segs, segment_duration)
 
     print(f"[MANIFEST] Ingen segmenter fundet i {client_dir}")
+    return None
 
 
 # ---------------------------------------------------------------------------
@@ -298,95 +271,337 @@ async def upload_hls_file(
 
     segment_duration = _normalize_segment_duration(segment_duration, default=2)
     client_dir       = safe_client_dir(client_id)
-    os.makedirs(client_dir, exist_ok=True)
+    await run_in_threadpool(os.makedirs, client_dir, exist_ok=True)
 
-    MAX_SIZE = 50 * 1024 * 1024
-    content  = await file.read(MAX_SIZE + 1)
-    if len(content) > MAX_SIZE:
+    # Starlette kender ofte størrelsen allerede; afvis tidligt uden at kopiere.
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
         raise HTTPException(status_code=413, detail="Filen er for stor (max 50 MB)")
 
     seg_path = os.path.join(client_dir, file.filename)
-    with open(seg_path, "wb") as f:
-        f.write(content)
+    try:
+        size = await run_in_threadpool(_spool_to_path, file.file, seg_path)
+    except _UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Filen er for stor (max 50 MB)")
 
+    mtime = time.time()
     dt = _parse_captured_at(captured_at)
-    if dt is not None:
-        _store_captured_at(client_id, file.filename, dt)
-    else:
+    if dt is None:
+        dt = datetime.fromtimestamp(mtime - segment_duration, tz=timezone.utc)
+    # Journal (fsync/komprimering), manifest og delfiler rører disken; alt
+    # kører i threadpoolen ligesom _spool_to_path.
+    await run_in_threadpool(_store_captured_at, client_id, file.filename, dt)
+    info = await run_in_threadpool(
+        segment_index.record,
+        client_id, client_dir, file.filename, size, dt, segment_duration, mtime,
+        captured_at_loader=lambda: _get_captured_at_map(client_id),
+    )
+    if info is not None:
+        stream_states.record_upload(client_id, info)
+
+    print(f"[UPLOAD] Gemt: {file.filename} ({size} bytes), client={client_id}, captured_at={captured_at}")
+    manifest = await run_in_threadpool(
+        update_manifest, client_dir, client_id, keep_n=KEEP_N, segment_duration=segment_duration,
+    )
+
+    seq = extract_num(file.filename, "segment_")
+    if seq >= 0:
+        await run_in_threadpool(_remove_parts, client_dir, await ll_hls.segment_complete(client_id, seq))
+    await _publish_hls_event(
+        "segment", client_id,
+        segment=_segment_to_event(info) if info is not None else None,
+        msn=seq, manifest=manifest,
+    )
+
+    return {"filename": file.filename, "client_id": client_id, "segment_duration": segment_duration}
+
+
+def _remove_parts(client_dir: str, filenames: List[str]) -> None:
+    for name in filenames:
         try:
-            mtime = os.path.getmtime(seg_path)
-            dt_fallback = datetime.fromtimestamp(mtime - segment_duration, tz=timezone.utc)
-            _store_captured_at(client_id, file.filename, dt_fallback)
-        except Exception:
+            os.remove(os.path.join(client_dir, name))
+        except FileNotFoundError:
             pass
+        except Exception as e:
+            print(f"[LL-HLS] Kunne ikke slette {name}: {e}")
 
-    print(f"[UPLOAD] Gemt: {file.filename} ({len(content)} bytes), client={client_id}, captured_at={captured_at}")
-    update_manifest(client_dir, client_id, keep_n=KEEP_N, segment_duration=segment_duration)
 
-    return {"filename": file.filename, "client_id": client_id, "segment_duration": segment_duration}
+@router.post("/hls/upload-part")
+async def upload_hls_part(
+    file: UploadFile = File(...),
+    client_id: str = Form(...),
+    msn: int = Form(...),
+    part: int = Form(...),
+    duration: float = Form(...),
+    independent: bool = Form(False),
+    captured_at: Optional[str] = Form(default=None),
+    user=Depends(get_current_user_or_client)
+):
+    """
+    LL-HLS: delsegment nr. part af segment msn (segment_<msn>.ts/.mp4).
+    Det hele segment uploades stadig bagefter via /hls/upload.
+    """
+    require_hls_access(user, client_id)
+    ext = os.path.splitext(file.filename or "")[1]
+    if ext not in (".ts", ".mp4"):
+        raise HTTPException(status_code=400, detail="Kun .ts eller .mp4 dele understøttes")
+    if msn < 0 or part < 0:
+        raise HTTPException(status_code=400, detail="Ugyldigt msn/part")
+    if not 0 < duration <= 10:
+        raise HTTPException(status_code=400, detail="Ugyldig varighed for del")
+
+    client_dir = safe_client_dir(client_id)
+    await run_in_threadpool(os.makedirs, client_dir, exist_ok=True)
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Filen er for stor (max 50 MB)")
+
+    name = part_filename(msn, part, ext)
+    try:
+        await run_in_threadpool(_spool_to_path, file.file, os.path.join(client_dir, name))
+    except _UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Filen er for stor (max 50 MB)")
+
+    info = PartInfo(msn, part, name, duration, independent, _parse_captured_at(captured_at))
+    stale = await ll_hls.record_part(client_id, info)
+    await run_in_threadpool(_remove_parts, client_dir, stale)
+    if name not in stale:
+        await _publish_hls_event(
+            "part", client_id,
+            msn=msn, part=part, filename=name, duration=duration, independent=independent,
+            captured_at=_dt_to_event(info.captured_at),
+        )
+    return {"filename": name, "client_id": client_id, "msn": msn, "part": part}
 
 
 # ---------------------------------------------------------------------------
-# Cleanup
+# LL-HLS playlist (blokerende reload)
 # ---------------------------------------------------------------------------
-@router.post("/hls/cleanup")
-async def cleanup_hls_files(
-    payload: HlsCleanupRequest,
-    keep_n: int = KEEP_N,
-    user=Depends(get_current_user_or_client)
+_LL_MEDIA_TYPES = {".ts": "video/mp2t", ".mp4": "video/mp4"}
+
+
+def _ll_principal(token: Optional[str], authorization: Optional[str]):
+    """
+    Token fra ?token= (hls.js genbruger playlist-URL'ens query) eller
+    Authorization-header. Egen kortlivet session, så DB-forbindelsen ikke
+    holdes mens forespørgslen blokerer.
+    """
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    from db import engine
+    with Session(engine) as session:
+        user = verify_ws_token(token, session) if token else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Kunne ikke validere legitimationsoplysninger")
+    return user
+
+
+@router.get("/hls/{client_id}/ll/index.m3u8")
+async def get_ll_playlist(
+    client_id: str,
+    _HLS_msn: Optional[int] = Query(default=None),
+    _HLS_part: Optional[int] = Query(default=None),
+    token: Optional[str] = Query(default=None),
+    authorization: Optional[str] = Header(default=None),
 ):
-    client_id        = payload.client_id
+    user = await run_in_threadpool(_ll_principal, token, authorization)
     require_hls_access(user, client_id)
-    keep_files       = payload.keep_files
-    segment_duration = _normalize_segment_duration(payload.segment_duration, default=2)
-    client_dir       = safe_client_dir(client_id)
+    client_dir = safe_client_dir(client_id)
 
+    def _segments() -> List[SegmentInfo]:
+        segs = _latest_segments(client_id, client_dir, KEEP_N)
+        return [s for s in segs if s.ext == segs[-1].ext] if segs else []
+
+    segments = _segments()
+    segment_duration = segments[-1].duration if segments else 2
+    if _HLS_msn is not None:
+        if _HLS_part is not None and _HLS_part < 0:
+            raise HTTPException(status_code=400, detail="Ugyldig _HLS_part")
+        last_seq = segments[-1].seq if segments else -1
+        if not ll_hls.can_block(client_id, _HLS_msn, last_seq):
+            raise HTTPException(status_code=400, detail="_HLS_msn ligger for langt fremme")
+        # RFC 8216bis: svar senest efter tre target durations.
+        if _HLS_msn > last_seq:
+            if not await ll_hls.wait_for(client_id, _HLS_msn, _HLS_part, timeout=3 * segment_duration):
+                raise HTTPException(status_code=503, detail="Playlisten blev ikke opdateret i tide")
+            segments = _segments()
+
+    if not segments and not ll_hls.is_active(client_id):
+        raise HTTPException(status_code=404, detail="Manifest ikke fundet")
+
+    return Response(
+        content=ll_hls.render(client_id, segments, segment_duration),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache, no-store, must-revalidate"},
+    )
+
+
+@router.get("/hls/{client_id}/ll/{filename}")
+async def get_ll_media(client_id: str, filename: str):
+    """
+    Segmenter og dele refereret fra LL-playlisten. Uden auth ligesom
+    /hls-mountet, som serverer de samme filer. En del der er annonceret via
+    EXT-X-PRELOAD-HINT holdes åben, til den er uploadet.
+    """
+    client_dir = safe_client_dir(client_id)
+    ext = os.path.splitext(filename)[1]
+    parsed = parse_part_filename(filename)
+    if parsed is None and extract_num(filename, "segment_") < 0:
+        raise HTTPException(status_code=404, detail="Fil ikke fundet")
+
+    path = os.path.join(client_dir, filename)
+    if parsed is not None and not os.path.exists(path):
+        msn, index = parsed
+        # Ruten er uden auth: vent kun på klienter der faktisk uploader dele.
+        if ll_hls.is_active(client_id) and ll_hls.can_block(client_id, msn):
+            await ll_hls.wait_for_part(client_id, msn, index, timeout=3 * ll_hls.part_target(client_id))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Fil ikke fundet")
+    return FileResponse(path, media_type=_LL_MEDIA_TYPES.get(ext, "application/octet-stream"))
+
+
+# ---------------------------------------------------------------------------
+# Cleanup
+# ---------------------------------------------------------------------------
+def _cleanup_client_dir(
+    client_id: str, client_dir: str, keep_files: List[str], keep_n: int, segment_duration: int,
+) -> Optional[tuple]:
+    """
+    Disk-delen af /hls/cleanup (scandir, sletning, journal, manifest). Kører i
+    threadpoolen. Returnerer (slettede, beholdte, manifest-hændelse) eller None
+    hvis klientmappen ikke findes.
+    """
     if not os.path.exists(client_dir):
-        return {"deleted": [], "kept": [], "segment_duration": segment_duration}
+        return None
 
-    all_files = [
-        f for f in os.listdir(client_dir)
-        if f.startswith("segment_") and (f.endswith(".ts") or f.endswith(".mp4"))
-    ]
-    to_delete = [f for f in all_files if f not in keep_files]
+    keep_set = set(keep_files)
+    with os.scandir(client_dir) as entries:
+        all_files = [
+            entry.name for entry in entries
+            if entry.name.startswith("segment_") and entry.name.endswith((".ts", ".mp4"))
+        ]
+    to_delete = [f for f in all_files if f not in keep_set]
     for seg in to_delete:
         try:
             os.remove(os.path.join(client_dir, seg))
         except Exception as e:
             print(f"[CLEANUP] Kunne ikke slette {seg}: {e}")
+    segment_index.discard(client_id, to_delete)
 
-    # Hold captured_at sidecar i sync med segmenter der stadig findes.
+    # Hold captured_at journal i sync med segmenter der stadig findes.
     try:
-        cap_map = _get_captured_at_map(client_id)
-        existing = {f for f in os.listdir(client_dir) if f.startswith("segment_")}
-        cap_map = {k: v for k, v in cap_map.items() if k in existing}
-        _captured_at_store[client_id] = cap_map
-        _write_captured_at_to_disk(client_id, cap_map)
+        deleted = set(to_delete)
+        captured_at_journal.retain(client_id, [f for f in all_files if f not in deleted])
     except Exception as e:
-        print(f"[CLEANUP] Kunne ikke opdatere captured_at sidecar: {e}")
+        print(f"[CLEANUP] Kunne ikke opdatere captured_at journal: {e}")
 
-    kept_sorted = sorted(
-        [f for f in keep_files if os.path.exists(os.path.join(client_dir, f))],
-        key=lambda f: extract_num(f, "segment_")
-    )
-    kept_in_manifest = kept_sorted[-keep_n:]
+    kept_segments = [
+        info for info in _latest_segments(client_id, client_dir, HLS_INDEX_CAPACITY, segment_duration=segment_duration)
+        if info.filename in keep_set
+    ][-keep_n:]
+    kept_in_manifest = [info.filename for info in kept_segments]
 
-    if kept_in_manifest:
-        media_seq     = extract_num(kept_in_manifest[0], "segment_")
+    if kept_segments:
         manifest_path = os.path.join(client_dir, "index.m3u8")
-        _write_manifest(
-            manifest_path, kept_in_manifest, media_seq, segment_duration,
-            client_dir=client_dir,
-            captured_at_map=_get_captured_at_map(client_id),
-        )
+        body = _write_manifest(client_id, manifest_path, kept_segments, segment_duration)
+        manifest = _manifest_event(body, kept_segments, segment_duration)
         print(f"[CLEANUP] Manifest skrevet med {len(kept_in_manifest)} segmenter.")
+    else:
+        # Manifestet på disk peger nu på slettede segmenter.
+        stream_states.record_manifest(client_id, [], segment_duration)
+        manifest = _manifest_event(None, [], segment_duration)
+    return to_delete, kept_in_manifest, manifest
+
+
+@router.post("/hls/cleanup")
+async def cleanup_hls_files(
+    payload: HlsCleanupRequest,
+    keep_n: int = KEEP_N,
+    user=Depends(get_current_user_or_client)
+):
+    client_id        = payload.client_id
+    require_hls_access(user, client_id)
+    segment_duration = _normalize_segment_duration(payload.segment_duration, default=2)
+    client_dir       = safe_client_dir(client_id)
+
+    result = await run_in_threadpool(
+        _cleanup_client_dir, client_id, client_dir, payload.keep_files, keep_n, segment_duration,
+    )
+    if result is None:
+        return {"deleted": [], "kept": [], "segment_duration": segment_duration}
+    to_delete, kept_in_manifest, manifest = result
+    await _publish_hls_event("cleanup", client_id, deleted=to_delete, manifest=manifest)
 
     return {"deleted": to_delete, "kept": kept_in_manifest, "segment_duration": segment_duration}
 
 
 # ---------------------------------------------------------------------------
-# Last segment info
+# Manifest (cachet)
+# ---------------------------------------------------------------------------
+_MANIFEST_HEADERS = {
+    "Content-Type": "application/vnd.apple.mpegurl",
+    # Må gemmes, men skal revalideres hver gang (If-None-Match -> 304).
+    "Cache-Control": "no-cache",
+}
+
+
+@hls_router.get("/hls/{client_id}/index.m3u8")
+async def get_manifest(client_id: str, request: Request):
+    """
+    index.m3u8 fra manifest_cache i stedet for disk. Uden auth ligesom
+    resten af /hls-mountet.
+    """
+    entry = manifest_cache.get(client_id)
+    if entry is None:
+        manifest_path = os.path.join(safe_client_dir(client_id), "index.m3u8")
+        entry = await run_in_threadpool(manifest_cache.load, client_id, manifest_path)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Manifest ikke fundet")
+
+    headers = {**_MANIFEST_HEADERS, "ETag": entry.etag, "X-Manifest-Generation": str(entry.generation)}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        manifest_cache.count("not_modified")
+        return Response(status_code=304, headers=headers)
+    manifest_cache.count("hits")
+    return Response(content=entry.body, headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# Stream state (health / last-segment-info)
 # ---------------------------------------------------------------------------
+_NO_CACHE_HEADERS = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma":        "no-cache",
+    "Expires":       "0",
+}
+HLS_HEALTH_BATCH_MAX = 200
+
+
+def _seed_stream_state(client_id: str) -> bool:
+    """
+    Efter genstart/reset: byg tilstanden fra segment-indekset (som selv
+    genopbygges fra disk én gang). False hvis der ikke findes et manifest.
+    """
+    client_dir = safe_client_dir(client_id)
+    if not os.path.exists(os.path.join(client_dir, "index.m3u8")):
+        return False
+    for ext in [".ts", ".mp4"]:
+        segments = _latest_segments(client_id, client_dir, KEEP_N, ext)
+        if segments:
+            stream_states.record_manifest(client_id, segments, segments[-1].duration)
+            return True
+    stream_states.record_manifest(client_id, [], 2)
+    return True
+
+
+def _stream_health(client_id: str) -> dict:
+    health = stream_states.health(client_id, MANIFEST_STALE_SECONDS)
+    if health is None:
+        if not _seed_stream_state(client_id):
+            return {"online": False, "has_segments": False, "is_stale": False, "last_update": None, "message": "Manifest ikke fundet"}
+        health = stream_states.health(client_id, MANIFEST_STALE_SECONDS)
+    health["low_latency"] = ll_hls.is_active(client_id)
+    return health
+
+
 @router.get("/hls/{client_id}/last-segment-info")
 def get_last_segment_info(
     client_id: str,
@@ -394,61 +609,34 @@ def get_last_segment_info(
     user=Depends(get_current_user_or_client)
 ):
     require_hls_access(user, client_id)
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"]        = "no-cache"
-    response.headers["Expires"]       = "0"
-
-    client_dir    = safe_client_dir(client_id)
-    manifest_path = os.path.join(client_dir, "index.m3u8")
-    if not os.path.exists(manifest_path):
-        return {"error": "no manifest", "is_healthy": False}
-
-    with open(manifest_path, "r", encoding="utf-8") as m3u:
-        lines = m3u.readlines()
-
-    segment_files = [line.strip() for line in lines if line.strip().startswith("segment_")]
-    if not segment_files:
-        return {"error": "no segments", "is_healthy": False}
-
-    last_segment = segment_files[-1]
-    seg_path     = os.path.join(client_dir, last_segment)
-    if not os.path.exists(seg_path):
-        return {"error": "segment missing", "is_healthy": False}
-
-    captured_at_map = _get_captured_at_map(client_id)
-    manifest_dates = _read_manifest_program_dates(manifest_path)
-    dt = captured_at_map.get(last_segment) or manifest_dates.get(last_segment)
-    if dt is not None:
-        timestamp_iso = _dt_to_iso(dt)
-        epoch         = dt.timestamp()
-    else:
-        mtime         = os.path.getmtime(seg_path)
-        dt_utc        = datetime.fromtimestamp(mtime, tz=timezone.utc)
-        timestamp_iso = dt_utc.replace(microsecond=0).isoformat().replace("+00:00", "Z")
-        epoch         = mtime
+    response.headers.update(_NO_CACHE_HEADERS)
 
-    return {
-        "segment":       last_segment,
-        "timestamp":     timestamp_iso,
-        "epoch":         epoch,
-        "segment_count": len(segment_files),
-        "is_healthy":    True,
-    }
+    info = stream_states.last_segment_info(client_id)
+    if info is None:
+        if not _seed_stream_state(client_id):
+            return {"error": "no manifest", "is_healthy": False}
+        info = stream_states.last_segment_info(client_id)
+    return info
 
 
-
-def _guess_target_duration_from_manifest(lines: List[str]) -> Optional[int]:
-    for line in lines:
-        if line.startswith("#EXT-X-TARGETDURATION:"):
-            try:
-                return int(line.split(":", 1)[1])
-            except Exception:
-                return None
-    return None
-
 # ---------------------------------------------------------------------------
 # Health check
 # ---------------------------------------------------------------------------
+@router.get("/hls/health")
+def health_check_batch(
+    response: Response,
+    client_ids: List[str] = Query(..., description="Klient-id'er, fx ?client_ids=1&client_ids=2"),
+    user=Depends(get_current_user_or_client)
+):
+    """Health for mange livestreams i ét kald (fx oversigter med flere kiosker)."""
+    if len(client_ids) > HLS_HEALTH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Højst {HLS_HEALTH_BATCH_MAX} klienter pr. kald")
+    for client_id in client_ids:
+        require_hls_access(user, client_id)
+    response.headers.update(_NO_CACHE_HEADERS)
+    return {"clients": {client_id: _stream_health(client_id) for client_id in dict.fromkeys(client_ids)}}
+
+
 @router.get("/hls/{client_id}/health")
 def health_check(
     client_id: str,
@@ -456,73 +644,138 @@ def health_check(
     user=Depends(get_current_user_or_client)
 ):
     require_hls_access(user, client_id)
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"]        = "no-cache"
-    response.headers["Expires"]       = "0"
+    response.headers.update(_NO_CACHE_HEADERS)
+    return _stream_health(client_id)
 
-    client_dir    = safe_client_dir(client_id)
-    manifest_path = os.path.join(client_dir, "index.m3u8")
-    if not os.path.exists(manifest_path):
-        return {"online": False, "has_segments": False, "is_stale": False, "last_update": None, "message": "Manifest ikke fundet"}
 
-    try:
-        with open(manifest_path, "r", encoding="utf-8") as m3u:
-            manifest_lines = [line.strip() for line in m3u if line.strip()]
-
-        manifest_segments = [line for line in manifest_lines if line.startswith("segment_")]
-        existing_manifest_segments = [
-            seg for seg in manifest_segments
-            if os.path.exists(os.path.join(client_dir, seg))
-            and os.path.getsize(os.path.join(client_dir, seg)) > 1000
-        ]
+# ---------------------------------------------------------------------------
+# Retention (baggrundsopgave startet fra main.py)
+# ---------------------------------------------------------------------------
+def _forget_client(client_id: str) -> None:
+    """Glem al in-memory tilstand for klienten (reset og eviction). Kun fra event-loopet."""
+    captured_at_journal.drop(client_id)
+    segment_index.drop(client_id)
+    ll_hls.drop(client_id)
+    manifest_cache.drop(client_id)
+    stream_states.drop(client_id)
 
-        if existing_manifest_segments:
-            last_seg = existing_manifest_segments[-1]
-            seg_path = os.path.join(client_dir, last_seg)
-            mtime = os.path.getmtime(seg_path)
-            last_update = datetime.fromtimestamp(mtime, tz=timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
-            age_seconds = time.time() - mtime
-            is_stale = age_seconds > MANIFEST_STALE_SECONDS
-            return {
-                "online": True,
-                "has_segments": True,
-                "is_stale": is_stale,
-                "last_update": last_update,
-                "age_seconds": round(age_seconds, 2),
-                "segment_count": len(existing_manifest_segments),
-                "manifest_segment_count": len(manifest_segments),
-                "latest_segment": last_seg,
-                "target_duration": _guess_target_duration_from_manifest(manifest_lines),
-                "message": "Stream er forældet — klienten svarer ikke" if is_stale else "Stream er aktiv",
-            }
-
-        # Manifest findes, men peger ikke på eksisterende segmenter.
-        # Det er typisk et cleanup/path-problem, og bør ikke ligne aktiv stream.
-        return {
-            "online": True,
-            "has_segments": False,
-            "is_stale": False,
-            "last_update": None,
-            "segment_count": 0,
-            "manifest_segment_count": len(manifest_segments),
-            "message": "Manifest findes, men segmentfiler mangler",
-        }
-    except Exception as e:
-        return {"online": False, "has_segments": False, "is_stale": False, "last_update": None, "message": f"Fejl: {str(e)}"}
+
+async def _on_segments_pruned(client_id: str, deleted: List[str], remaining: List[str]) -> None:
+    segment_index.discard(client_id, deleted)
+    await run_in_threadpool(captured_at_journal.retain, client_id, remaining)
+    # Beskårne segmenter er ældre end manifestets; manifestet er uændret.
+    await _publish_hls_event("cleanup", client_id, deleted=deleted, manifest=None)
+
+
+async def _on_client_evicted(client_id: str) -> None:
+    _forget_client(client_id)
+    await _publish_hls_event("reset", client_id)
+
+
+hls_retention = HlsRetention(
+    HLS_DIR,
+    lambda name: extract_num(name, "segment_"),
+    keep_min=KEEP_N,
+    on_pruned=_on_segments_pruned,
+    on_evicted=_on_client_evicted,
+)
 
 
 # ---------------------------------------------------------------------------
-# Reset
+# Sync mellem workers (relay_bus)
 # ---------------------------------------------------------------------------
-@router.post("/hls/{client_id}/reset")
-def reset_hls(client_id: str, response: Response, user=Depends(get_current_user_or_client)):
-    require_hls_access(user, client_id)
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+# HLS_DIR deles af alle workers, men segment-indeks, manifest-cache, stream
+# state og LL-HLS ligger i hukommelsen. Den worker der modtager et upload
+# opdaterer sig selv og sender hændelsen til de andre, som opdaterer deres
+# caches uden at læse disken. captured_at-journalen genindlæses dovent.
+HLS_EVENTS_CHANNEL = "hls:events"
+
+
+def _dt_to_event(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if dt is not None else None
+
+
+def _segment_to_event(info: SegmentInfo) -> dict:
+    return {
+        "seq": info.seq,
+        "filename": info.filename,
+        "size": info.size,
+        "captured_at": _dt_to_event(info.captured_at),
+        "duration": info.duration,
+        "mtime": info.mtime,
+    }
+
+
+def _segment_from_event(data: dict) -> SegmentInfo:
+    return SegmentInfo(
+        data["seq"], data["filename"], data["size"],
+        _parse_captured_at(data.get("captured_at")), data["duration"], data["mtime"],
+    )
+
+
+def _manifest_event(body: Optional[bytes], segments: List[SegmentInfo], segment_duration: int) -> dict:
+    return {
+        "body": body.decode("utf-8") if body is not None else None,
+        "segments": [_segment_to_event(s) for s in segments],
+        "segment_duration": segment_duration,
+    }
+
+
+async def _publish_hls_event(op: str, client_id: str, **fields) -> None:
+    if relay_bus.distributed:
+        await relay_bus.broadcast(HLS_EVENTS_CHANNEL, {"op": op, "client_id": client_id, **fields})
+
+
+def _apply_manifest_event(client_id: str, manifest: Optional[dict]) -> None:
+    if not manifest:
+        return
+    if manifest["body"] is not None:
+        manifest_cache.put(client_id, manifest["body"].encode("utf-8"))
+    segments = [_segment_from_event(s) for s in manifest["segments"]]
+    stream_states.record_manifest(client_id, segments, manifest["segment_duration"])
+
+
+async def _hls_event(msg: dict) -> None:
+    """Hændelse fra en anden worker."""
+    op = msg.get("op")
+    client_id = msg.get("client_id")
     client_dir = safe_client_dir(client_id)
 
-    if client_id in _captured_at_store:
-        del _captured_at_store[client_id]
+    if op == "segment":
+        captured_at_journal.drop(client_id)
+        if msg.get("segment"):
+            info = _segment_from_event(msg["segment"])
+            await run_in_threadpool(
+                segment_index.record,
+                client_id, client_dir, info.filename, info.size, info.captured_at, info.duration, info.mtime,
+                captured_at_loader=lambda: _get_captured_at_map(client_id),
+            )
+            stream_states.record_upload(client_id, info)
+        _apply_manifest_event(client_id, msg.get("manifest"))
+        if msg.get("msn", -1) >= 0:
+            # Origin har allerede slettet de udløbne delfiler.
+            await ll_hls.segment_complete(client_id, msg["msn"])
+    elif op == "part":
+        await ll_hls.record_part(client_id, PartInfo(
+            msg["msn"], msg["part"], msg["filename"], msg["duration"], msg["independent"],
+            _parse_captured_at(msg.get("captured_at")),
+        ))
+    elif op == "cleanup":
+        captured_at_journal.drop(client_id)
+        segment_index.discard(client_id, msg.get("deleted") or [])
+        _apply_manifest_event(client_id, msg.get("manifest"))
+    elif op == "reset":
+        _forget_client(client_id)
+
+
+relay_bus.subscribe(HLS_EVENTS_CHANNEL, _hls_event)
 
+
+# ---------------------------------------------------------------------------
+# Reset
+# ---------------------------------------------------------------------------
+def _reset_client_dir(client_id: str, client_dir: str) -> dict:
+    """Sletter filerne; kaldes fra threadpoolen efter _forget_client."""
     if not os.path.exists(client_dir):
         return {"message": "already cleaned", "success": True, "timestamp": utcnow().isoformat() + "Z"}
     try:
@@ -534,10 +787,23 @@ def reset_hls(client_id: str, response: Response, user=Depends(get_current_user_
         return {"message": f"reset failed: {e}", "success": False, "timestamp": utcnow().isoformat() + "Z"}
 
 
+@router.post("/hls/{client_id}/reset")
+async def reset_hls(client_id: str, response: Response, user=Depends(get_current_user_or_client)):
+    require_hls_access(user, client_id)
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    client_dir = safe_client_dir(client_id)
+    _forget_client(client_id)
+    result = await run_in_threadpool(_reset_client_dir, client_id, client_dir)
+    await _publish_hls_event("reset", client_id)
+    return result
+
+
 # ---------------------------------------------------------------------------
 # WebSocket signalling
 # ---------------------------------------------------------------------------
 class Room:
+    """Lokale forbindelser på denne worker. Beskeder går via relay_bus."""
+
     def __init__(self):
         self.broadcaster: WebSocket = None
         self.viewers: Dict[str, WebSocket] = {}
@@ -546,6 +812,21 @@ class Room:
 rooms: Dict[str, Room] = {}
 
 
+def _broadcaster_channel(client_id: str) -> str:
+    return f"ls:broadcaster:{client_id}"
+
+
+def _viewer_channel(client_id: str, viewer_id: str) -> str:
+    return f"ls:viewer:{client_id}:{viewer_id}"
+
+
+def _ws_principal(token: Optional[str]):
+    """Token-opslag i threadpoolen, så DB-kaldet ikke blokerer event-loopet."""
+    from db import engine
+    with Session(engine) as session:
+        return verify_ws_token(token, session)
+
+
 @router.websocket("/ws/livestream/{client_id}")
 async def livestream_endpoint(
     websocket: WebSocket,
@@ -556,34 +837,41 @@ async def livestream_endpoint(
         await websocket.close(code=1008)
         return
 
-    from db import engine
-    with Session(engine) as session:
-        user = verify_ws_token(token, session)
-        if not user:
-            await websocket.close(code=4001)
-            return
-        try:
-            require_hls_access(user, client_id)  # v6.6: enforce same access rules for livestream WS
-        except HTTPException:
-            await websocket.close(code=1008)
-            return
+    user = await run_in_threadpool(_ws_principal, token)
+    if not user:
+        await websocket.close(code=4001)
+        return
+    try:
+        require_hls_access(user, client_id)  # v6.6: enforce same access rules for livestream WS
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
 
     await websocket.accept()
     if client_id not in rooms:
         rooms[client_id] = Room()
     room = rooms[client_id]
+    channel = None
+
+    async def deliver(msg: dict) -> None:
+        await websocket.send_json(msg)
 
     try:
         data = await websocket.receive_json()
         if data.get("type") == "broadcaster":
             room.broadcaster = websocket
+            channel = _broadcaster_channel(client_id)
+            relay_bus.subscribe(channel, deliver)
+            await relay_bus.set_presence(channel, {})
             await websocket.send_json({"type": "ack", "role": "broadcaster"})
         elif data.get("type") == "newViewer":
             viewer_id = str(data.get("viewer_id"))
             room.viewers[viewer_id] = websocket
+            channel = _viewer_channel(client_id, viewer_id)
+            relay_bus.subscribe(channel, deliver)
+            await relay_bus.set_presence(channel, {})
             await websocket.send_json({"type": "ack", "role": "viewer", "viewer_id": viewer_id})
-            if room.broadcaster:
-                await room.broadcaster.send_json({"type": "newViewer", "viewer_id": viewer_id})
+            await relay_bus.send(_broadcaster_channel(client_id), {"type": "newViewer", "viewer_id": viewer_id})
         else:
             await websocket.close()
             return
@@ -592,23 +880,28 @@ async def livestream_endpoint(
             msg = await websocket.receive_json()
             if websocket == room.broadcaster:
                 viewer_id = msg.get("viewer_id")
-                if viewer_id and viewer_id in room.viewers:
-                    await room.viewers[viewer_id].send_json(msg)
+                if viewer_id:
+                    await relay_bus.send(_viewer_channel(client_id, str(viewer_id)), msg)
             else:
                 viewer_id = next((vid for vid, ws in room.viewers.items() if ws == websocket), None)
-                if room.broadcaster and viewer_id:
+                if viewer_id:
                     msg["viewer_id"] = viewer_id
-                    await room.broadcaster.send_json(msg)
+                    await relay_bus.send(_broadcaster_channel(client_id), msg)
 
     except WebSocketDisconnect:
-        if websocket == room.broadcaster: room.broadcaster = None
-        for vid, ws in list(room.viewers.items()):
-            if ws == websocket: del room.viewers[vid]
+        pass
     except Exception as e:
         print(f"[WS] Fejl for client_id={client_id}: {e}")
         traceback.print_exc()
-        if websocket == room.broadcaster: room.broadcaster = None
-        for vid, ws in list(room.viewers.items()):
-            if ws == websocket: del room.viewers[vid]
         try: await websocket.close()
         except Exception: pass
+    finally:
+        if channel is not None:
+            relay_bus.unsubscribe(channel, deliver)
+        if websocket == room.broadcaster:
+            room.broadcaster = None
+            await relay_bus.clear_presence(channel)
+        for vid, ws in list(room.viewers.items()):
+            if ws == websocket:
+                del room.viewers[vid]
+                await relay_bus.clear_presence(_viewer_channel(client_id, vid))
@@ -9,13 +9,37 @@ Arkitektur:
 - Backend broker frames og input-events mellem browser og klient.
 
 Dette er ikke VNC/RDP. Det er en kontrolleret MVP:
-- klient sender JPEG frames
+- klient sender JPEG frames, helst som binære WebSocket-frames
+  (se remote_desktop_frames.py), som backend videresender uden at afkode
 - browser sender mus/tastatur-events
 - klient udfører input lokalt via xdotool
 
 Sikkerhed:
 - browser-adgang er superadmin-only
 - agent-adgang kræver admin/superadmin-token eller matchende client-token
+
+Flere workers:
+- AGENTS/BROWSERS rummer kun forbindelser på denne worker.
+- Beskeder går via relay_bus (kanalerne rd:agent:<client_id>,
+  rd:browser:<session_id> og rd:status:<client_id>), så browser og agent kan
+  sidde på hver sin worker. Om agenten er forbundet (og skærmstørrelsen)
+  slås op i relay_bus' presence.
+
+Langsomme browsere:
+- Hver BrowserSession har sin egen udgående kø og writer-task
+  (ws_send_queue.py). Frames droppes efter "seneste vinder", kontrol-
+  beskeder leveres tabsfrit, så agentens løkke aldrig venter på en browser.
+
+Delt stream (agenten melder shared_stream=true i hello):
+- agenten streamer én gang pr. klient (session_id BROADCAST_SESSION_ID):
+  en keyframe og derefter kun ændrede tiles. Relæet sender dem til alle
+  viewers (conn.viewers) og cacher keyframe + tiles i KEYFRAMES.
+- en ny viewer får cachen med det samme i stedet for at starte endnu en
+  stream på agenten; kun første start_stream og sidste stop_stream når
+  agenten.
+- tiles er deltas i browserens kø; kan en browser ikke følge med, bedes
+  agenten om en frisk keyframe (request_frame med keyframe=true).
+- ældre agenter uden shared_stream kører som før med én stream pr. session.
 """
 
 from __future__ import annotations
@@ -28,11 +52,17 @@ from dataclasses import dataclass, field
 from typing import Any, Optional
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
 
 from auth import verify_ws_token
 from db import engine
 from models import Client, User
+from relay_bus import relay_bus
+from remote_desktop_frames import BROADCAST_SESSION_ID, FRAME_TILE, frame_session_id, frame_type
+from remote_desktop_keyframes import KeyframeCache
+from session_registry import ShardedLocks
+from ws_send_queue import WebSocketSendQueue
 
 router = APIRouter(prefix="/remote-desktop", tags=["remote-desktop"])
 
@@ -46,6 +76,13 @@ class AgentConnection:
     hostname: Optional[str] = None
     width: Optional[int] = None
     height: Optional[int] = None
+    conn_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    shared_stream: bool = False
+    # Browser-sessioner der ser den delte stream (kun ved shared_stream).
+    viewers: set[str] = field(default_factory=set)
+
+    def presence(self) -> dict[str, Any]:
+        return {"hostname": self.hostname, "width": self.width, "height": self.height, "conn_id": self.conn_id}
 
 
 @dataclass
@@ -56,17 +93,85 @@ class BrowserSession:
     user_id: Optional[int]
     username: str
     connected_at: float = field(default_factory=time.time)
+    queue: Optional[WebSocketSendQueue] = None
+
+    def __post_init__(self) -> None:
+        if self.queue is None:
+            self.queue = WebSocketSendQueue(
+                self.websocket,
+                f"rd:browser:{self.session_id}",
+                on_resync=self._request_keyframe,
+            )
+
+    def _request_keyframe(self) -> None:
+        # Browseren har tabt tiles; uden en ny keyframe ville billedet være forkert.
+        task = asyncio.create_task(relay_bus.send(_agent_channel(self.client_id), {
+            "type": "request_frame",
+            "keyframe": True,
+            "session_id": self.session_id,
+        }))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    def deliver(self, msg: dict[str, Any] | bytes) -> None:
+        if isinstance(msg, bytes) and frame_type(msg) == FRAME_TILE:
+            self.queue.put_delta(msg)
+        elif isinstance(msg, bytes) or msg.get("type") == "frame":
+            self.queue.put_frame(msg)
+        else:
+            self.queue.put(msg)
 
 
 AGENTS: dict[int, AgentConnection] = {}
 BROWSERS: dict[str, BrowserSession] = {}
-LOCK = asyncio.Lock()
+# Serialiserer kun registrering af agenter for samme klient.
+LOCKS = ShardedLocks()
+# Referencer til fire-and-forget tasks, så de ikke garbage-collectes før de kører.
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+# Seneste keyframe + tiles pr. klient med delt stream (kun agenter på denne worker).
+KEYFRAMES = KeyframeCache()
 
 
 async def _send_json(ws: WebSocket, payload: dict[str, Any]) -> None:
     await ws.send_text(json.dumps(payload, ensure_ascii=False))
 
 
+async def _receive_text_or_bytes(ws: WebSocket) -> str | bytes:
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
+
+
+def _agent_channel(client_id: int) -> str:
+    return f"rd:agent:{client_id}"
+
+
+def _browser_channel(session_id: str) -> str:
+    return f"rd:browser:{session_id}"
+
+
+def _status_channel(client_id: int) -> str:
+    return f"rd:status:{client_id}"
+
+
+def _browsers_group(client_id: int) -> str:
+    return f"rd:browsers:{client_id}"
+
+
+def _agent_presence(client_id: int) -> Optional[dict[str, Any]]:
+    """Agentens presence på tværs af workers (None hvis ikke forbundet)."""
+    return relay_bus.get_presence(_agent_channel(client_id))
+
+
+def _is_browser_of(client_id: int, session_id: str) -> bool:
+    """Agenten må kun sende til browser-sessioner for sin egen klient."""
+    browser = relay_bus.get_presence(_browser_channel(session_id))
+    return bool(browser) and browser.get("client_id") == client_id
+
+
 def _extract_token(websocket: WebSocket) -> Optional[str]:
     token = websocket.query_params.get("token")
     if token:
@@ -123,7 +228,7 @@ async def remote_desktop_agent_ws(websocket: WebSocket, client_id: int):
     """
     await websocket.accept()
 
-    principal = _get_ws_user(websocket)
+    principal = await run_in_threadpool(_get_ws_user, websocket)
     if not principal:
         await _close_with_reason(websocket, 4401, "Ikke logget ind")
         return
@@ -138,29 +243,49 @@ async def remote_desktop_agent_ws(websocket: WebSocket, client_id: int):
         await _close_with_reason(websocket, 4403, "Kun admin/superadmin eller matchende client-token må forbinde remote desktop-agent")
         return
 
-    if not _client_exists_and_accessible(client_id, principal):
+    if not await run_in_threadpool(_client_exists_and_accessible, client_id, principal):
         await _close_with_reason(websocket, 4404, "Klient ikke fundet, ikke godkendt eller ingen adgang")
         return
 
-    async with LOCK:
-        old = AGENTS.get(client_id)
-        if old:
-            try:
-                await old.websocket.close(code=4400, reason="Ny remote desktop-agent forbandt")
-            except Exception:
-                pass
-        AGENTS[client_id] = AgentConnection(
-            client_id=client_id,
-            websocket=websocket,
-            user_id=None if isinstance(principal, Client) else principal.id,
-        )
+    conn = AgentConnection(
+        client_id=client_id,
+        websocket=websocket,
+        user_id=None if isinstance(principal, Client) else principal.id,
+    )
+
+    async def deliver(msg: dict[str, Any]) -> None:
+        # En nyere agent for samme klient (evt. på en anden worker) overtager.
+        if msg.get("type") == "_replaced":
+            if msg.get("conn_id") != conn.conn_id:
+                await _close_with_reason(websocket, 4400, "Ny remote desktop-agent forbandt")
+            return
+        if conn.shared_stream and not await _deliver_shared(conn, msg):
+            return
+        await _send_json(websocket, msg)
+
+    # To agenter for samme klient må ikke registrere sig samtidigt, ellers kan
+    # de lukke hinanden via _replaced.
+    async with LOCKS.lock(client_id):
+        AGENTS[client_id] = conn
+        relay_bus.subscribe(_agent_channel(client_id), deliver)
+        await relay_bus.publish(_agent_channel(client_id), {"type": "_replaced", "conn_id": conn.conn_id})
+        await relay_bus.set_presence(_agent_channel(client_id), conn.presence())
 
     await _send_json(websocket, {"type": "hello", "role": "agent", "client_id": client_id})
     await _broadcast_status(client_id)
 
     try:
         while True:
-            raw = await websocket.receive_text()
+            raw = await _receive_text_or_bytes(websocket)
+            if isinstance(raw, bytes):
+                # Binær frame: kun headeren læses, billeddata videresendes uændret.
+                session_id = frame_session_id(raw)
+                if session_id == BROADCAST_SESSION_ID and conn.shared_stream:
+                    await _fan_out_shared(conn, raw)
+                elif session_id and _is_browser_of(client_id, session_id):
+                    await relay_bus.send_bytes(_browser_channel(session_id), raw)
+                continue
+
             try:
                 msg = json.loads(raw)
             except Exception:
@@ -170,35 +295,33 @@ async def remote_desktop_agent_ws(websocket: WebSocket, client_id: int):
             session_id = str(msg.get("session_id") or "")
 
             if msg_type == "hello":
-                async with LOCK:
-                    conn = AGENTS.get(client_id)
-                    if conn and conn.websocket is websocket:
-                        conn.hostname = msg.get("hostname")
-                        if msg.get("width"):
-                            conn.width = int(msg.get("width"))
-                        if msg.get("height"):
-                            conn.height = int(msg.get("height"))
+                current = AGENTS.get(client_id) is conn
+                if current:
+                    conn.hostname = msg.get("hostname")
+                    conn.shared_stream = bool(msg.get("shared_stream"))
+                    if msg.get("width"):
+                        conn.width = int(msg.get("width"))
+                    if msg.get("height"):
+                        conn.height = int(msg.get("height"))
+                    await relay_bus.set_presence(_agent_channel(client_id), conn.presence())
                 await _broadcast_status(client_id)
                 continue
 
-            if session_id:
-                async with LOCK:
-                    browser = BROWSERS.get(session_id)
-                if browser:
-                    try:
-                        await _send_json(browser.websocket, msg)
-                    except Exception:
-                        pass
+            if session_id and _is_browser_of(client_id, session_id):
+                await relay_bus.send(_browser_channel(session_id), msg)
 
     except WebSocketDisconnect:
         pass
     except Exception:
         pass
     finally:
-        async with LOCK:
-            conn = AGENTS.get(client_id)
-            if conn and conn.websocket is websocket:
+        relay_bus.unsubscribe(_agent_channel(client_id), deliver)
+        async with LOCKS.lock(client_id):
+            current = AGENTS.get(client_id) is conn
+            if current:
                 AGENTS.pop(client_id, None)
+                KEYFRAMES.drop(client_id)
+                await relay_bus.clear_presence(_agent_channel(client_id))
         await _broadcast_status(client_id)
 
 
@@ -209,7 +332,7 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
     """
     await websocket.accept()
 
-    user = _get_ws_user(websocket)
+    user = await run_in_threadpool(_get_ws_user, websocket)
     if not user:
         await _close_with_reason(websocket, 4401, "Ikke logget ind")
         return
@@ -219,7 +342,7 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
         await _close_with_reason(websocket, 4403, "Kun superadmin må åbne fjernskrivebord")
         return
 
-    if not _client_exists_and_accessible(client_id, user):
+    if not await run_in_threadpool(_client_exists_and_accessible, client_id, user):
         await _close_with_reason(websocket, 4404, "Klient ikke fundet eller ingen adgang")
         return
 
@@ -232,28 +355,38 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
         username=user.username,
     )
 
-    async with LOCK:
-        BROWSERS[session_id] = browser
-        agent = AGENTS.get(client_id)
+    async def deliver(msg: dict[str, Any] | bytes) -> None:
+        browser.deliver(msg)
+
+    browser.queue.start()
+    BROWSERS[session_id] = browser
+    relay_bus.subscribe(_browser_channel(session_id), deliver)
+    relay_bus.subscribe(_status_channel(client_id), deliver)
+    await relay_bus.set_presence(_browser_channel(session_id), {
+        "client_id": client_id,
+        "username": user.username,
+        "group": _browsers_group(client_id),
+    })
+    agent = _agent_presence(client_id)
 
-    await _send_json(websocket, {
+    browser.queue.put({
         "type": "hello",
         "role": "browser",
         "session_id": session_id,
         "client_id": client_id,
         "agent_connected": bool(agent),
-        "width": agent.width if agent else None,
-        "height": agent.height if agent else None,
+        "width": agent.get("width") if agent else None,
+        "height": agent.get("height") if agent else None,
     })
 
     if agent:
-        await _send_json(agent.websocket, {
+        await relay_bus.send(_agent_channel(client_id), {
             "type": "browser_connected",
             "session_id": session_id,
             "username": user.username,
         })
     else:
-        await _send_json(websocket, {
+        browser.queue.put({
             "type": "status",
             "level": "warning",
             "message": "Remote desktop-agenten er ikke forbundet på klienten endnu.",
@@ -265,13 +398,13 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
             try:
                 msg = json.loads(raw)
             except Exception:
-                await _send_json(websocket, {"type": "error", "message": "Ugyldig JSON"})
+                browser.queue.put({"type": "error", "message": "Ugyldig JSON"})
                 continue
 
             msg_type = msg.get("type")
 
             if msg_type == "ping":
-                await _send_json(websocket, {"type": "pong", "ts": time.time()})
+                browser.queue.put({"type": "pong", "ts": time.time()})
                 continue
 
             if msg_type not in {
@@ -283,7 +416,7 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
                 "shout",
                 "request_frame",
             }:
-                await _send_json(websocket, {"type": "error", "message": f"Ukendt type: {msg_type}"})
+                browser.queue.put({"type": "error", "message": f"Ukendt type: {msg_type}"})
                 continue
 
             msg["session_id"] = session_id
@@ -296,18 +429,13 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
                     flush=True,
                 )
 
-            async with LOCK:
-                agent = AGENTS.get(client_id)
-
-            if not agent:
-                await _send_json(websocket, {
+            if not await relay_bus.send(_agent_channel(client_id), msg):
+                browser.queue.put({
                     "type": "error",
                     "message": "Klientens remote desktop-agent er ikke forbundet.",
                 })
                 continue
 
-            await _send_json(agent.websocket, msg)
-
             if msg_type == "shout":
                 print(
                     f"REMOTE_DESKTOP_SHOUT_FORWARDED client_id={client_id} session_id={session_id}",
@@ -322,41 +450,103 @@ async def remote_desktop_browser_ws(websocket: WebSocket, client_id: int):
         except Exception:
             pass
     finally:
-        async with LOCK:
-            BROWSERS.pop(session_id, None)
-            agent = AGENTS.get(client_id)
+        relay_bus.unsubscribe(_browser_channel(session_id), deliver)
+        relay_bus.unsubscribe(_status_channel(client_id), deliver)
+        BROWSERS.pop(session_id, None)
+        await browser.queue.close()
+        await relay_bus.clear_presence(_browser_channel(session_id))
 
-        if agent:
-            try:
-                await _send_json(agent.websocket, {
-                    "type": "stop_stream",
-                    "session_id": session_id,
-                })
-            except Exception:
-                pass
-
-
-async def _broadcast_status(client_id: int) -> None:
-    async with LOCK:
-        agent = AGENTS.get(client_id)
-        browsers = [b for b in BROWSERS.values() if b.client_id == client_id]
-
-    for browser in browsers:
         try:
-            await _send_json(browser.websocket, {
-                "type": "agent_status",
-                "agent_connected": bool(agent),
-                "width": agent.width if agent else None,
-                "height": agent.height if agent else None,
+            await relay_bus.send(_agent_channel(client_id), {
+                "type": "stop_stream",
+                "session_id": session_id,
             })
         except Exception:
             pass
 
 
+async def _fan_out_shared(conn: AgentConnection, raw: bytes) -> None:
+    """Delt stream: cache framen og send den til alle viewers."""
+    if KEYFRAMES.record(conn.client_id, raw):
+        await _send_json(conn.websocket, {
+            "type": "request_frame",
+            "keyframe": True,
+            "session_id": BROADCAST_SESSION_ID,
+        })
+    for sid in list(conn.viewers):
+        if not await relay_bus.send_bytes(_browser_channel(sid), raw):
+            # Browseren er væk uden stop_stream (fx en worker der døde).
+            conn.viewers.discard(sid)
+
+
+async def _replay_keyframe(client_id: int, session_id: str) -> bool:
+    """Send cachet keyframe + tiles til én session. False hvis cachen er tom."""
+    frames = KEYFRAMES.replay(client_id)
+    for data in frames:
+        await relay_bus.send_bytes(_browser_channel(session_id), data)
+    return bool(frames)
+
+
+async def _deliver_shared(conn: AgentConnection, msg: dict[str, Any]) -> bool:
+    """
+    Browser-besked til en agent med delt stream. True hvis beskeden skal
+    videre til agenten; stream-styring for én viewer håndteres her.
+    """
+    msg_type = msg.get("type")
+    session_id = str(msg.get("session_id") or "")
+
+    if msg_type == "start_stream":
+        first = not conn.viewers
+        conn.viewers.add(session_id)
+        if first:
+            return True
+        if await _replay_keyframe(conn.client_id, session_id):
+            return False
+        # Agenten streamer allerede, men der er ingen keyframe endnu.
+        await _send_json(conn.websocket, {
+            "type": "request_frame",
+            "keyframe": True,
+            "session_id": BROADCAST_SESSION_ID,
+        })
+        return False
+
+    if msg_type == "stop_stream":
+        conn.viewers.discard(session_id)
+        return not conn.viewers
+
+    if msg_type == "request_frame" and msg.get("keyframe"):
+        return not await _replay_keyframe(conn.client_id, session_id)
+
+    return True
+
+
+async def _broadcast_status(client_id: int) -> None:
+    agent = _agent_presence(client_id)
+    await relay_bus.publish(_status_channel(client_id), {
+        "type": "agent_status",
+        "agent_connected": bool(agent),
+        "width": agent.get("width") if agent else None,
+        "height": agent.get("height") if agent else None,
+    })
+
+
 @router.get("/clients/{client_id}/status")
 def remote_desktop_status(client_id: int):
     return {
         "client_id": client_id,
-        "agent_connected": client_id in AGENTS,
-        "browser_sessions": len([b for b in BROWSERS.values() if b.client_id == client_id]),
+        "agent_connected": _agent_presence(client_id) is not None,
+        "browser_sessions": len(relay_bus.presence_in_group(_browsers_group(client_id))),
+    }
+
+
+def stats() -> dict[str, Any]:
+    """Kø-dybde og drops pr. browser-session på denne worker (/health/remote-desktop)."""
+    return {
+        "agents": len(AGENTS),
+        "browsers": len(BROWSERS),
+        "keyframes": KEYFRAMES.stats(),
+        "sessions": {
+            sid: {"client_id": b.client_id, "username": b.username, **b.queue.stats()}
+            for sid, b in list(BROWSERS.items())
+        },
     }
@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 from sqlmodel import select
 from db import get_session
-from models import School, SchoolCreate, Client, CalendarMarking, User, SchoolSeasonTimes
+from models import School, SchoolCreate, Client, CalendarDay, User, SchoolSeasonTimes
 from pydantic import BaseModel
 from typing import Optional
-from auth import get_current_user, get_current_admin_user
-from datetime import date
+from auth import get_current_user, get_current_admin_user, invalidate_user_principal, invalidate_client_principal
+import calendar_store
+from season_calendar import get_season_calendar
 
 router = APIRouter()
 
@@ -42,24 +43,6 @@ def _validate_season(season: str) -> str:
     return season
 
 
-def _get_school_year_dates(season: str):
-    start_year = int(season.split("/")[0])
-    dates = []
-    for month in range(8, 13):
-        for day in range(1, 32):
-            try:
-                dates.append(date(start_year, month, day))
-            except ValueError:
-                continue
-    for month in range(1, 8):
-        for day in range(1, 32):
-            try:
-                dates.append(date(start_year + 1, month, day))
-            except ValueError:
-                continue
-    return dates
-
-
 @router.get("/schools/", response_model=list[School])
 def get_schools(session=Depends(get_session), user=Depends(get_current_user)):
     if user.is_superadmin:
@@ -76,8 +59,6 @@ def get_season_summary(session=Depends(get_session), user=Depends(get_current_us
     Returnerer hvilke sæsoner der har kalenderdata og hvilke skoler per sæson.
     Superadmin ser alle skoler. Almindelige admins/brugere ser kun egen skole.
     """
-    markings = session.exec(select(CalendarMarking)).all()
-    clients = session.exec(select(Client)).all()
     if user.is_superadmin:
         allowed_school_ids = None
     elif user.school_id:
@@ -85,24 +66,22 @@ def get_season_summary(session=Depends(get_session), user=Depends(get_current_us
     else:
         allowed_school_ids = set()
 
-    client_school_map = {
-        c.id: c.school_id
-        for c in clients
-        if c.school_id and (allowed_school_ids is None or c.school_id in allowed_school_ids)
-    }
     schools = session.exec(select(School)).all()
     school_map = {s.id: s.name for s in schools if allowed_school_ids is None or s.id in allowed_school_ids}
 
-    # Byg sæson → set af school_ids
+    # Sæson → set af school_ids, udregnet som DISTINCT i SQL i stedet for at
+    # hente alle kalenderdage.
+    pairs = session.exec(
+        select(CalendarDay.season, Client.school_id)
+        .join(Client, Client.id == CalendarDay.client_id)
+        .where(Client.school_id != None)
+        .distinct()
+    ).all()
     season_schools: dict[str, set] = {}
-    for marking in markings:
-        season = marking.season
-        school_id = client_school_map.get(marking.client_id)
-        if not season or not school_id:
+    for season, school_id in pairs:
+        if not season or (allowed_school_ids is not None and school_id not in allowed_school_ids):
             continue
-        if season not in season_schools:
-            season_schools[season] = set()
-        season_schools[season].add(school_id)
+        season_schools.setdefault(season, set()).add(school_id)
 
     # Byg resultat
     result = {}
@@ -150,17 +129,23 @@ def delete_school(school_id: int, session=Depends(get_session), admin=Depends(ge
     if not school:
         raise HTTPException(status_code=404, detail="Skole ikke fundet")
     clients = session.exec(select(Client).where(Client.school_id == school_id)).all()
+    removed_client_ids = [client.id for client in clients]
+    calendar_store.delete_for_clients(session, removed_client_ids)
     for client in clients:
-        for marking in session.exec(select(CalendarMarking).where(CalendarMarking.client_id == client.id)).all():
-            session.delete(marking)
         session.delete(client)
+    school_usernames = []
     for school_user in session.exec(select(User).where(User.school_id == school_id)).all():
         school_user.school_id = None
+        school_usernames.append(school_user.username)
         session.add(school_user)
     for st in session.exec(select(SchoolSeasonTimes).where(SchoolSeasonTimes.school_id == school_id)).all():
         session.delete(st)
     session.delete(school)
     session.commit()
+    for client_id in removed_client_ids:
+        invalidate_client_principal(client_id)
+    for username in school_usernames:
+        invalidate_user_principal(username)
 
 
 @router.patch("/schools/{school_id}/times", response_model=School)
@@ -304,48 +289,43 @@ def apply_season_times_to_clients(
         we_on  = school.weekend_on  or "08:00"
         we_off = school.weekend_off or "18:00"
 
-    all_dates = _get_school_year_dates(season)
-    clients = session.exec(
-        select(Client).where(
+    calendar = get_season_calendar(session, season)
+    client_ids = session.exec(
+        select(Client.id).where(
             Client.school_id == school_id,
             Client.status == "approved"
         )
     ).all()
-    if not clients:
+    if not client_ids:
         raise HTTPException(status_code=404, detail="Ingen godkendte klienter fundet for denne skole")
 
-    updated_clients = []
-    for client in clients:
-        new_markings = {}
-        for d in all_dates:
-            is_weekend = d.weekday() >= 5
-            if is_weekend:
-                new_markings[d.isoformat()] = {"status": "on", "onTime": we_on, "offTime": we_off}
-            else:
-                new_markings[d.isoformat()] = {"status": "on", "onTime": wd_on, "offTime": wd_off}
-
-        existing = session.exec(
-            select(CalendarMarking).where(
-                CalendarMarking.season == season,
-                CalendarMarking.client_id == client.id
-            )
-        ).first()
-        if existing:
-            existing.markings = new_markings
-            session.add(existing)
-        else:
-            session.add(CalendarMarking(
-                season=season, client_id=client.id, markings=new_markings
-            ))
-        updated_clients.append(client.id)
+    # Skabelonen er ens for alle klienter og bygges derfor kun én gang.
+    # Helligdage (Holiday) lægges ind som slukkede dage med hverdagstider.
+    template = calendar.template(
+        {"status": "on", "onTime": wd_on, "offTime": wd_off},
+        {"status": "on", "onTime": we_on, "offTime": we_off},
+        holiday_entry={"status": "off", "onTime": wd_on, "offTime": wd_off},
+    )
 
+    result = calendar_store.apply_season_template(session, list(client_ids), season, template)
     session.commit()
+    print(
+        f"[SEASON_TIMES] Skole {school_id} {season}: {len(client_ids)} klienter, "
+        f"upserted={result['upserted']} deleted={result['deleted']} unchanged={result['unchanged']} "
+        f"timings_ms={result['timings_ms']}",
+        flush=True,
+    )
     return {
         "ok": True,
         "school_id": school_id,
         "season": season,
-        "updated_clients": updated_clients,
-        "total_days": len(all_dates),
+        "updated_clients": list(client_ids),
+        "total_days": len(calendar.dates),
+        "holiday_days": len(calendar.holidays),
+        "upserted_days": result["upserted"],
+        "deleted_days": result["deleted"],
+        "unchanged_days": result["unchanged"],
+        "timings_ms": result["timings_ms"],
     }
 
 
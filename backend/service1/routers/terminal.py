@@ -14,10 +14,21 @@ v6.6:
     mode=admin  -> admin/root-terminal-agent på klienten
 - Browser-terminal er fortsat superadmin-only.
 - Remote desktop er IKKE ændret og forbliver kiosk-sessionen.
+
+Flere workers:
+- CLIENTS/BROWSERS rummer kun forbindelser på denne worker. Beskeder går via
+  relay_bus (term:client:<id>:<mode>, term:browser:<sid>,
+  term:status:<id>:<mode>), og forbindelsesstatus slås op i presence.
+
+Output:
+- Alt til browseren går gennem sessionens TerminalFlow (terminal_flow.py),
+  som samler output-bidder og holder et ack-vindue. Agenten får
+  {"type": "flow", "action": "pause"|"resume"} når browseren halter.
+- Agentens worker gemmer terminalens seneste forløb (terminal_scrollback.py)
+  og sender det som én "scrollback"-frame til browsere der forbinder.
 """
 from __future__ import annotations
 
-import asyncio
 import json
 import time
 import uuid
@@ -25,11 +36,16 @@ from dataclasses import dataclass, field
 from typing import Any, Optional
 
 from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
 
 from auth import verify_ws_token
 from db import engine
 from models import Client, User
+from relay_bus import relay_bus
+from session_registry import ShardedLocks
+from terminal_flow import TerminalFlow
+from terminal_scrollback import TerminalScrollback
 
 router = APIRouter(prefix="/terminal", tags=["terminal"])
 
@@ -44,6 +60,7 @@ class ClientConnection:
     user_id: Optional[int]
     connected_at: float = field(default_factory=time.time)
     hostname: Optional[str] = None
+    conn_id: str = field(default_factory=lambda: uuid.uuid4().hex)
 
 
 @dataclass
@@ -55,13 +72,16 @@ class BrowserSession:
     user_id: Optional[int]
     username: str
     connected_at: float = field(default_factory=time.time)
+    flow: Optional[TerminalFlow] = None
 
 
 # Nøgle: (client_id, mode). Det gør, at user-terminal og admin/root-terminal
 # kan være forbundet samtidigt uden at overskrive hinanden.
 CLIENTS: dict[tuple[int, str], ClientConnection] = {}
 BROWSERS: dict[str, BrowserSession] = {}
-LOCK = asyncio.Lock()
+# Serialiserer kun registrering af agenter for samme (client_id, mode).
+LOCKS = ShardedLocks()
+SCROLLBACK = TerminalScrollback()
 
 
 def _normalize_mode(mode: str | None) -> str:
@@ -75,6 +95,18 @@ async def _send_json(ws: WebSocket, payload: dict[str, Any]) -> None:
     await ws.send_text(json.dumps(payload, ensure_ascii=False))
 
 
+def _client_channel(client_id: int, mode: str) -> str:
+    return f"term:client:{client_id}:{mode}"
+
+
+def _browser_channel(session_id: str) -> str:
+    return f"term:browser:{session_id}"
+
+
+def _status_channel(client_id: int, mode: str) -> str:
+    return f"term:status:{client_id}:{mode}"
+
+
 def _extract_token(websocket: WebSocket) -> Optional[str]:
     token = websocket.query_params.get("token")
     if token:
@@ -140,7 +172,7 @@ async def terminal_client_ws(
     await websocket.accept()
     mode = _normalize_mode(mode)
 
-    principal = _get_ws_user(websocket)
+    principal = await run_in_threadpool(_get_ws_user, websocket)
     if not principal:
         await _close_with_reason(websocket, 4401, "Ikke logget ind")
         return
@@ -159,25 +191,38 @@ async def terminal_client_ws(
         )
         return
 
-    if not _client_exists_and_accessible(client_id, principal):
+    if not await run_in_threadpool(_client_exists_and_accessible, client_id, principal):
         await _close_with_reason(websocket, 4404, "Klient ikke fundet, ikke godkendt eller ingen adgang")
         return
 
     key = (client_id, mode)
-    async with LOCK:
-        old = CLIENTS.get(key)
-        if old:
-            try:
-                await old.websocket.close(code=4400, reason=f"Ny terminal-agent forbandt mode={mode}")
-            except Exception:
-                pass
+    channel = _client_channel(client_id, mode)
+    conn = ClientConnection(
+        client_id=client_id,
+        mode=mode,
+        websocket=websocket,
+        user_id=None if isinstance(principal, Client) else principal.id,
+    )
 
-        CLIENTS[key] = ClientConnection(
-            client_id=client_id,
-            mode=mode,
-            websocket=websocket,
-            user_id=None if isinstance(principal, Client) else principal.id,
-        )
+    async def deliver(msg: dict[str, Any]) -> None:
+        # En nyere agent med samme mode (evt. på en anden worker) overtager.
+        if msg.get("type") == "_replaced":
+            if msg.get("conn_id") != conn.conn_id:
+                await _close_with_reason(websocket, 4400, f"Ny terminal-agent forbandt mode={mode}")
+            return
+        if msg.get("type") == "_scrollback":
+            # Browseren kan sidde på en anden worker; scrollback ligger her hos agenten.
+            replay = SCROLLBACK.replay_message(client_id, mode)
+            if replay is not None:
+                await relay_bus.send(_browser_channel(str(msg.get("session_id"))), replay)
+            return
+        await _send_json(websocket, msg)
+
+    async with LOCKS.lock(key):
+        CLIENTS[key] = conn
+        relay_bus.subscribe(channel, deliver)
+        await relay_bus.publish(channel, {"type": "_replaced", "conn_id": conn.conn_id})
+        await relay_bus.set_presence(channel, {"hostname": None, "conn_id": conn.conn_id})
 
     await _send_json(websocket, {"type": "hello", "role": "client", "client_id": client_id, "mode": mode})
     await _broadcast_status(client_id, mode)
@@ -194,31 +239,28 @@ async def terminal_client_ws(
             session_id = msg.get("session_id")
 
             if msg_type == "hello":
-                async with LOCK:
-                    conn = CLIENTS.get(key)
-                    if conn and conn.websocket is websocket:
-                        conn.hostname = msg.get("hostname")
+                if CLIENTS.get(key) is conn:
+                    conn.hostname = msg.get("hostname")
+                    await relay_bus.set_presence(channel, {"hostname": conn.hostname, "conn_id": conn.conn_id})
                 await _broadcast_status(client_id, mode)
                 continue
 
             if session_id:
-                async with LOCK:
-                    browser = BROWSERS.get(str(session_id))
-                    # Send kun svar tilbage til browser-sessioner med samme mode.
-                    if browser and browser.client_id == client_id and browser.mode == mode:
-                        try:
-                            await _send_json(browser.websocket, msg)
-                        except Exception:
-                            pass
+                # Send kun svar tilbage til browser-sessioner med samme klient og mode.
+                browser = relay_bus.get_presence(_browser_channel(str(session_id)))
+                if browser and browser.get("client_id") == client_id and browser.get("mode") == mode:
+                    SCROLLBACK.record(client_id, mode, msg)
+                    await relay_bus.send(_browser_channel(str(session_id)), msg)
     except WebSocketDisconnect:
         pass
     except Exception:
         pass
     finally:
-        async with LOCK:
-            conn = CLIENTS.get(key)
-            if conn and conn.websocket is websocket:
+        relay_bus.unsubscribe(channel, deliver)
+        async with LOCKS.lock(key):
+            if CLIENTS.get(key) is conn:
                 CLIENTS.pop(key, None)
+                await relay_bus.clear_presence(channel)
         await _broadcast_status(client_id, mode)
 
 
@@ -227,12 +269,16 @@ async def terminal_browser_ws(
     websocket: WebSocket,
     client_id: int,
     mode: str = Query(default="user"),
+    flow: int = Query(default=0),
 ):
-    """Frontend/browserens terminal WebSocket."""
+    """
+    Frontend/browserens terminal WebSocket. flow=1: browseren sender
+    {"type": "ack", "bytes": size} for hver output-besked.
+    """
     await websocket.accept()
     mode = _normalize_mode(mode)
 
-    user = _get_ws_user(websocket)
+    user = await run_in_threadpool(_get_ws_user, websocket)
     if not user:
         await _close_with_reason(websocket, 4401, "Ikke logget ind")
         return
@@ -243,7 +289,7 @@ async def terminal_browser_ws(
         await _close_with_reason(websocket, 4403, "Kun superadmin må åbne remote terminal")
         return
 
-    if not _client_exists_and_accessible(client_id, user):
+    if not await run_in_threadpool(_client_exists_and_accessible, client_id, user):
         await _close_with_reason(websocket, 4404, "Klient ikke fundet eller ingen adgang")
         return
 
@@ -257,33 +303,47 @@ async def terminal_browser_ws(
         username=user.username,
     )
 
-    key = (client_id, mode)
-    async with LOCK:
-        BROWSERS[session_id] = browser
-        client_conn = CLIENTS.get(key)
-
-    await _send_json(
-        websocket,
-        {
-            "type": "hello",
-            "role": "browser",
+    channel = _client_channel(client_id, mode)
+
+    async def on_flow(request_id: Optional[str], pause: bool) -> None:
+        await relay_bus.send(channel, {
+            "type": "flow",
+            "action": "pause" if pause else "resume",
             "session_id": session_id,
-            "client_id": client_id,
-            "mode": mode,
-            "client_connected": bool(client_conn),
-        },
-    )
+            "request_id": request_id,
+        })
+
+    browser.flow = TerminalFlow(websocket, on_flow, windowed=bool(flow))
+    browser.flow.start()
 
-    if not client_conn:
+    async def deliver(msg: dict[str, Any]) -> None:
+        browser.flow.put(msg)
+
+    BROWSERS[session_id] = browser
+    relay_bus.subscribe(_browser_channel(session_id), deliver)
+    relay_bus.subscribe(_status_channel(client_id, mode), deliver)
+    await relay_bus.set_presence(_browser_channel(session_id), {"client_id": client_id, "mode": mode})
+    client_conn = relay_bus.get_presence(channel)
+
+    browser.flow.put({
+        "type": "hello",
+        "role": "browser",
+        "session_id": session_id,
+        "client_id": client_id,
+        "mode": mode,
+        "client_connected": bool(client_conn),
+        "flow": browser.flow.windowed,
+    })
+
+    if client_conn:
+        await relay_bus.send(channel, {"type": "_scrollback", "session_id": session_id})
+    else:
         label = "admin/root-terminal-agenten" if mode == "admin" else "terminal-agenten"
-        await _send_json(
-            websocket,
-            {
-                "type": "status",
-                "level": "warning",
-                "message": f"{label} er ikke forbundet på klienten endnu.",
-            },
-        )
+        browser.flow.put({
+            "type": "status",
+            "level": "warning",
+            "message": f"{label} er ikke forbundet på klienten endnu.",
+        })
 
     try:
         while True:
@@ -291,38 +351,35 @@ async def terminal_browser_ws(
             try:
                 msg = json.loads(raw)
             except Exception:
-                await _send_json(websocket, {"type": "error", "message": "Ugyldig JSON"})
+                browser.flow.put({"type": "error", "message": "Ugyldig JSON"})
                 continue
 
             msg_type = msg.get("type")
             if msg_type == "ping":
-                await _send_json(websocket, {"type": "pong", "ts": time.time()})
+                browser.flow.put({"type": "pong", "ts": time.time()})
+                continue
+
+            if msg_type == "ack":
+                try:
+                    browser.flow.ack(int(msg.get("bytes") or 0))
+                except (TypeError, ValueError):
+                    pass
                 continue
 
             if msg_type != "run":
-                await _send_json(websocket, {"type": "error", "message": f"Ukendt type: {msg_type}"})
+                browser.flow.put({"type": "error", "message": f"Ukendt type: {msg_type}"})
                 continue
 
             command = str(msg.get("command") or "").strip()
             if not command:
                 continue
             if len(command) > 4000:
-                await _send_json(websocket, {"type": "error", "message": "Kommandoen er for lang"})
+                browser.flow.put({"type": "error", "message": "Kommandoen er for lang"})
                 continue
 
             request_id = uuid.uuid4().hex
-            async with LOCK:
-                client_conn = CLIENTS.get(key)
-
-            if not client_conn:
-                await _send_json(
-                    websocket,
-                    {"type": "error", "message": "Klientens terminal-agent er ikke forbundet."},
-                )
-                continue
-
-            await _send_json(
-                client_conn.websocket,
+            sent = await relay_bus.send(
+                channel,
                 {
                     "type": "run",
                     "session_id": session_id,
@@ -332,6 +389,8 @@ async def terminal_browser_ws(
                     "mode": mode,
                 },
             )
+            if not sent:
+                browser.flow.put({"type": "error", "message": "Klientens terminal-agent er ikke forbundet."})
     except WebSocketDisconnect:
         pass
     except Exception as e:
@@ -340,33 +399,46 @@ async def terminal_browser_ws(
         except Exception:
             pass
     finally:
-        async with LOCK:
-            BROWSERS.pop(session_id, None)
+        relay_bus.unsubscribe(_browser_channel(session_id), deliver)
+        relay_bus.unsubscribe(_status_channel(client_id, mode), deliver)
+        BROWSERS.pop(session_id, None)
+        await browser.flow.close()
+        await relay_bus.clear_presence(_browser_channel(session_id))
 
 
 async def _broadcast_status(client_id: int, mode: str) -> None:
-    key = (client_id, mode)
-    async with LOCK:
-        connected = key in CLIENTS
-        browsers = [b for b in BROWSERS.values() if b.client_id == client_id and b.mode == mode]
-
-    for browser in browsers:
-        try:
-            await _send_json(
-                browser.websocket,
-                {"type": "agent_status", "client_connected": connected, "mode": mode},
-            )
-        except Exception:
-            pass
+    connected = relay_bus.get_presence(_client_channel(client_id, mode)) is not None
+    await relay_bus.publish(
+        _status_channel(client_id, mode),
+        {"type": "agent_status", "client_connected": connected, "mode": mode},
+    )
 
 
 @router.get("/clients/{client_id}/status")
 def terminal_status(client_id: int, mode: str = Query(default="user")):
     """Letvægts-status endpoint til debugging."""
     mode = _normalize_mode(mode)
+    connected_modes = sorted(
+        m for m in VALID_TERMINAL_MODES
+        if relay_bus.get_presence(_client_channel(client_id, m)) is not None
+    )
     return {
         "client_id": client_id,
         "mode": mode,
-        "client_connected": (client_id, mode) in CLIENTS,
-        "connected_modes": sorted([m for (cid, m) in CLIENTS.keys() if cid == client_id]),
+        "client_connected": mode in connected_modes,
+        "connected_modes": connected_modes,
+    }
+
+
+def stats() -> dict[str, Any]:
+    """Output-buffer og ack-vindue pr. browser-session på denne worker (/health/terminal)."""
+    return {
+        "clients": len(CLIENTS),
+        "browsers": len(BROWSERS),
+        "scrollback": SCROLLBACK.stats(),
+        "sessions": {
+            sid: {"client_id": b.client_id, "mode": b.mode, **b.flow.stats()}
+            for sid, b in list(BROWSERS.items())
+            if b.flow is not None
+        },
     }
@@ -9,6 +9,7 @@ from auth import (
     get_current_admin_user,
     get_current_user,
     get_password_hash,
+    invalidate_user_principal,
     validate_password_strength,
     verify_password,
 )
@@ -235,6 +236,7 @@ def update_user(
         session.add(user)
         session.commit()
         session.refresh(user)
+        invalidate_user_principal(user.username)
         return user
 
     # Admin-operationer herunder:
@@ -285,6 +287,8 @@ def update_user(
     session.add(user)
     session.commit()
     session.refresh(user)
+    # Rolle, aktiv-status, skole og kodeord må ikke leve videre i principal-cachen.
+    invalidate_user_principal(user.username)
     return user
 
 
@@ -312,5 +316,7 @@ def delete_user(
             detail="Kan ikke slette den sidste aktive superadministrator",
         )
 
+    username = user.username
     session.delete(user)
     session.commit()
+    invalidate_user_principal(username)
@@ -0,0 +1,288 @@
+"""
+schedule_publisher.py
+
+Baggrundskø der skubber gemte kalendere ud til kiosk-agenterne
+(POST http://<klient-ip>:8000/api/update_schedule).
+
+Tidligere kaldte save_marked_days requests.post(..., timeout=5) sekventielt
+for hver klient inde i request-handleren, mens DB-sessionen var åben. 30
+offline klienter kunne dermed blokere en worker i 150 sek.
+
+Nu:
+- save_marked_days committer, markerer klienterne som "queued" og returnerer,
+- N workers (SCHEDULE_PUBLISH_CONCURRENCY) deler én httpx.AsyncClient med
+  connection-pool,
+- fejl prøves igen med eksponentiel backoff op til SCHEDULE_PUBLISH_MAX_ATTEMPTS,
+- status pr. klient gemmes i SchedulePublishStatus og kan hentes via
+  GET /calendar/publish-status.
+
+Kalenderen læses fra databasen på sendetidspunktet, så flere gem lige efter
+hinanden samles til én levering med den nyeste version.
+
+Køen ligger kun i hukommelsen. Ved opstart (run) lægges rækker med status
+queued/sending i køen igen, og retrying planlægges til next_attempt_at, så
+en genstart eller deploy ikke efterlader leveringer der aldrig behandles.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+from datetime import timedelta
+from typing import Any, Optional
+
+import httpx
+from sqlmodel import Session, select
+
+import calendar_store
+from db import _env_int, engine
+from models import Client, SchedulePublishStatus, utcnow
+
+SCHEDULE_PUBLISH_CONCURRENCY = _env_int("SCHEDULE_PUBLISH_CONCURRENCY", 8, min_value=1)
+SCHEDULE_PUBLISH_TIMEOUT_SECONDS = _env_int("SCHEDULE_PUBLISH_TIMEOUT_SECONDS", 5, min_value=1)
+SCHEDULE_PUBLISH_MAX_ATTEMPTS = _env_int("SCHEDULE_PUBLISH_MAX_ATTEMPTS", 4, min_value=1)
+SCHEDULE_PUBLISH_BACKOFF_SECONDS = _env_int("SCHEDULE_PUBLISH_BACKOFF_SECONDS", 5, min_value=1)
+_MAX_BACKOFF_SECONDS = 300
+
+
+def _is_safe_private_ip(ip_str: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip_str)
+        return addr.is_private or addr.is_loopback
+    except ValueError:
+        return False
+
+
+class _Skip(Exception):
+    """Leveringen kan ikke lykkes ved at prøve igen (ingen IP, offentlig IP)."""
+
+
+def mark_queued(session, client_id: int, season: str) -> None:
+    """Sæt status 'queued' i kalderens transaktion (committes sammen med kalenderen)."""
+    row = session.get(SchedulePublishStatus, client_id) or SchedulePublishStatus(client_id=client_id)
+    row.season = season
+    row.status = "queued"
+    row.attempts = 0
+    row.last_error = None
+    row.queued_at = utcnow()
+    row.next_attempt_at = None
+    session.add(row)
+
+
+def _update_status(client_id: int, **fields: Any) -> None:
+    with Session(engine) as session:
+        row = session.get(SchedulePublishStatus, client_id) or SchedulePublishStatus(client_id=client_id)
+        for name, value in fields.items():
+            setattr(row, name, value)
+        session.add(row)
+        session.commit()
+
+
+def _load_job(client_id: int, season: str) -> tuple[str, dict[str, Any]]:
+    """(url, markedDays) for klienten. Rejser _Skip hvis der ikke kan leveres."""
+    with Session(engine) as session:
+        client = session.get(Client, client_id)
+        if client is None:
+            raise _Skip("Klienten findes ikke længere")
+        client_ip = client.lan_ip_address or client.wifi_ip_address
+        if not client_ip:
+            raise _Skip("Klienten har ingen IP-adresse")
+        if not _is_safe_private_ip(client_ip):
+            print(f"[SCHEDULE] SSRF-advarsel: Klient {client_id} har offentlig IP ({client_ip}) — afviser", flush=True)
+            raise _Skip(f"Offentlig IP afvist ({client_ip})")
+        marked_days = calendar_store.read_days(session, client_id, season=season)
+    return f"http://{client_ip}:8000/api/update_schedule", marked_days
+
+
+_UNFINISHED = ("queued", "sending", "retrying")
+
+
+def _load_unfinished() -> list[tuple[int, Optional[str], str, int, Optional[Any]]]:
+    """(client_id, season, status, attempts, next_attempt_at) for ufærdige leveringer."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(SchedulePublishStatus).where(SchedulePublishStatus.status.in_(_UNFINISHED))
+        ).all()
+        return [(r.client_id, r.season, r.status, r.attempts, r.next_attempt_at) for r in rows]
+
+
+def list_status(session, client_ids: list[int]) -> list[SchedulePublishStatus]:
+    if not client_ids:
+        return []
+    return session.exec(
+        select(SchedulePublishStatus).where(SchedulePublishStatus.client_id.in_(client_ids))
+    ).all()
+
+
+class SchedulePublisher:
+    def __init__(self, concurrency: int = SCHEDULE_PUBLISH_CONCURRENCY):
+        self.concurrency = concurrency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        # client_id -> (season, attempt) for job der venter i køen.
+        self._pending: dict[int, tuple[str, int]] = {}
+        self._inflight: set[int] = set()
+        # Nyt gem mens klienten sendes: kør igen bagefter med nyeste data.
+        self._rerun: dict[int, str] = {}
+        self._retry_handles: dict[int, asyncio.TimerHandle] = {}
+        self.stats_counters = {"queued": 0, "delivered": 0, "retries": 0, "failed": 0, "skipped": 0}
+
+    # -- producer side ---------------------------------------------------------
+    def enqueue(self, client_ids: list[int], season: str) -> None:
+        """Trådsikker: kaldes fra sync endpoints efter commit."""
+        if self._loop is None:
+            print("[SCHEDULE] Publisher kører ikke — leveringer forbliver 'queued'", flush=True)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._enqueue_now, list(client_ids), season)
+        except RuntimeError:
+            pass
+
+    def _enqueue_now(self, client_ids: list[int], season: str, attempt: int = 1) -> None:
+        for client_id in client_ids:
+            if attempt == 1:
+                # Et nyt gem overhaler en planlagt retry.
+                handle = self._retry_handles.pop(client_id, None)
+                if handle is not None:
+                    handle.cancel()
+            elif client_id not in self._retry_handles:
+                continue
+            else:
+                self._retry_handles.pop(client_id, None)
+
+            if client_id in self._inflight:
+                self._rerun[client_id] = season
+                continue
+            already_pending = client_id in self._pending
+            self._pending[client_id] = (season, attempt)
+            if not already_pending:
+                self._queue.put_nowait(client_id)
+                self.stats_counters["queued"] += 1
+
+    # -- workers ---------------------------------------------------------------
+    async def run(self) -> None:
+        """Baggrundsopgave startet fra lifespan i main.py."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+        try:
+            await self._resume_unfinished()
+        except Exception as e:
+            print(f"[SCHEDULE] Kunne ikke genoptage ufærdige leveringer: {e!r}", flush=True)
+        async with httpx.AsyncClient(timeout=SCHEDULE_PUBLISH_TIMEOUT_SECONDS, limits=limits) as http:
+            workers = [asyncio.create_task(self._worker(http)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                for handle in self._retry_handles.values():
+                    handle.cancel()
+                self._retry_handles.clear()
+                self._loop = None
+
+    async def _resume_unfinished(self) -> None:
+        """Leveringer der var i køen, da processen sidst stoppede."""
+        rows = await asyncio.to_thread(_load_unfinished)
+        now = utcnow()
+        resumed = 0
+        for client_id, season, status, attempts, next_attempt_at in rows:
+            if not season:
+                await asyncio.to_thread(
+                    _update_status, client_id, status="failed", last_error="Afbrudt af genstart (ingen sæson)",
+                )
+                continue
+            resumed += 1
+            if status == "retrying" and attempts < SCHEDULE_PUBLISH_MAX_ATTEMPTS:
+                delay = max(0.0, (next_attempt_at - now).total_seconds()) if next_attempt_at else 0.0
+                self._retry_handles[client_id] = self._loop.call_later(
+                    delay, self._enqueue_now, [client_id], season, attempts + 1,
+                )
+            else:
+                self._enqueue_now([client_id], season)
+        if resumed:
+            print(f"[SCHEDULE] Genoptager {resumed} ufærdige leveringer efter genstart", flush=True)
+
+    async def _worker(self, http: httpx.AsyncClient) -> None:
+        while True:
+            client_id = await self._queue.get()
+            job = self._pending.pop(client_id, None)
+            if job is None:
+                continue
+            season, attempt = job
+            self._inflight.add(client_id)
+            try:
+                await self._deliver(http, client_id, season, attempt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[SCHEDULE] Uventet fejl for klient {client_id}: {e!r}", flush=True)
+            finally:
+                self._inflight.discard(client_id)
+                rerun_season = self._rerun.pop(client_id, None)
+                if rerun_season is not None:
+                    self._enqueue_now([client_id], rerun_season)
+
+    async def _deliver(self, http: httpx.AsyncClient, client_id: int, season: str, attempt: int) -> None:
+        now = utcnow()
+        await asyncio.to_thread(
+            _update_status, client_id,
+            status="sending", attempts=attempt, last_attempt_at=now, next_attempt_at=None,
+        )
+        try:
+            url, marked_days = await asyncio.to_thread(_load_job, client_id, season)
+        except _Skip as e:
+            self.stats_counters["skipped"] += 1
+            print(f"[SCHEDULE] Klient {client_id} springes over: {e}", flush=True)
+            await asyncio.to_thread(_update_status, client_id, status="skipped", last_error=str(e))
+            return
+
+        try:
+            resp = await http.post(url, json={"markedDays": marked_days})
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            await self._handle_failure(client_id, season, attempt, url, e)
+            return
+
+        self.stats_counters["delivered"] += 1
+        print(f"[SCHEDULE] Sendt kalender til klient {client_id} ({url})", flush=True)
+        await asyncio.to_thread(
+            _update_status, client_id,
+            status="delivered", last_error=None, delivered_at=utcnow(),
+        )
+
+    async def _handle_failure(self, client_id: int, season: str, attempt: int, url: str, error: Exception) -> None:
+        message = f"{type(error).__name__}: {error}"
+        if attempt >= SCHEDULE_PUBLISH_MAX_ATTEMPTS:
+            self.stats_counters["failed"] += 1
+            print(f"[SCHEDULE] Opgiver klient {client_id} ({url}) efter {attempt} forsøg: {message}", flush=True)
+            await asyncio.to_thread(_update_status, client_id, status="failed", last_error=message)
+            return
+
+        delay = min(SCHEDULE_PUBLISH_BACKOFF_SECONDS * (2 ** (attempt - 1)), _MAX_BACKOFF_SECONDS)
+        self.stats_counters["retries"] += 1
+        print(f"[SCHEDULE] Fejl ved send til klient {client_id} ({url}): {message} — nyt forsøg om {delay}s", flush=True)
+        await asyncio.to_thread(
+            _update_status, client_id,
+            status="retrying", last_error=message,
+            next_attempt_at=utcnow() + timedelta(seconds=delay),
+        )
+        self._retry_handles[client_id] = self._loop.call_later(
+            delay, self._enqueue_now, [client_id], season, attempt + 1,
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "running": self._loop is not None,
+            "concurrency": self.concurrency,
+            "queued_now": len(self._pending),
+            "inflight": len(self._inflight),
+            "scheduled_retries": len(self._retry_handles),
+            **self.stats_counters,
+        }
+
+
+schedule_publisher = SchedulePublisher()
@@ -0,0 +1,140 @@
+"""
+season_calendar.py
+
+Memoiseret skoleårs-kalender (1. august – 31. juli) pr. sæson.
+
+Datoerne, ugedagsflag og ISO-strenge for en sæson er rene funktioner af
+startåret og beregnes derfor kun én gang pr. proces. Helligdage fra Holiday
+lægges ovenpå og caches, indtil invalidate_holidays() kaldes fra
+routers/holidays.py.
+
+Bruges af approve_client, apply_season_times_to_clients og valideringen af
+POST /calendar/marked-days.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Optional
+
+from sqlmodel import select
+
+from models import Holiday
+
+
+def current_season(today: Optional[date] = None) -> str:
+    """Sæsonen der indeholder today, fx '2025/2026'."""
+    today = today or date.today()
+    start = today.year if today.month >= 8 else today.year - 1
+    return f"{start}/{start + 1}"
+
+
+def season_start_year(season: str) -> int:
+    """'2025/2026' -> 2025. Kalderen validerer formatet (se _validate_season)."""
+    return int(str(season).split("/")[0])
+
+
+@lru_cache(maxsize=16)
+def _season_dates(start_year: int) -> tuple[date, ...]:
+    first = date(start_year, 8, 1)
+    last = date(start_year + 1, 7, 31)
+    return tuple(first + timedelta(days=i) for i in range((last - first).days + 1))
+
+
+@dataclass(frozen=True)
+class SeasonCalendar:
+    season: str
+    dates: tuple[date, ...]
+    iso: tuple[str, ...]
+    is_weekend: tuple[bool, ...]
+    holidays: frozenset[date]
+
+    @property
+    def first(self) -> date:
+        return self.dates[0]
+
+    @property
+    def last(self) -> date:
+        return self.dates[-1]
+
+    def contains(self, day: date) -> bool:
+        return self.first <= day <= self.last
+
+    def is_holiday(self, day: date) -> bool:
+        return day in self.holidays
+
+    def template(
+        self,
+        weekday_entry: dict[str, Any],
+        weekend_entry: dict[str, Any],
+        holiday_entry: Optional[dict[str, Any]] = None,
+    ) -> dict[date, dict[str, Any]]:
+        """{dato: dag-objekt} for hele sæsonen. holiday_entry overskriver helligdage."""
+        out = {
+            day: (weekend_entry if weekend else weekday_entry)
+            for day, weekend in zip(self.dates, self.is_weekend)
+        }
+        if holiday_entry is not None:
+            for day in self.holidays:
+                out[day] = holiday_entry
+        return out
+
+
+_lock = threading.Lock()
+_calendars: dict[str, SeasonCalendar] = {}
+_holidays: Optional[frozenset[date]] = None
+# Tælles op ved invalidate_holidays(); det der er læst før, gemmes ikke.
+_generation = 0
+
+
+def _load_holidays(session) -> frozenset[date]:
+    global _holidays
+    with _lock:
+        if _holidays is not None:
+            return _holidays
+        generation = _generation
+    days = set()
+    for raw in session.exec(select(Holiday.date)).all():
+        try:
+            days.add(date.fromisoformat(str(raw)[:10]))
+        except ValueError:
+            continue
+    loaded = frozenset(days)
+    with _lock:
+        if generation == _generation:
+            _holidays = loaded
+    return loaded
+
+
+def get_season_calendar(session, season: str) -> SeasonCalendar:
+    with _lock:
+        cached = _calendars.get(season)
+        generation = _generation
+    if cached is not None:
+        return cached
+
+    dates = _season_dates(season_start_year(season))
+    holidays = _load_holidays(session)
+    calendar = SeasonCalendar(
+        season=season,
+        dates=dates,
+        iso=tuple(d.isoformat() for d in dates),
+        is_weekend=tuple(d.weekday() >= 5 for d in dates),
+        holidays=frozenset(d for d in holidays if dates[0] <= d <= dates[-1]),
+    )
+    with _lock:
+        if generation == _generation:
+            _calendars[season] = calendar
+    return calendar
+
+
+def invalidate_holidays() -> None:
+    """Kaldes når helligdage oprettes/slettes. Datoskabelonerne beholdes."""
+    global _holidays, _generation
+    with _lock:
+        _generation += 1
+        _holidays = None
+        _calendars.clear()
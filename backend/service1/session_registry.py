@@ -0,0 +1,30 @@
+"""
+session_registry.py
+
+Låse for registrering af relæ-agenter i terminal og remote desktop.
+
+Begge routere beskyttede AGENTS/CLIENTS/BROWSERS med én global
+asyncio.Lock, så registrering på én kiosk ventede på alle andre. Nu:
+
+- ShardedLocks: en fast mængde låse valgt ud fra nøglen (client_id eller
+  (client_id, mode)). Urelaterede kiosker deler kun lås ved hash-kollision,
+  og antallet af låse vokser ikke med antallet af klienter.
+- Browser-registrene er almindelige dicts uden lås: tilføj/fjern er
+  synkrone og dermed atomare på event-loopet. Opslag pr. klient (fx antal
+  viewers) går via relay_bus.presence_in_group, der også ser andre workers.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Hashable
+
+_DEFAULT_SHARDS = 64
+
+
+class ShardedLocks:
+    def __init__(self, shards: int = _DEFAULT_SHARDS):
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+
+    def lock(self, key: Hashable) -> asyncio.Lock:
+        return self._locks[hash(key) % len(self._locks)]
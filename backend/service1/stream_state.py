@@ -0,0 +1,151 @@
+"""
+stream_state.py
+
+Live-tilstand pr. livestream-klient til /hls/{id}/health, last-segment-info og
+det samlede GET /hls/health.
+
+Endpointsene åbnede tidligere index.m3u8, kaldte exists/getsize for hvert
+segment i manifestet og parsede EXT-X-PROGRAM-DATE-TIME, og frontend poller
+dem hvert sekund pr. viewer. Nu opdaterer upload og _write_manifest et
+StreamState-objekt, og opslag er O(1):
+
+- record_upload(): seneste seq, captured_at, bitrate og upload-interval
+  (glidende gennemsnit),
+- record_manifest(): segmenterne der står i manifestet lige nu.
+
+Efter genstart seedes tilstanden fra segment-indekset (se routers/livestream.py).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from hls_segments import SegmentInfo
+
+# Vægt på nyeste måling i de glidende gennemsnit.
+_EWMA_ALPHA = 0.3
+
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def _ewma(current: Optional[float], sample: float) -> float:
+    return sample if current is None else current + _EWMA_ALPHA * (sample - current)
+
+
+@dataclass
+class StreamState:
+    client_id: str
+    last_seq: int = -1
+    last_segment: Optional[str] = None
+    last_captured_at: Optional[datetime] = None
+    last_upload_at: Optional[float] = None
+    uploads: int = 0
+    bitrate_bps: Optional[float] = None
+    upload_interval_s: Optional[float] = None
+    manifest_latest: Optional[SegmentInfo] = None
+    manifest_segment_count: int = 0
+    target_duration: Optional[int] = None
+
+    def age_seconds(self, now: Optional[float] = None) -> Optional[float]:
+        if self.manifest_latest is None:
+            return None
+        return (now or time.time()) - self.manifest_latest.mtime
+
+    def health(self, stale_seconds: int, now: Optional[float] = None) -> dict:
+        latest = self.manifest_latest
+        if latest is None:
+            return {
+                "online": True,
+                "has_segments": False,
+                "is_stale": False,
+                "last_update": None,
+                "segment_count": 0,
+                "manifest_segment_count": self.manifest_segment_count,
+                "message": "Manifest findes, men segmentfiler mangler",
+            }
+        age = self.age_seconds(now)
+        is_stale = age > stale_seconds
+        return {
+            "online": True,
+            "has_segments": True,
+            "is_stale": is_stale,
+            "last_update": _iso(datetime.fromtimestamp(latest.mtime, tz=timezone.utc)),
+            "age_seconds": round(age, 2),
+            "segment_count": self.manifest_segment_count,
+            "manifest_segment_count": self.manifest_segment_count,
+            "latest_segment": latest.filename,
+            "target_duration": self.target_duration,
+            "bitrate_kbps": round(self.bitrate_bps / 1000, 1) if self.bitrate_bps else None,
+            "upload_interval_seconds": round(self.upload_interval_s, 2) if self.upload_interval_s else None,
+            "message": "Stream er forældet — klienten svarer ikke" if is_stale else "Stream er aktiv",
+        }
+
+    def last_segment_info(self) -> dict:
+        latest = self.manifest_latest
+        if latest is None:
+            return {"error": "no segments", "is_healthy": False}
+        dt = latest.program_date
+        return {
+            "segment":       latest.filename,
+            "timestamp":     _iso(dt),
+            "epoch":         dt.timestamp(),
+            "segment_count": self.manifest_segment_count,
+            "is_healthy":    True,
+        }
+
+
+class StreamStates:
+    def __init__(self):
+        self._states: Dict[str, StreamState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, client_id: str) -> StreamState:
+        state = self._states.get(client_id)
+        if state is None:
+            state = self._states[client_id] = StreamState(client_id)
+        return state
+
+    def record_upload(self, client_id: str, info: SegmentInfo) -> None:
+        with self._lock:
+            state = self._state(client_id)
+            if state.last_upload_at is not None and info.mtime > state.last_upload_at:
+                state.upload_interval_s = _ewma(state.upload_interval_s, info.mtime - state.last_upload_at)
+            state.bitrate_bps = _ewma(state.bitrate_bps, info.size * 8 / max(info.duration, 1))
+            state.last_upload_at = info.mtime
+            state.uploads += 1
+            if info.seq >= state.last_seq:
+                state.last_seq = info.seq
+                state.last_segment = info.filename
+                state.last_captured_at = info.captured_at
+
+    def record_manifest(self, client_id: str, segments: List[SegmentInfo], target_duration: int) -> None:
+        with self._lock:
+            state = self._state(client_id)
+            state.manifest_latest = segments[-1] if segments else None
+            state.manifest_segment_count = len(segments)
+            state.target_duration = target_duration
+
+    def health(self, client_id: str, stale_seconds: int, now: Optional[float] = None) -> Optional[dict]:
+        """None hvis klienten ikke er set siden genstart/reset."""
+        with self._lock:
+            state = self._states.get(client_id)
+            return state.health(stale_seconds, now) if state is not None else None
+
+    def last_segment_info(self, client_id: str) -> Optional[dict]:
+        with self._lock:
+            state = self._states.get(client_id)
+            return state.last_segment_info() if state is not None else None
+
+    def drop(self, client_id: str) -> None:
+        with self._lock:
+            self._states.pop(client_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._states), "uploads": sum(s.uploads for s in self._states.values())}
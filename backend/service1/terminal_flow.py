@@ -0,0 +1,292 @@
+"""
+terminal_flow.py
+
+Samling af output og flow control for remote terminal.
+
+Tidligere blev hver output-besked fra agenten sendt videre til browseren som
+sin egen JSON-frame, direkte fra agentens modtageløkke. `cat` af en stor log
+blev til tusindvis af små frames, og serveren bufrede ubegrænset, hvis
+browseren ikke fulgte med. Pr. browser-session er der nu en TerminalFlow:
+
+- output-bidder med samme request_id og stream samles, indtil
+  TERMINAL_COALESCE_MS er gået eller TERMINAL_COALESCE_BYTES er nået,
+- ack-vindue: hver output-frame har "size"; browseren svarer
+  {"type": "ack", "bytes": size}. Der sendes ikke mere output, mens
+  TERMINAL_WINDOW_BYTES er uden ack (kun browsere der forbinder med flow=1;
+  ældre browsere får samlet output uden vindue),
+- når bufferen når TERMINAL_HIGH_WATER_BYTES, sendes {"type": "flow",
+  "action": "pause"} til agenten, og "resume" når den er under
+  TERMINAL_LOW_WATER_BYTES,
+- TERMINAL_BUFFER_MAX_BYTES er et hårdt loft: ignorerer agenten pause,
+  kasseres det ældste ventende output og erstattes af en markør.
+
+Andre beskeder (started/exit/error/status) leveres tabsfrit og i rækkefølge
+med output. De tæller mod WS_CONTROL_QUEUE_MAX som i ws_send_queue.py;
+løber de fuld, lukkes forbindelsen i stedet for at hukommelsen vokser.
+
+Pause/resume sendes til agenten af én flow-task, i den rækkefølge de blev
+besluttet, og med det request_id der gjaldt da. En pause kan derfor aldrig
+nå agenten efter den resume der ophævede den.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from db import _env_int
+from ws_send_queue import WS_CONTROL_QUEUE_MAX
+
+TERMINAL_COALESCE_MS = _env_int("TERMINAL_COALESCE_MS", 15, min_value=0)
+TERMINAL_COALESCE_BYTES = _env_int("TERMINAL_COALESCE_BYTES", 32 * 1024, min_value=1024)
+TERMINAL_WINDOW_BYTES = _env_int("TERMINAL_WINDOW_BYTES", 256 * 1024, min_value=16 * 1024)
+TERMINAL_HIGH_WATER_BYTES = _env_int("TERMINAL_HIGH_WATER_BYTES", 512 * 1024, min_value=32 * 1024)
+TERMINAL_LOW_WATER_BYTES = _env_int("TERMINAL_LOW_WATER_BYTES", 128 * 1024, min_value=0)
+TERMINAL_BUFFER_MAX_BYTES = _env_int("TERMINAL_BUFFER_MAX_BYTES", 2 * 1024 * 1024, min_value=64 * 1024)
+
+# (request_id, pause) -> send flow-besked til agenten
+FlowCallback = Callable[[Optional[str], bool], Awaitable[None]]
+
+
+@dataclass
+class _Output:
+    request_id: Optional[str]
+    stream: Optional[str]
+    session_id: Optional[str]
+    chunks: List[str] = field(default_factory=list)
+    size: int = 0
+    created: float = field(default_factory=time.monotonic)
+
+    def add(self, data: str) -> None:
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def message(self) -> Dict[str, Any]:
+        return {
+            "type": "output",
+            "session_id": self.session_id,
+            "request_id": self.request_id,
+            "stream": self.stream,
+            "data": "".join(self.chunks),
+            "size": self.size,
+        }
+
+
+class TerminalFlow:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_flow: FlowCallback,
+        windowed: bool,
+        coalesce_ms: int = TERMINAL_COALESCE_MS,
+        coalesce_bytes: int = TERMINAL_COALESCE_BYTES,
+        window_bytes: int = TERMINAL_WINDOW_BYTES,
+        high_water: int = TERMINAL_HIGH_WATER_BYTES,
+        low_water: int = TERMINAL_LOW_WATER_BYTES,
+        buffer_max: int = TERMINAL_BUFFER_MAX_BYTES,
+        control_max: int = WS_CONTROL_QUEUE_MAX,
+    ):
+        self.websocket = websocket
+        self._on_flow = on_flow
+        self.windowed = windowed
+        self.coalesce_s = coalesce_ms / 1000
+        self.coalesce_bytes = coalesce_bytes
+        self.window_bytes = window_bytes
+        self.high_water = high_water
+        self.low_water = min(low_water, high_water)
+        self.buffer_max = max(buffer_max, high_water)
+        self.control_max = control_max
+        self._pending: Deque[_Output | Dict[str, Any]] = deque()
+        self._pending_bytes = 0
+        self._pending_control = 0
+        self._unacked = 0
+        self._paused: Optional[str] = None  # request_id der er sat på pause
+        # (request_id, pause) i den rækkefølge de er besluttet; sendes af _flow_task.
+        self._flow_out: asyncio.Queue[Tuple[Optional[str], bool]] = asyncio.Queue()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flow_task: Optional[asyncio.Task] = None
+        # Loopet holder kun svage referencer til tasks; hold dem her til de er færdige.
+        self._background: Set[asyncio.Task] = set()
+        self.closed = False
+        self.stats_counters = {
+            "chunks_in": 0,
+            "frames_out": 0,
+            "bytes_out": 0,
+            "bytes_dropped": 0,
+            "pauses": 0,
+            "window_stalls": 0,
+            "control_overflow": 0,
+        }
+
+    # -- livscyklus -------------------------------------------------------------
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._writer())
+        self._flow_task = asyncio.create_task(self._flow_sender())
+
+    async def close(self) -> None:
+        self.closed = True
+        self._wake.set()
+        for task in (self._task, self._flow_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = self._flow_task = None
+        if self._paused is not None:
+            # Agenten må ikke blive hængende på pause for en lukket browser.
+            request_id, self._paused = self._paused, None
+            await self._send_flow(request_id, False)
+
+    # -- input -----------------------------------------------------------------
+    def put(self, msg: Dict[str, Any]) -> bool:
+        """False (og lukning) hvis for mange ikke-output-beskeder venter."""
+        if self.closed:
+            return False
+        if msg.get("type") != "output":
+            if self._pending_control >= self.control_max:
+                self.stats_counters["control_overflow"] += 1
+                print(f"[TERMINAL] Kontrol-kø fuld ({self.control_max}) — lukker browser-forbindelsen", flush=True)
+                self.closed = True
+                self._wake.set()
+                self._spawn(self._close_socket())
+                return False
+            self._pending.append(msg)
+            self._pending_control += 1
+            self._wake.set()
+            return True
+
+        data = str(msg.get("data") or "")
+        self.stats_counters["chunks_in"] += 1
+        last = self._pending[-1] if self._pending else None
+        if (
+            isinstance(last, _Output)
+            and last.request_id == msg.get("request_id")
+            and last.stream == msg.get("stream")
+            and last.size < self.coalesce_bytes
+        ):
+            last.add(data)
+        else:
+            out = _Output(msg.get("request_id"), msg.get("stream"), msg.get("session_id"))
+            out.add(data)
+            self._pending.append(out)
+        self._pending_bytes += len(data)
+
+        if self._pending_bytes > self.buffer_max:
+            self._drop_oldest_output()
+        if self._pending_bytes >= self.high_water and self._paused is None:
+            self._paused = msg.get("request_id") or ""
+            self.stats_counters["pauses"] += 1
+            self._flow_out.put_nowait((self._paused, True))
+        self._wake.set()
+        return True
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def ack(self, nbytes: int) -> None:
+        self._unacked = max(0, self._unacked - max(0, int(nbytes)))
+        self._wake.set()
+
+    def _drop_oldest_output(self) -> None:
+        dropped = 0
+        for item in self._pending:
+            if self._pending_bytes - dropped <= self.high_water:
+                break
+            if isinstance(item, _Output) and item.size:
+                dropped += item.size
+                item.chunks = []
+                item.size = 0
+        if not dropped:
+            return
+        self._pending_bytes -= dropped
+        self.stats_counters["bytes_dropped"] += dropped
+        marker = f"\n[... {dropped} tegn output udeladt — browseren fulgte ikke med ...]\n"
+        for item in self._pending:
+            if isinstance(item, _Output) and not item.chunks:
+                item.add(marker)
+                self._pending_bytes += len(marker)
+                break
+
+    # -- writer ----------------------------------------------------------------
+    def _resume(self) -> None:
+        request_id, self._paused = self._paused, None
+        self._flow_out.put_nowait((request_id, False))
+
+    async def _send_flow(self, request_id: Optional[str], pause: bool) -> None:
+        try:
+            await self._on_flow(request_id or None, pause)
+        except Exception:
+            pass
+
+    async def _flow_sender(self) -> None:
+        while True:
+            request_id, pause = await self._flow_out.get()
+            await self._send_flow(request_id, pause)
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close(code=1013, reason="Browseren følger ikke med")
+        except Exception:
+            pass
+
+    def _window_open(self) -> bool:
+        return not self.windowed or self._unacked < self.window_bytes
+
+    async def _writer(self) -> None:
+        while not self.closed:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending and not self.closed:
+                head = self._pending[0]
+                if isinstance(head, _Output):
+                    wait = head.created + self.coalesce_s - time.monotonic()
+                    if wait > 0 and head.size < self.coalesce_bytes and len(self._pending) == 1:
+                        # Giv flere bidder en chance for at blive samlet.
+                        await asyncio.sleep(wait)
+                        continue
+                    if not self._window_open():
+                        self.stats_counters["window_stalls"] += 1
+                        break
+                    self._pending.popleft()
+                    self._pending_bytes -= head.size
+                    if head.size:
+                        await self._send(head.message())
+                        self._unacked += head.size
+                        self.stats_counters["bytes_out"] += head.size
+                else:
+                    self._pending.popleft()
+                    self._pending_control -= 1
+                    await self._send(head)
+                if self._paused is not None and self._pending_bytes <= self.low_water:
+                    self._resume()
+
+    async def _send(self, msg: Dict[str, Any]) -> None:
+        try:
+            await self.websocket.send_text(json.dumps(msg, ensure_ascii=False))
+            self.stats_counters["frames_out"] += 1
+        except Exception:
+            # Socket lukket; modtageløkken rydder op.
+            self.closed = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "windowed": self.windowed,
+            "pending_bytes": self._pending_bytes,
+            "pending_messages": len(self._pending),
+            "pending_control": self._pending_control,
+            "unacked_bytes": self._unacked,
+            "paused": self._paused is not None,
+            **self.stats_counters,
+        }
@@ -0,0 +1,121 @@
+"""
+terminal_scrollback.py
+
+Scrollback pr. terminal (client_id, mode).
+
+En browser der åbner terminalen (eller genforbinder efter et netværksudfald)
+så intet, før der kom nyt output, og måtte køre kommandoer igen på kiosken.
+Den worker der har agenten, gemmer nu de seneste
+TERMINAL_SCROLLBACK_BYTES bytes (UTF-8) af terminalens forløb (kommandoer,
+output, exit-koder) i en ring, som sendes i én "scrollback"-frame når en
+browser forbinder.
+
+Ringen er begrænset i bytes, ikke i antal beskeder: de ældste bidder
+fjernes, og den ældste bid afkortes til sin hale, hvis kun en del af den
+skal væk (fx efter at text() har samlet ringen til én bid).
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from db import _env_int
+
+TERMINAL_SCROLLBACK_BYTES = _env_int("TERMINAL_SCROLLBACK_BYTES", 64 * 1024, min_value=0)
+
+
+def _utf8_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _utf8_tail(text: str, nbytes: int) -> str:
+    """De sidste højst nbytes bytes; et afskåret multibyte-tegn udelades."""
+    return text.encode("utf-8")[-nbytes:].decode("utf-8", errors="ignore") if nbytes > 0 else ""
+
+
+class ScrollbackRing:
+    def __init__(self, max_bytes: int = TERMINAL_SCROLLBACK_BYTES):
+        self.max_bytes = max_bytes
+        self._chunks: Deque[str] = deque()
+        self._size = 0  # bytes (UTF-8)
+        self.truncated = False
+
+    def append(self, text: str) -> None:
+        if not text or self.max_bytes <= 0:
+            return
+        size = _utf8_len(text)
+        if size >= self.max_bytes:
+            self._chunks.clear()
+            text = _utf8_tail(text, self.max_bytes)
+            size = _utf8_len(text)
+            self._size = 0
+            self.truncated = True
+        self._chunks.append(text)
+        self._size += size
+        while self._size > self.max_bytes:
+            self.truncated = True
+            head = self._chunks[0]
+            head_size = _utf8_len(head)
+            excess = self._size - self.max_bytes
+            if head_size <= excess:
+                self._chunks.popleft()
+                self._size -= head_size
+                continue
+            tail = _utf8_tail(head, head_size - excess)
+            self._chunks[0] = tail
+            self._size -= head_size - _utf8_len(tail)
+
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            # Saml én gang, så gentagne replays ikke joiner igen.
+            joined = "".join(self._chunks)
+            self._chunks.clear()
+            self._chunks.append(joined)
+        return self._chunks[0] if self._chunks else ""
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class TerminalScrollback:
+    def __init__(self, max_bytes: int = TERMINAL_SCROLLBACK_BYTES):
+        self.max_bytes = max_bytes
+        self._rings: Dict[Tuple[int, str], ScrollbackRing] = {}
+
+    def record(self, client_id: int, mode: str, msg: Dict[str, Any]) -> None:
+        """Gem den del af en agent-besked, som browseren ville vise."""
+        msg_type = msg.get("type")
+        if msg_type == "output":
+            text = str(msg.get("data") or "")
+        elif msg_type == "started":
+            text = f"$ {msg.get('command') or ''}\n"
+        elif msg_type == "exit":
+            text = f"[exit {msg.get('code')}]\n"
+        elif msg_type == "error":
+            text = f"[FEJL] {msg.get('message') or ''}\n"
+        else:
+            return
+        key = (client_id, mode)
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = ScrollbackRing(self.max_bytes)
+        ring.append(text)
+
+    def replay_message(self, client_id: int, mode: str) -> Optional[Dict[str, Any]]:
+        ring = self._rings.get((client_id, mode))
+        if ring is None or not len(ring):
+            return None
+        return {
+            "type": "scrollback",
+            "mode": mode,
+            "data": ring.text(),
+            "truncated": ring.truncated,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "terminals": len(self._rings),
+            "bytes": sum(len(r) for r in self._rings.values()),
+            "max_bytes_per_terminal": self.max_bytes,
+        }
@@ -0,0 +1,199 @@
+"""
+ws_send_queue.py
+
+Udgående kø med egen writer-task pr. WebSocket.
+
+Relæerne (remote desktop) sendte direkte til browserens socket fra agentens
+modtageløkke. Én langsom browser stoppede dermed agentens løkke og alle
+andre viewers. Nu lægger relæet beskeden i browserens kø og fortsætter:
+
+- frames (video): "seneste frame vinder" — en frame der endnu ikke er sendt,
+  erstattes af den nye og tælles som droppet,
+- alt andet (status, fejl, svar på input): tabsfrit i rækkefølge. Kontrol-
+  køen er begrænset; løber den fuld, er browseren reelt død, og
+  forbindelsen lukkes i stedet for at beskeder tabes i stilhed,
+- delta-frames (tiles oven på en keyframe): kan ikke droppes enkeltvis.
+  De sendes i rækkefølge efter keyframen; en ny keyframe kasserer ventende
+  deltas. Løber delta-køen fuld, kasseres den (og efterfølgende deltas
+  indtil næste keyframe), og on_resync kaldes, så relæet kan sende en
+  frisk keyframe.
+
+Kontrolbeskeder sendes før en ventende frame.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Union
+
+from fastapi import WebSocket
+
+from db import _env_int
+
+WS_CONTROL_QUEUE_MAX = _env_int("WS_CONTROL_QUEUE_MAX", 256, min_value=16)
+WS_DELTA_QUEUE_MAX = _env_int("WS_DELTA_QUEUE_MAX", 240, min_value=8)
+
+Message = Union[Dict[str, Any], bytes]
+
+
+class WebSocketSendQueue:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        name: str,
+        control_max: int = WS_CONTROL_QUEUE_MAX,
+        delta_max: int = WS_DELTA_QUEUE_MAX,
+        on_resync: Optional[Callable[[], None]] = None,
+    ):
+        self.websocket = websocket
+        self.name = name
+        self.control_max = control_max
+        self.delta_max = delta_max
+        self.on_resync = on_resync
+        self._control: Deque[Message] = deque()
+        self._frame: Optional[Message] = None
+        self._deltas: Deque[Message] = deque()
+        self._awaiting_keyframe = False
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Loopet holder kun svage referencer til tasks; hold dem her til de er færdige.
+        self._background: Set[asyncio.Task] = set()
+        self.closed = False
+        self.stats_counters = {
+            "sent": 0,
+            "frames_sent": 0,
+            "frames_dropped": 0,
+            "deltas_sent": 0,
+            "deltas_dropped": 0,
+            "resyncs": 0,
+            "control_overflow": 0,
+            "max_depth": 0,
+            "send_errors": 0,
+        }
+        self._last_send_ms = 0.0
+
+    # -- livscyklus -------------------------------------------------------------
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._writer())
+
+    async def close(self) -> None:
+        self.closed = True
+        self._wake.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # -- enqueue ---------------------------------------------------------------
+    def put_frame(self, message: Message) -> None:
+        """Video-frame: erstatter en ventende frame."""
+        if self.closed:
+            return
+        if self._frame is not None:
+            self.stats_counters["frames_dropped"] += 1
+        if self._deltas:
+            # Ventende deltas hører til en ældre keyframe.
+            self.stats_counters["deltas_dropped"] += len(self._deltas)
+            self._deltas.clear()
+        self._awaiting_keyframe = False
+        self._frame = message
+        self._wake.set()
+
+    def put_delta(self, message: Message) -> None:
+        """Delta oven på seneste keyframe: tabsfri, men med loft."""
+        if self.closed:
+            return
+        if self._awaiting_keyframe:
+            self.stats_counters["deltas_dropped"] += 1
+            return
+        if len(self._deltas) >= self.delta_max:
+            self.stats_counters["deltas_dropped"] += len(self._deltas) + 1
+            self.stats_counters["resyncs"] += 1
+            self._deltas.clear()
+            self._awaiting_keyframe = True
+            if self.on_resync is not None:
+                self.on_resync()
+            return
+        self._deltas.append(message)
+        self.stats_counters["max_depth"] = max(self.stats_counters["max_depth"], self.depth)
+        self._wake.set()
+
+    def put(self, message: Message) -> bool:
+        """Tabsfri besked. False (og lukning) hvis kontrol-køen er fuld."""
+        if self.closed:
+            return False
+        if len(self._control) >= self.control_max:
+            self.stats_counters["control_overflow"] += 1
+            print(f"[WS-QUEUE] {self.name}: kontrol-kø fuld ({self.control_max}) — lukker forbindelsen", flush=True)
+            self.closed = True
+            self._spawn(self._close_socket())
+            return False
+        self._control.append(message)
+        self.stats_counters["max_depth"] = max(self.stats_counters["max_depth"], self.depth)
+        self._wake.set()
+        return True
+
+    @property
+    def depth(self) -> int:
+        return len(self._control) + len(self._deltas) + (1 if self._frame is not None else 0)
+
+    # -- writer ----------------------------------------------------------------
+    async def _send(self, message: Message) -> None:
+        started = time.perf_counter()
+        if isinstance(message, bytes):
+            await self.websocket.send_bytes(message)
+        else:
+            await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+        self._last_send_ms = (time.perf_counter() - started) * 1000
+        self.stats_counters["sent"] += 1
+
+    async def _writer(self) -> None:
+        while not self.closed:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                while self._control or self._frame is not None or self._deltas:
+                    if self._control:
+                        await self._send(self._control.popleft())
+                        continue
+                    if self._frame is not None:
+                        frame, self._frame = self._frame, None
+                        await self._send(frame)
+                        self.stats_counters["frames_sent"] += 1
+                        continue
+                    await self._send(self._deltas.popleft())
+                    self.stats_counters["deltas_sent"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Socket lukket; modtageløkken rydder op.
+                self.stats_counters["send_errors"] += 1
+                self.closed = True
+                return
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close(code=1013, reason="Browseren følger ikke med")
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "control_depth": len(self._control),
+            "frame_pending": self._frame is not None,
+            "delta_depth": len(self._deltas),
+            "last_send_ms": round(self._last_send_ms, 2),
+            **self.stats_counters,
+        }
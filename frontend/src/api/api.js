@@ -57,6 +57,8 @@ export function getTerminalBrowserWsUrl(clientId, mode = "user") {
   const token = getAuthToken();
   const params = new URLSearchParams();
   params.set("mode", mode === "admin" ? "admin" : "user");
+  // Browseren kvitterer output med {"type": "ack"} (ack-vindue i backend).
+  params.set("flow", "1");
   if (token) params.set("token", token);
   return `${getWsApiUrl()}/api/terminal/browser/${encodeURIComponent(clientId)}/ws?${params.toString()}`;
 }
@@ -100,8 +102,10 @@ export async function logout() {
 // Klienter
 // ---------------------------------------------------------------------------
 
+// Listevisninger bruger view=list: backend returnerer kun de felter listerne
+// viser (ClientListItem) i stedet for alle diagnostik-/display-felter.
 export async function getClients() {
-  const res = await fetch(`${apiUrl}/api/clients/`, {
+  const res = await fetch(`${apiUrl}/api/clients/?view=list`, {
     headers: authHeaders(),
     credentials: "include",
   });
@@ -111,7 +115,7 @@ export async function getClients() {
 }
 
 export async function getMyClients() {
-  const res = await fetch(`${apiUrl}/api/clients/me`, {
+  const res = await fetch(`${apiUrl}/api/clients/me?view=list`, {
     headers: authHeaders(),
     credentials: "include",
   });
@@ -120,6 +124,18 @@ export async function getMyClients() {
   return res.json();
 }
 
+// Online/offline/sleeping-tællinger pr. skole (én grupperet query i backend).
+export async function getClientsSummary(schoolId) {
+  const query = schoolId != null ? `?school_id=${encodeURIComponent(schoolId)}` : "";
+  const res = await fetch(`${apiUrl}/api/clients/summary${query}`, {
+    headers: authHeaders(),
+    credentials: "include",
+  });
+  if (res.status === 401) { handle401(); throw new Error("Login udløbet"); }
+  if (!res.ok) throw new Error(await extractError(res, "Kunne ikke hente klientoversigt"));
+  return res.json();
+}
+
 export async function getClientsPublic() {
   const res = await fetch(`${apiUrl}/api/clients/public`);
   if (!res.ok) throw new Error(await extractError(res, "Kunne ikke hente klienter"));
@@ -193,6 +209,52 @@ export async function getChromeStatus(id, { fallbackToClient = false } = {}) {
   return json;
 }
 
+/**
+ * Abonnér på chrome-status via Server-Sent Events i stedet for polling.
+ * Backend sender først et "snapshot" og derefter kun ændrede felter ("change").
+ * onData kaldes altid med den samlede (flettede) status.
+ * @param {number|string} id - Klient ID
+ * @param {(data: object) => void} onData
+ * @param {(err: Event) => void} [onError] - kaldes hvis strømmen fejler før første snapshot
+ * @returns {() => void} luk-funktion
+ */
+export function subscribeChromeStatus(id, onData, onError) {
+  if (typeof window === "undefined" || typeof window.EventSource === "undefined") {
+    onError?.(new Error("EventSource understøttes ikke"));
+    return () => {};
+  }
+  const source = new EventSource(`${apiUrl}/api/clients/${id}/chrome-status/stream`, {
+    withCredentials: true,
+  });
+  let state = null;
+
+  source.addEventListener("snapshot", (event) => {
+    try {
+      state = JSON.parse(event.data);
+      onData(state);
+    } catch {
+      // Ignorer ugyldigt event
+    }
+  });
+  source.addEventListener("change", (event) => {
+    try {
+      state = { ...(state || {}), ...JSON.parse(event.data) };
+      onData(state);
+    } catch {
+      // Ignorer ugyldigt event
+    }
+  });
+  source.onerror = (err) => {
+    // EventSource genforbinder selv; fald kun tilbage hvis vi aldrig fik data.
+    if (state == null) {
+      source.close();
+      onError?.(err);
+    }
+  };
+
+  return () => source.close();
+}
+
 export async function updateClient(id, updates) {
   const res = await fetch(`${apiUrl}/api/clients/${id}/update`, {
     method: "PUT",
@@ -387,6 +449,20 @@ export async function saveMarkedDays(payload) {
   return res.json();
 }
 
+// Kalenderen leveres til klienterne i baggrunden efter gem; her hentes
+// seneste leveringsstatus (queued/sending/retrying/delivered/failed/skipped).
+export async function getCalendarPublishStatus(clientIds) {
+  const params = new URLSearchParams();
+  (clientIds || []).forEach((id) => params.append("client_ids", String(id)));
+  const res = await fetch(`${apiUrl}/api/calendar/publish-status?${params.toString()}`, {
+    headers: authHeaders(),
+    credentials: "include",
+  });
+  if (res.status === 401) { handle401(); throw new Error("Login udløbet"); }
+  if (!res.ok) throw new Error(await extractError(res, "Kunne ikke hente leveringsstatus"));
+  return res.json();
+}
+
 /**
  * Hent markerede dage for en klient i en sæson.
  *
@@ -675,6 +751,20 @@ export async function stopLivestream(clientId) {
   return res.json();
 }
 
+// HLS-health for flere klienter i ét kald: { clients: { "<id>": {...} } }.
+export async function getHlsHealthBatch(clientIds) {
+  const params = new URLSearchParams();
+  (clientIds || []).forEach((id) => params.append("client_ids", String(id)));
+  const res = await fetch(`${apiUrl}/api/hls/health?${params.toString()}`, {
+    headers: authHeaders(),
+    credentials: "include",
+  });
+  if (res.status === 401) { handle401(); throw new Error("Login udløbet"); }
+  if (!res.ok)
+    throw new Error(await extractError(res, "Kunne ikke hente stream-status"));
+  return res.json();
+}
+
 // ---------------------------------------------------------------------------
 // Installationskoder / Enrollment tokens
 // ---------------------------------------------------------------------------
@@ -362,6 +362,7 @@ export default function ClientDetailsLivestreamSection({
   const hlsRef   = useRef(null);
 
   const [serverReady, setServerReady]           = useState(false);
+  const [lowLatency, setLowLatency]             = useState(false);
   const [manifestReady, setManifestReady]       = useState(false);
   const [error, setError]                       = useState("");
   const [buffering, setBuffering]               = useState(false);
@@ -533,6 +534,7 @@ export default function ClientDetailsLivestreamSection({
             const data = await resp.json();
             if (data.has_segments && !data.is_stale) {
               if (!stop) {
+                setLowLatency(Boolean(data.low_latency));
                 setServerReady(true);
                 setStreamStale(false);
                 setAutoStartStatus("");
@@ -580,17 +582,22 @@ export default function ClientDetailsLivestreamSection({
     hlsParams.set("_ts", String(Date.now()));
     if (token) hlsParams.set("token", token);
 
-    const hlsUrl = `${apiUrl}/hls/${clientId}/index.m3u8?${hlsParams.toString()}`;
+    // LL-HLS-playlisten kræver at kiosken uploader delsegmenter (se health.low_latency).
+    const hlsUrl = lowLatency
+      ? `${apiUrl}/api/hls/${clientId}/ll/index.m3u8?${hlsParams.toString()}`
+      : `${apiUrl}/hls/${clientId}/index.m3u8?${hlsParams.toString()}`;
 
     let fatalErrorTimeout = null;
     let playTimeout       = null;
 
     if (Hls.isSupported()) {
       const hls = new Hls({
-        // Vi bruger almindelig HLS med korte segmenter, ikke LL-HLS.
-        // liveSyncDuration holder browseren tættere på live edge end den gamle 3x8s-buffer.
-        liveSyncDuration:             HLS_LIVE_SYNC_SECONDS,
-        liveMaxLatencyDuration:       HLS_MAX_LATENCY_SECONDS,
+        // Almindelig HLS: liveSyncDuration holder browseren tættere på live edge
+        // end den gamle 3x8s-buffer. I LL-HLS styrer PART-HOLD-BACK fra playlisten.
+        ...(lowLatency ? {} : {
+          liveSyncDuration:           HLS_LIVE_SYNC_SECONDS,
+          liveMaxLatencyDuration:     HLS_MAX_LATENCY_SECONDS,
+        }),
         initialLiveManifestSize:      1,
         maxBufferLength:              6,
         maxMaxBufferLength:           10,
@@ -599,7 +606,7 @@ export default function ClientDetailsLivestreamSection({
         maxLiveSyncPlaybackRate:      1.25,
         enableWorker:                 true,
         startLevel:                   -1,
-        lowLatencyMode:               false,
+        lowLatencyMode:               lowLatency,
         forceKeyFrameOnDiscontinuity: false,
         manifestLoadingTimeOut:       5000,
         manifestLoadingMaxRetry:      4,
@@ -695,7 +702,7 @@ export default function ClientDetailsLivestreamSection({
       };
     }
     // eslint-disable-next-line
-  }, [clientId, effectiveRefreshKey, clientOnline, serverReady]);
+  }, [clientId, effectiveRefreshKey, clientOnline, serverReady, lowLatency]);
 
   // -------------------------------------------------------------------------
   // Backend polling — hvert 2s
@@ -11,6 +11,7 @@ import ClientTerminalDialog from "./terminal/ClientTerminalDialog";
 
 import {
   getChromeStatus,
+  subscribeChromeStatus,
   clientAction,
   openRemoteDesktop,
   getClient,
@@ -259,10 +260,41 @@ export default function ClientDetailsPage({
   }, [client?.id]);
 
   // ---------------------------------------------------------------------------
-  // Chrome-status polling — hvert 1s
+  // Chrome-status — push via SSE, fallback til polling hvert 1s
   // ---------------------------------------------------------------------------
   const mountedRef = useRef(true);
 
+  const applyChromeStatus = useCallback((data) => {
+    if (data?.chrome_status != null) setLiveChromeStatus(data.chrome_status);
+    if (data?.chrome_color != null)  setLiveChromeColor(data.chrome_color);
+    if (data?.last_seen != null)     setLastSeen(data.last_seen);
+    if (data?.pending_chrome_action != null) {
+      const pca = String(data.pending_chrome_action || "none").toLowerCase();
+      setLocalPendingAction(pca || "none");
+    }
+    if (data?.state) setLocalClientState(data.state);
+    if (typeof data?.isOnline === "boolean") {
+      setLiveClientOnline(data.isOnline);
+    } else if (typeof data?.is_online === "boolean") {
+      setLiveClientOnline(data.is_online);
+    }
+
+    const stepName      = data?.step?.step ?? null;
+    const stepTimestamp = data?.step?.timestamp ?? null;
+    setLiveStep(stepName);
+    liveStepRef.current          = stepName;
+    liveStepTimestampRef.current = stepTimestamp;
+
+    if (data?.uptime != null) {
+      const parsed = parseInt(String(data.uptime), 10);
+      if (!isNaN(parsed) && parsed >= 0) {
+        uptimeBaseRef.current  = parsed;
+        uptimeFetchRef.current = Date.now();
+        setUptime(parsed);
+      }
+    }
+  }, []);
+
   useEffect(() => {
     if (!client?.id) return;
     mountedRef.current = true;
@@ -273,35 +305,7 @@ export default function ClientDetailsPage({
         try {
           const data = await getChromeStatus(client.id, { fallbackToClient: true });
           if (cancelled || !mountedRef.current) break;
-
-          if (data?.chrome_status != null) setLiveChromeStatus(data.chrome_status);
-          if (data?.chrome_color != null)  setLiveChromeColor(data.chrome_color);
-          if (data?.last_seen != null)     setLastSeen(data.last_seen);
-          if (data?.pending_chrome_action != null) {
-            const pca = String(data.pending_chrome_action || "none").toLowerCase();
-            setLocalPendingAction(pca || "none");
-          }
-          if (data?.state) setLocalClientState(data.state);
-          if (typeof data?.isOnline === "boolean") {
-            setLiveClientOnline(data.isOnline);
-          } else if (typeof data?.is_online === "boolean") {
-            setLiveClientOnline(data.is_online);
-          }
-
-          const stepName      = data?.step?.step ?? null;
-          const stepTimestamp = data?.step?.timestamp ?? null;
-          setLiveStep(stepName);
-          liveStepRef.current          = stepName;
-          liveStepTimestampRef.current = stepTimestamp;
-
-          if (data?.uptime != null) {
-            const parsed = parseInt(String(data.uptime), 10);
-            if (!isNaN(parsed) && parsed >= 0) {
-              uptimeBaseRef.current  = parsed;
-              uptimeFetchRef.current = Date.now();
-              setUptime(parsed);
-            }
-          }
+          applyChromeStatus(data);
         } catch {
           // Ignorer poll-fejl
         }
@@ -309,9 +313,21 @@ export default function ClientDetailsPage({
       }
     }
 
-    poll();
-    return () => { cancelled = true; };
-  }, [client?.id]);
+    const unsubscribe = subscribeChromeStatus(
+      client.id,
+      (data) => {
+        if (!cancelled && mountedRef.current) applyChromeStatus(data);
+      },
+      () => {
+        if (!cancelled) poll();
+      },
+    );
+
+    return () => {
+      cancelled = true;
+      unsubscribe();
+    };
+  }, [client?.id, applyChromeStatus]);
 
   // ---------------------------------------------------------------------------
   // Cleanup ved unmount
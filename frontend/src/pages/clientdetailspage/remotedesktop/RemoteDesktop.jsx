@@ -41,6 +41,29 @@ function clamp(n, min, max) {
   return Math.max(min, Math.min(max, n));
 }
 
+// Binær frame fra agenten (backend/service1/remote_desktop_frames.py):
+// version u8, type u8, session_id 16 bytes, seq u32, x/y/width/height u16, data.
+// FRAME_JPEG er hele skærmen (keyframe), FRAME_TILE et ændret område oven på den.
+const FRAME_VERSION = 1;
+const FRAME_JPEG = 1;
+const FRAME_TILE = 2;
+const FRAME_HEADER_SIZE = 30;
+
+function parseBinaryFrame(buffer) {
+  if (buffer.byteLength < FRAME_HEADER_SIZE) return null;
+  const view = new DataView(buffer);
+  if (view.getUint8(0) !== FRAME_VERSION) return null;
+  return {
+    type: view.getUint8(1),
+    seq: view.getUint32(18),
+    x: view.getUint16(22),
+    y: view.getUint16(24),
+    width: view.getUint16(26),
+    height: view.getUint16(28),
+    payload: new Uint8Array(buffer, FRAME_HEADER_SIZE),
+  };
+}
+
 export default function RemoteDesktop() {
   const { clientId } = useParams();
 
@@ -51,6 +74,12 @@ export default function RemoteDesktop() {
   const containerRef = useRef(null);
   const mouseDownRef = useRef(false);
   const lastMouseMoveSentRef = useRef(0);
+  const frameUrlRef = useRef(null);
+  // Tiles tegnes oven på keyframen i et canvas uden for DOM'en.
+  const canvasRef = useRef(null);
+  const hasKeyframeRef = useRef(false);
+  const drawChainRef = useRef(Promise.resolve());
+  const drawPendingRef = useRef(0);
 
   const [connected, setConnected] = useState(false);
   const [agentConnected, setAgentConnected] = useState(false);
@@ -91,14 +120,57 @@ export default function RemoteDesktop() {
     return true;
   }, []);
 
+  // binary: agenten må sende frames som binære WebSocket-frames (se parseBinaryFrame).
   const startStream = useCallback(() => {
-    send({ type: "start_stream" });
+    send({ type: "start_stream", binary: true });
   }, [send]);
 
   const stopStream = useCallback(() => {
     send({ type: "stop_stream" });
   }, [send]);
 
+  // Binære frames vises via object URLs; den forrige frigives.
+  const showFrame = useCallback((blob) => {
+    if (frameUrlRef.current) {
+      URL.revokeObjectURL(frameUrlRef.current);
+      frameUrlRef.current = null;
+    }
+    if (!blob) return;
+    frameUrlRef.current = URL.createObjectURL(blob);
+    setFrameSrc(frameUrlRef.current);
+  }, []);
+
+  // Afkodning er asynkron; kæden holder keyframes og tiles i rækkefølge.
+  // Canvas'et kodes kun til et billede når der ikke venter flere tiles.
+  const drawFrame = useCallback((frame) => {
+    const blob = new Blob([frame.payload], { type: "image/jpeg" });
+    const isKeyframe = frame.type === FRAME_JPEG;
+    if (isKeyframe) showFrame(blob);
+
+    drawPendingRef.current += 1;
+    drawChainRef.current = drawChainRef.current
+      .then(async () => {
+        if (!isKeyframe && !hasKeyframeRef.current) return;
+        const bitmap = await createImageBitmap(blob);
+        if (!canvasRef.current) canvasRef.current = document.createElement("canvas");
+        const canvas = canvasRef.current;
+        if (isKeyframe) {
+          canvas.width = bitmap.width;
+          canvas.height = bitmap.height;
+          hasKeyframeRef.current = true;
+        }
+        canvas.getContext("2d").drawImage(bitmap, isKeyframe ? 0 : frame.x, isKeyframe ? 0 : frame.y);
+        bitmap.close();
+        if (isKeyframe || drawPendingRef.current > 1) return;
+        const composed = await new Promise((resolve) => canvas.toBlob(resolve, "image/jpeg", 0.9));
+        if (composed) showFrame(composed);
+      })
+      .catch(() => {})
+      .finally(() => {
+        drawPendingRef.current -= 1;
+      });
+  }, [showFrame]);
+
   const connect = useCallback(() => {
     if (!clientId) return;
 
@@ -112,8 +184,10 @@ export default function RemoteDesktop() {
     setStatus("Forbinder...");
     setConnected(false);
     setAgentConnected(false);
+    hasKeyframeRef.current = false;
 
     const ws = new WebSocket(getRemoteDesktopWsUrl(clientId));
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -132,6 +206,21 @@ export default function RemoteDesktop() {
     };
 
     ws.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        const frame = parseBinaryFrame(event.data);
+        if (frame?.type === FRAME_TILE) {
+          drawFrame(frame);
+          setLastFrameTs(Date.now());
+        } else if (frame?.type === FRAME_JPEG) {
+          drawFrame(frame);
+          if (frame.width && frame.height) {
+            setScreenSize({ width: frame.width, height: frame.height });
+          }
+          setLastFrameTs(Date.now());
+        }
+        return;
+      }
+
       let msg;
       try {
         msg = JSON.parse(event.data);
@@ -147,7 +236,7 @@ export default function RemoteDesktop() {
         }
         setStatus(msg.agent_connected ? "Remote desktop klar" : "Venter på klient-agent");
         if (msg.agent_connected) {
-          setTimeout(() => send({ type: "start_stream" }), 200);
+          setTimeout(() => send({ type: "start_stream", binary: true }), 200);
         }
         return;
       }
@@ -159,7 +248,7 @@ export default function RemoteDesktop() {
         }
         setStatus(msg.agent_connected ? "Klient-agent forbundet" : "Klient-agent ikke forbundet");
         if (msg.agent_connected) {
-          setTimeout(() => send({ type: "start_stream" }), 200);
+          setTimeout(() => send({ type: "start_stream", binary: true }), 200);
         }
         return;
       }
@@ -171,6 +260,9 @@ export default function RemoteDesktop() {
       }
 
       if (msg.type === "frame") {
+        // Ældre agenter sender stadig base64 i JSON.
+        showFrame(null);
+        hasKeyframeRef.current = false;
         setFrameSrc(`data:image/jpeg;base64,${msg.data}`);
         if (msg.width && msg.height) {
           setScreenSize({ width: msg.width, height: msg.height });
@@ -189,7 +281,7 @@ export default function RemoteDesktop() {
         return;
       }
     };
-  }, [clientId, send]);
+  }, [clientId, send, showFrame, drawFrame]);
 
   useEffect(() => {
     connect();
@@ -198,8 +290,9 @@ export default function RemoteDesktop() {
         wsRef.current?.send(JSON.stringify({ type: "stop_stream" }));
         wsRef.current?.close();
       } catch {}
+      showFrame(null);
     };
-  }, [connect]);
+  }, [connect, showFrame]);
 
   const frameAgeText = useMemo(() => {
     if (!lastFrameTs) return "";
@@ -215,6 +215,23 @@ export default function ClientTerminalDialog({ open, onClose, client }) {
         return;
       }
 
+      if (msg.type === "scrollback") {
+        // Terminalens seneste forløb fra backend, så man ikke skal køre kommandoer igen.
+        appendLine(
+          setLines,
+          `[${nowTime()}] Tidligere output${msg.truncated ? " (afkortet)" : ""}:`
+        );
+        String(msg.data || "")
+          .replace(/\r/g, "")
+          .split("\n")
+          .forEach((l, idx, arr) => {
+            if (idx === arr.length - 1 && l === "") return;
+            appendLine(setLines, l);
+          });
+        appendLine(setLines, `[${nowTime()}] — slut på tidligere output —`);
+        return;
+      }
+
       if (msg.type === "status") {
         appendLine(setLines, `[${nowTime()}] ${msg.message}`);
         return;
@@ -242,6 +259,12 @@ export default function ClientTerminalDialog({ open, onClose, client }) {
             if (idx === arr.length - 1 && l === "") return;
             appendLine(setLines, prefix + l);
           });
+        // Flow control: kvittér når outputtet er behandlet, så backend sender mere.
+        if (msg.size) {
+          try {
+            ws.send(JSON.stringify({ type: "ack", bytes: msg.size }));
+          } catch {}
+        }
         return;
       }
 